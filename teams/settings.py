@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.gzip.GZipMiddleware',
+    'teams_core.middleware.GzipRequestMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -73,6 +75,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'teams_core.context_processors.navbar_notifications',
             ],
         },
     },
@@ -91,6 +94,16 @@ DATABASES = {
     }
 }
 
+# A per-process cache. Entries invalidated by another process (dispatch_notifications,
+# process_ingestion_jobs, another web worker) stay until they expire, so the navbar's
+# unread summary may lag by up to TEAMS_UNREAD_CACHE_TTL. Point this at Redis or
+# Memcached to have invalidations reach every process; a longer TTL is then safe.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -138,9 +151,11 @@ REST_FRAMEWORK = {
     # or allow read-only access for unauthenticated users.
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
+        'teams_core.renderers.MessagePackRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
+        'teams_core.parsers.MessagePackParser',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
@@ -201,4 +216,26 @@ EMAIL_USE_TLS = False
 # EMAIL_HOST_PASSWORD = ''
 
 TEAMS_ADMIN_MAIL = 'athakur@cdot.in'
-TEAMS_HOST_URL = 'http://192.168.3.82/'
\ No newline at end of file
+TEAMS_HOST_URL = 'http://192.168.3.82/'
+TEAMS_INGEST_BATCH_SIZE = 1000  # Rows per statement when bulk-ingesting test executions
+TEAMS_INGEST_LEASE_TIMEOUT = 10 * 60  # Seconds an ingestion worker may go without renewing its job's lease before it is reclaimed
+TEAMS_GZIP_MAX_STREAM_SIZE = 1024 ** 3  # Decompressed bytes allowed for streamed gzip bodies (NDJSON, uploads)
+TEAMS_GZIP_MAX_BODY_SIZE = 256 * 1024 ** 2  # Decompressed bytes allowed for gzip bodies parsed in memory (JSON, MessagePack)
+TEAMS_IDEMPOTENCY_TTL = 24 * 60 * 60  # Seconds for which responses to Idempotency-Key requests are replayed
+TEAMS_IDEMPOTENCY_IN_FLIGHT_TIMEOUT = 60 * 60  # Seconds before an unfinished Idempotency-Key request counts as dead; keep it above the longest request
+# Admission control of write requests; None disables a limit. The counters and token
+# buckets live in each process, so a deployment of N web workers admits up to N times
+# these limits: divide the intended totals by the number of workers.
+TEAMS_ADMISSION_MAX_IN_FLIGHT = 8  # Concurrent writes across all users
+TEAMS_ADMISSION_MAX_IN_FLIGHT_PER_USER = 4  # Concurrent writes of one user
+TEAMS_ADMISSION_RATE = 50  # Writes per second across all users (token bucket refill rate)
+TEAMS_ADMISSION_BURST = 100
+TEAMS_ADMISSION_USER_RATE = 10  # Writes per second of one user
+TEAMS_ADMISSION_USER_BURST = 20
+TEAMS_NOTIFICATION_WORKERS = 2  # Threads sending failure notifications after commit; 0 leaves it to dispatch_notifications
+TEAMS_NOTIFICATION_MAX_ATTEMPTS = 5  # Tries before a failure event is given up
+TEAMS_NOTIFICATION_COALESCE = True  # One failure notification per recipient and test run instead of one per failure
+TEAMS_NOTIFICATION_SUMMARY_DELAY = 60  # Seconds notifications wait before send_notification_summary reports them
+TEAMS_UNREAD_CACHE_TTL = 30  # Seconds the navbar's unread notification summary is cached at most; see CACHES
+TEAMS_NOTIFICATION_MAX_AGE_DAYS = 90  # prune_notifications deletes read notifications older than this
+TEAMS_NOTIFICATION_MAX_PER_USER = 1000  # and keeps at most this many notifications per user
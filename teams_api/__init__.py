@@ -1,3 +1,9 @@
 from .test_run_api import TestRunAPI
 from .auth import PortalAuth
-from .exceptions import APIError
\ No newline at end of file
+from .exceptions import APIError
+from .spool import ExecutionSpool, replay_spools
+
+try:
+    from .async_api import AsyncTestRunAPI, AsyncPortalAuth
+except ImportError:  # httpx is only needed for the asyncio client
+    pass
@@ -0,0 +1,187 @@
+import asyncio
+import time
+
+import httpx
+
+from .utils import (
+    default_wire_format, new_idempotency_key, RequestPlan,
+    check_response, check_test_case_response, validate_test_case, validate_test_cases,
+    chunk_ranges, batch_idempotency_key, merge_append_counts, merge_upsert_results, check_ingestion_job,
+)
+
+
+class AsyncPortalAuth:
+    """
+    asyncio counterpart of PortalAuth. Owns a pooled httpx.AsyncClient that is
+    shared with the AsyncTestRunAPI instances using this auth.
+    """
+    def __init__(self, base_url, client=None, pool_size=10, timeout=60):
+        self.base_url = base_url
+        self.access_token = None  # Store the JWT access token
+        self.refresh_token = None  # Store the JWT refresh token
+        self.client = client or httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=timeout,
+        )
+        self._refresh_lock = asyncio.Lock()
+
+    async def login(self, username, password):
+        payload = {
+            "username": username,
+            "password": password
+        }
+
+        try:
+            response = await self.client.post(f"{self.base_url}/api/token/", json=payload)
+            response.raise_for_status()  # Raise an error for bad responses
+
+            tokens = response.json()
+            self.access_token = tokens['access']
+            self.refresh_token = tokens['refresh']
+
+            return response  # Return the login response (with tokens)
+        except httpx.HTTPError as e:
+            print(f"Login failed: {e}")
+            return None
+
+    async def refresh_access_token(self, stale_token=None):
+        """
+        Use the refresh token to get a new access token. Returns None if that fails.
+        When `stale_token` is given and another task already replaced it, no
+        new refresh is made, so concurrent 401s cause a single refresh.
+        """
+        async with self._refresh_lock:
+            if stale_token is not None and self.access_token != stale_token:
+                return True
+            try:
+                response = await self.client.post(f"{self.base_url}/api/token/refresh/", json={"refresh": self.refresh_token})
+                response.raise_for_status()
+                self.access_token = response.json()['access']  # Update access token
+                return response
+            except httpx.HTTPError as e:
+                print(f"Token refresh failed: {e}")
+                return None
+
+    def logout(self):
+        self.access_token = None
+        self.refresh_token = None
+
+    async def close(self):
+        """Close the pooled connections."""
+        await self.client.aclose()
+
+
+class AsyncTestRunAPI:
+    """
+    asyncio counterpart of TestRunAPI, with the same methods as coroutines.
+    At most `max_concurrency` requests of this client are in flight at once;
+    further calls wait for a free slot.
+    """
+    def __init__(self, auth, wire_format=None, compress=True, retries=3, backoff=0.5, max_concurrency=10):
+        self.auth = auth
+        self.base_url = self.auth.base_url
+        self.client = self.auth.client
+        self.wire_format = wire_format or default_wire_format()
+        self.compress = compress
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _request(self, method, url, data=None, idempotency_key=None):
+        """
+        Send an authenticated request over the client, following the retry and
+        refresh decisions of a RequestPlan exactly like TestRunAPI._request.
+        """
+        plan = RequestPlan(method, url, data, idempotency_key, self.wire_format, self.compress,
+                           self.retries, self.backoff)
+        while True:
+            used_token = self.auth.access_token
+            headers = plan.headers(used_token)
+            try:
+                async with self._semaphore:
+                    response = await self.client.request(method, url, content=plan.body, headers=headers)
+            except httpx.TransportError as e:
+                plan.after_error(e)
+            else:
+                action = plan.after_response(response, can_refresh=bool(self.auth.refresh_token))
+                if action == RequestPlan.REFRESH:
+                    if await self.auth.refresh_access_token(stale_token=used_token) is not None:
+                        continue
+                    return response
+                if action == RequestPlan.RETURN:
+                    return response
+            await asyncio.sleep(plan.delay)
+
+    @staticmethod
+    def new_idempotency_key():
+        """Generate a key for a write that may be retried."""
+        return new_idempotency_key()
+
+    async def create_test_run(self, data, idempotency_key=None):
+        url = f"{self.base_url}/tests/test-cases/testruns/"
+        return check_response(await self._request("POST", url, data, idempotency_key), (201,), "create test run")
+
+    async def submit_test_run(self, data, idempotency_key=None):
+        url = f"{self.base_url}/tests/test-cases/testruns/?async=true"
+        return check_response(await self._request("POST", url, data, idempotency_key), (202,), "submit test run")
+
+    async def get_ingestion_job(self, job_id):
+        url = f"{self.base_url}/tests/test-cases/ingestionjobs/{job_id}/"
+        return check_response(await self._request("GET", url), (200,), "fetch ingestion job")
+
+    async def wait_for_ingestion_job(self, job_id, timeout=300, interval=2):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = check_ingestion_job(await self.get_ingestion_job(job_id), job_id, deadline, timeout)
+            if job is not None:
+                return job
+            await asyncio.sleep(interval)
+
+    async def get_test_run(self, test_run_id):
+        url = f"{self.base_url}/tests/test-cases/testruns/{test_run_id}/"
+        return check_response(await self._request("GET", url), (200,), "fetch test run")
+
+    async def update_test_run(self, test_run_id, data, idempotency_key=None):
+        url = f"{self.base_url}/tests/test-cases/testruns/{test_run_id}/"
+        return check_response(await self._request("PUT", url, data, idempotency_key), (200, 201), "update test run")
+
+    async def append_executions(self, test_run_id, executions, chunk_size=None, idempotency_key=None):
+        '''
+        Unlike TestRunAPI.append_executions, the batches are sent concurrently.
+        '''
+        url = f"{self.base_url}/tests/test-cases/testruns/{test_run_id}/executions/append/"
+
+        executions = list(executions)
+        chunk_size, starts = chunk_ranges(len(executions), chunk_size)
+
+        async def send(index, start):
+            response = await self._request("POST", url, {'executions': executions[start:start + chunk_size]},
+                                           batch_idempotency_key(idempotency_key, index))
+            return check_response(response, (200,), "append executions")
+
+        return merge_append_counts(await asyncio.gather(*(send(index, start) for index, start in enumerate(starts))))
+
+    async def delete_test_run(self, test_run_id):
+        url = f"{self.base_url}/tests/test-cases/testruns/{test_run_id}/"
+        check_response(await self._request("DELETE", url), (204,), "delete test run")
+        return
+
+    async def create_test_case(self, data):
+        '''
+        Name and OID are mandatory for us
+        '''
+        url = f"{self.base_url}/tests/test-cases/testcases/"
+        validate_test_case(data)
+        return check_test_case_response(await self._request("POST", url, data))
+
+    async def bulk_upsert_test_cases(self, test_cases, update_names=False, chunk_size=None):
+        url = f"{self.base_url}/tests/test-cases/testcases/bulk/"
+        test_cases = list(test_cases)
+        validate_test_cases(test_cases)
+
+        chunk_size, starts = chunk_ranges(len(test_cases), chunk_size)
+        chunks = []
+        for start in starts:
+            payload = {'testcases': test_cases[start:start + chunk_size], 'update_names': update_names}
+            chunks.append(check_response(await self._request("POST", url, payload), (200,), "upsert test cases"))
+        return merge_upsert_results(chunks)
@@ -1,11 +1,15 @@
 import requests
 from requests.exceptions import RequestException
+from .utils import create_session
 
 class PortalAuth:
-    def __init__(self, base_url):
+    def __init__(self, base_url, session=None, pool_size=10, timeout=60):
         self.base_url = base_url
+        self.timeout = timeout  # Seconds to wait for the token endpoints, like TestRunAPI requests
         self.access_token = None  # Store the JWT access token
         self.refresh_token = None  # Store the JWT refresh token
+        # Pooled keep-alive connections, shared with the API clients using this auth
+        self.session = session or create_session(pool_size)
 
     def login(self, username, password):
         # Prepare the login payload for obtaining JWT token
@@ -16,7 +20,7 @@ class PortalAuth:
 
         try:
             # Send login request to obtain JWT tokens
-            response = requests.post(f"{self.base_url}/api/token/", json=payload)
+            response = self.session.post(f"{self.base_url}/api/token/", json=payload, timeout=self.timeout)
             response.raise_for_status()  # Raise an error for bad responses
 
             # Extract the access and refresh tokens from the response
@@ -30,12 +34,14 @@ class PortalAuth:
             return None
 
     def refresh_access_token(self):
-        """Use the refresh token to get a new access token."""
+        """Use the refresh token to get a new access token. Returns None if that fails."""
         try:
             # Send request to refresh the access token using the refresh token
-            response = requests.post(f"{self.base_url}/api/token/refresh/", json={"refresh": self.refresh_token})
+            response = self.session.post(f"{self.base_url}/api/token/refresh/", json={"refresh": self.refresh_token},
+                                         timeout=self.timeout)
             response.raise_for_status()
             self.access_token = response.json()['access']  # Update access token
+            return response
         except RequestException as e:
             print(f"Token refresh failed: {e}")
             return None
@@ -43,3 +49,7 @@ class PortalAuth:
     def logout(self):
         self.access_token = None
         self.refresh_token = None
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
@@ -1,5 +1,6 @@
 # exceptions.py
 class APIError(Exception):
     """Custom exception for API-related errors."""
-    def __init__(self, message):
+    def __init__(self, message, status_code=None):
         super().__init__(message)
+        self.status_code = status_code  # HTTP status of the failed response, if there was one
@@ -0,0 +1,167 @@
+"""
+pytest plugin that reports the results of a session to TEAMS while it runs.
+
+Enable it with ``-p teams_api.pytest_plugin`` (or ``pytest_plugins`` in a
+conftest.py) and point it at a server:
+
+    pytest -p teams_api.pytest_plugin --teams-url https://teams.example.com \
+        --teams-username ci --teams-password secret
+
+The test run is created when the session starts. Every test report is recorded
+into an ExecutionSpool, which journals it and uploads it in batches from a
+background thread, so the tests never wait on the server. When the session
+ends the spool is flushed and the notes of the run are updated with a summary.
+
+A test is reported under the OID given with ``@pytest.mark.teams_oid("TC001")``.
+Tests without the marker are only reported with ``--teams-register-testcases``,
+which creates test cases named after their node ids; the server would reject
+the whole batch for an OID it does not know otherwise.
+"""
+import datetime
+import os
+import tempfile
+
+import pytest
+
+from .auth import PortalAuth
+from .exceptions import APIError
+from .test_run_api import TestRunAPI
+
+# Result of a report, keyed by (phase, outcome); phases without an entry are not reported
+RESULTS = {
+    ('setup', 'failed'): 'ERROR',
+    ('setup', 'skipped'): 'SKIPPED',
+    ('call', 'passed'): 'PASS',
+    ('call', 'failed'): 'FAIL',
+    ('call', 'skipped'): 'SKIPPED',
+    ('teardown', 'failed'): 'ERROR',
+}
+
+MAX_NOTES_LENGTH = 4000
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("teams", "Report results to TEAMS")
+    group.addoption("--teams-url", default=os.environ.get("TEAMS_URL"),
+                    help="Base URL of the TEAMS server. Reporting is disabled without it.")
+    group.addoption("--teams-username", default=os.environ.get("TEAMS_USERNAME"))
+    group.addoption("--teams-password", default=os.environ.get("TEAMS_PASSWORD"))
+    group.addoption("--teams-notes", default=None, help="Notes of the created test run.")
+    group.addoption("--teams-unpublished", action="store_true", help="Create the test run unpublished.")
+    group.addoption("--teams-register-testcases", action="store_true",
+                    help="Create test cases for collected tests that do not exist in TEAMS yet.")
+    group.addoption("--teams-spool-dir", default=None,
+                    help="Directory of the upload journal (default: the pytest cache, "
+                         "or a temporary directory without the cacheprovider plugin).")
+    group.addoption("--teams-batch-size", type=int, default=500)
+    group.addoption("--teams-flush-timeout", type=float, default=60,
+                    help="Seconds to wait at the end of the session for pending uploads.")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "teams_oid(oid): OID of the TEAMS test case this test reports to.")
+    # Only the controlling process reports when tests are distributed
+    if config.getoption("teams_url") and not hasattr(config, "workerinput"):
+        config.pluginmanager.register(TeamsReporter(config), "teams-reporter")
+
+
+class TeamsReporter:
+    def __init__(self, config):
+        self.config = config
+        self.option = config.option
+        self.auth = None
+        self.api = None
+        self.test_run_id = None
+        self.spool = None
+        self.testcases = {}
+        self.results = {}
+
+    def _warn(self, message):
+        reporter = self.config.pluginmanager.get_plugin("terminalreporter")
+        if reporter is not None:
+            reporter.write_line(f"TEAMS: {message}", yellow=True)
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_sessionstart(self, session):
+        self.auth = PortalAuth(base_url=self.option.teams_url.rstrip("/"))
+        if self.auth.login(self.option.teams_username, self.option.teams_password) is None:
+            self._warn("login failed, results will not be reported")
+            return
+        self.api = TestRunAPI(self.auth)
+        try:
+            self.test_run_id = self.api.create_test_run({
+                'date': datetime.datetime.now().isoformat(),
+                'notes': self.option.teams_notes or "pytest session in progress",
+                'published': not self.option.teams_unpublished,
+                'executions': [],
+            })['id']
+        except APIError as e:
+            self._warn(f"could not create the test run: {e}")
+            return
+
+        spool_dir = self.option.teams_spool_dir
+        if spool_dir is None:
+            # config.cache does not exist with -p no:cacheprovider
+            cache = getattr(self.config, "cache", None)
+            spool_dir = str(cache.mkdir("teams")) if cache is not None else tempfile.mkdtemp(prefix="teams-spool-")
+        self.spool = self.api.spool_executions(self.test_run_id, spool_dir,
+                                               batch_size=self.option.teams_batch_size)
+
+    def pytest_collection_finish(self, session):
+        unmarked = 0
+        for item in session.items:
+            marker = item.get_closest_marker("teams_oid")
+            if marker and marker.args:
+                self.testcases[item.nodeid] = (marker.args[0], item.name)
+            elif self.option.teams_register_testcases:
+                self.testcases[item.nodeid] = (item.nodeid, item.name)
+            else:
+                unmarked += 1
+        if unmarked and self.spool is not None:
+            self._warn(f"{unmarked} tests without a teams_oid marker will not be reported; "
+                       f"use --teams-register-testcases to report them under their node id")
+
+        if self.spool is not None and self.option.teams_register_testcases:
+            try:
+                self.api.bulk_upsert_test_cases(
+                    [{'oid': oid, 'name': name} for oid, name in set(self.testcases.values())])
+            except APIError as e:
+                self._warn(f"could not register test cases: {e}")
+
+    def pytest_runtest_logreport(self, report):
+        result = RESULTS.get((report.when, report.outcome))
+        if result is None or self.spool is None:
+            return
+        if report.nodeid not in self.testcases:
+            return
+        oid, name = self.testcases[report.nodeid]
+        execution = {'testcase': oid, 'result': result, 'duration': f"{report.duration:.6f}"}
+        if report.failed:
+            execution['notes'] = report.longreprtext[-MAX_NOTES_LENGTH:]
+        self.results[report.nodeid] = result
+        self.spool.record(execution)
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_sessionfinish(self, session, exitstatus):
+        if self.spool is None:
+            return
+        if not self.spool.close(timeout=self.option.teams_flush_timeout):
+            if self.spool.pending:
+                self._warn(f"{self.spool.pending} results of test run {self.test_run_id} were not uploaded; "
+                           f"they are kept in {self.spool.journal_path} for replay_spools()")
+            if self.spool.rejected:
+                self._warn(f"{self.spool.rejected} results of test run {self.test_run_id} were rejected "
+                           f"by the server; they are kept in {self.spool.rejected_path}")
+
+        counts = {}
+        for result in self.results.values():
+            counts[result] = counts.get(result, 0) + 1
+        summary = ", ".join(f"{count} {result}" for result, count in sorted(counts.items()))
+        notes = self.option.teams_notes or "pytest session"
+        try:
+            self.api.update_test_run(self.test_run_id, {
+                'notes': f"{notes} (exit status {int(exitstatus)}): {summary or 'no tests'}",
+            })
+        except APIError as e:
+            self._warn(f"could not finalize test run {self.test_run_id}: {e}")
+        self.auth.close()
@@ -0,0 +1,237 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from .exceptions import APIError
+from .utils import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# Client errors that may go away on their own; any other 4xx rejects the batch for good.
+# 409 is what a retry gets while an earlier attempt with its Idempotency-Key is still running.
+TRANSIENT_CLIENT_ERRORS = (408, 409, 429)
+
+
+def is_permanent_error(error):
+    """Whether an APIError will recur however often the batch is resent (bad data, credentials or run)."""
+    status_code = error.status_code
+    return status_code is not None and 400 <= status_code < 500 and status_code not in TRANSIENT_CLIENT_ERRORS
+
+
+class ExecutionSpool:
+    """
+    Records executions of a test run locally and uploads them in the background.
+
+    record() appends the execution to an on-disk journal and returns at once; a
+    background thread collects the recorded executions into batches of up to
+    `batch_size` (waiting at most `flush_interval` seconds for a batch to fill)
+    and sends them with TestRunAPI.append_executions, retrying with backoff
+    while the server is unavailable. The number of executions the server has
+    acknowledged is stored next to the journal, so executions recorded before
+    a crash are sent again by the next spool for the same run, or by
+    replay_spools(). Batches the server rejects with a client error other than
+    408, 409 or 429 (invalid data, bad credentials, a run that does not exist)
+    are moved to a '.rejected' dead-letter file and logged instead of being
+    retried forever, and counted in `rejected`. Unexpected errors are logged and
+    the batch is retried.
+    """
+    def __init__(self, api, test_run_id, spool_dir, batch_size=500, flush_interval=1.0,
+                 backoff=0.5, max_backoff=30):
+        self.api = api
+        self.test_run_id = test_run_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        os.makedirs(spool_dir, exist_ok=True)
+        base = os.path.join(spool_dir, str(test_run_id))
+        self.journal_path = f"{base}.ndjson"
+        self.acked_path = f"{base}.acked"
+        self.rejected_path = f"{base}.rejected"
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._recorded = 0
+        self._acked = read_acked(self.acked_path)  # Includes executions moved to the rejected file
+        self._rejected = 0
+
+        # Queue whatever a previous process recorded but could not send
+        for execution in read_journal(self.journal_path, skip=self._acked):
+            self._queue.put(execution)
+            self._recorded += 1
+        self._recorded += self._acked
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        if self._journal.tell() and not journal_ends_with_newline(self.journal_path):
+            self._journal.write("\n")  # Keep new records off a line cut short by a crash
+
+        self._thread = threading.Thread(target=self._run, name=f"teams-spool-{test_run_id}", daemon=True)
+        self._thread.start()
+
+    def record(self, execution):
+        """
+        Journal an execution and queue it for upload. Never waits on the server.
+        Raises RuntimeError once the spool is closed.
+        """
+        line = json.dumps(execution)
+        with self._lock:
+            if self._journal.closed:
+                raise RuntimeError(f"The spool of test run {self.test_run_id} is closed")
+            self._journal.write(line + "\n")
+            self._journal.flush()
+            self._recorded += 1
+        self._queue.put(execution)
+
+    @property
+    def pending(self):
+        """Number of recorded executions the server has not acknowledged yet."""
+        return self._recorded - self._acked
+
+    @property
+    def rejected(self):
+        """Number of executions this spool moved to the rejected file."""
+        return self._rejected
+
+    def close(self, timeout=None):
+        """
+        Send what is still queued and stop the background thread, waiting at most
+        `timeout` seconds. Returns True when the server accepted everything. The
+        journal is removed once nothing is pending, and kept for a later replay
+        otherwise; rejected executions stay in the rejected file either way.
+        """
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        with self._lock:
+            self._journal.close()
+        if self._thread.is_alive() or self.pending:
+            return False
+        for path in (self.journal_path, self.acked_path):
+            if os.path.exists(path):
+                os.remove(path)
+        return not self.rejected
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        try:
+            self._drain()
+        except Exception:
+            # Should not happen, but never let the spool stop draining without a trace
+            logger.exception("Spool of test run %s stopped; unsent executions stay in %s",
+                             self.test_run_id, self.journal_path)
+
+    def _drain(self):
+        batch = []
+        stopping = False
+        while not (stopping and not batch):
+            deadline = time.monotonic() + self.flush_interval
+            while not stopping and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if batch:
+                self._send(batch)
+                batch = []
+
+    def _send(self, batch):
+        """Send one batch, retrying until the server has either accepted or rejected it."""
+        attempt = 0
+        while True:
+            try:
+                self.api.append_executions(self.test_run_id, batch)
+                break
+            except APIError as e:
+                if is_permanent_error(e):
+                    self._reject(batch, e)
+                    break
+                logger.warning("Sending %d executions of test run %s failed, retrying: %s",
+                               len(batch), self.test_run_id, e)
+            except Exception:
+                logger.exception("Sending %d executions of test run %s failed, retrying",
+                                 len(batch), self.test_run_id)
+            time.sleep(min(backoff_delay(self.backoff, attempt), self.max_backoff))
+            attempt += 1
+        self._acked += len(batch)
+        write_acked(self.acked_path, self._acked)
+
+    def _reject(self, batch, error):
+        """Move a batch the server refused for good to the dead-letter file."""
+        with open(self.rejected_path, "a", encoding="utf-8") as rejected:
+            for execution in batch:
+                rejected.write(json.dumps(execution) + "\n")
+        self._rejected += len(batch)
+        logger.error("Server rejected %d executions of test run %s, moved them to %s: %s",
+                     len(batch), self.test_run_id, self.rejected_path, error)
+
+
+def read_acked(path):
+    try:
+        with open(path, encoding="utf-8") as acked:
+            return int(acked.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_acked(path, count):
+    # Replace atomically so that a crash never leaves a truncated count behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as acked:
+        acked.write(str(count))
+    os.replace(tmp_path, path)
+
+
+def journal_ends_with_newline(path):
+    with open(path, "rb") as journal:
+        journal.seek(-1, os.SEEK_END)
+        return journal.read(1) == b"\n"
+
+
+def read_journal(path, skip=0):
+    """Yield the executions of a journal, skipping the first `skip` ones."""
+    try:
+        journal = open(path, encoding="utf-8")
+    except FileNotFoundError:
+        return
+    with journal:
+        count = 0
+        for line in journal:
+            try:
+                execution = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by a crash; it was never reported as recorded
+            count += 1
+            if count > skip:
+                yield execution
+
+
+def replay_spools(api, spool_dir, timeout=None):
+    """
+    Send the unacknowledged executions of every journal left in `spool_dir`, e.g.
+    after a crash. Returns the ids of the test runs whose journals were fully sent
+    and accepted.
+    """
+    replayed = []
+    if not os.path.isdir(spool_dir):
+        return replayed
+    for filename in sorted(os.listdir(spool_dir)):
+        if not filename.endswith(".ndjson"):
+            continue
+        test_run_id = filename[:-len(".ndjson")]
+        spool = ExecutionSpool(api, test_run_id, spool_dir)
+        if spool.close(timeout):
+            replayed.append(test_run_id)
+    return replayed
@@ -0,0 +1,103 @@
+import asyncio
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.test import LiveServerTestCase
+
+from teams_core.models import TestCase, TestRun, TestExecution
+from teams_api import AsyncTestRunAPI, AsyncPortalAuth, APIError
+
+User = get_user_model()
+
+
+class TestAsyncAPILibrary(LiveServerTestCase):
+    def setUp(self):
+        """Set up a user and the test cases referred to by the runs."""
+        self.username = "anshul"
+        self.password = "password"
+        User.objects.create_user(username=self.username, password=self.password)
+        for i in range(1, 6):
+            TestCase.objects.create(name=f"Test Case {i}", oid=f"TC00{i}")
+
+    async def _login(self, **kwargs):
+        auth = AsyncPortalAuth(base_url=self.live_server_url)
+        response = await auth.login(username=self.username, password=self.password)
+        self.assertIsNotNone(response)
+        return auth, AsyncTestRunAPI(auth, **kwargs)
+
+    def test_concurrent_create_and_append(self):
+        """Test creating several test runs concurrently and appending executions in parallel batches."""
+        async def scenario():
+            auth, api = await self._login(max_concurrency=2)
+            try:
+                start = datetime.datetime.now()
+                runs = await asyncio.gather(*(
+                    api.create_test_run({
+                        'date': (start + datetime.timedelta(seconds=i)).isoformat(),
+                        'notes': f'Async Test Run {i}',
+                        'executions': [{'testcase': 'TC001', 'result': 'PASS', 'duration': '00:01:00'}],
+                    })
+                    for i in range(4)
+                ))
+                executions = [{'testcase': f'TC00{i}', 'result': 'PASS'} for i in range(2, 6)]
+                counts = await api.append_executions(runs[0]['id'], executions, chunk_size=2)
+                fetched = await api.get_test_run(runs[0]['id'])
+                return runs, counts, fetched
+            finally:
+                await auth.close()
+
+        runs, counts, fetched = asyncio.run(scenario())
+        self.assertEqual(len({run['id'] for run in runs}), 4)
+        self.assertEqual(TestRun.objects.count(), 4)
+        self.assertEqual(counts['appended'], 4)
+        self.assertEqual(len(fetched['executions']), 5)
+        self.assertEqual(TestExecution.objects.count(), 8)
+
+    def test_retry_with_same_key(self):
+        """Test that a write retried with its Idempotency-Key is replayed, and that the key cannot be reused."""
+        async def scenario():
+            auth, api = await self._login()
+            try:
+                data = {'date': datetime.datetime.now().isoformat(), 'executions': []}
+                first = await api.create_test_run(data, idempotency_key='same-run')
+                retry = await api.create_test_run(data, idempotency_key='same-run')
+                with self.assertRaises(APIError) as raised:
+                    await api.create_test_run(dict(data, notes='Other'), idempotency_key='same-run')
+                return first, retry, raised.exception
+            finally:
+                await auth.close()
+
+        first, retry, error = asyncio.run(scenario())
+        self.assertEqual(first['id'], retry['id'])
+        self.assertEqual(error.status_code, 422)
+        self.assertEqual(TestRun.objects.count(), 1)
+
+    def test_expired_access_token_is_refreshed(self):
+        """Test that a rejected access token is refreshed transparently."""
+        async def scenario():
+            auth, api = await self._login()
+            try:
+                auth.access_token = 'expired'
+                created = await api.create_test_run({'date': datetime.datetime.now().isoformat(), 'executions': []})
+                return auth.access_token, created
+            finally:
+                await auth.close()
+
+        access_token, created = asyncio.run(scenario())
+        self.assertNotEqual(access_token, 'expired')
+        self.assertTrue(TestRun.objects.filter(pk=created['id']).exists())
+
+    def test_unknown_test_case_raises(self):
+        """Test that server side validation errors surface as APIError."""
+        async def scenario():
+            auth, api = await self._login()
+            try:
+                await api.create_test_run({
+                    'date': datetime.datetime.now().isoformat(),
+                    'executions': [{'testcase': 'TC404', 'result': 'PASS'}],
+                })
+            finally:
+                await auth.close()
+
+        with self.assertRaises(APIError):
+            asyncio.run(scenario())
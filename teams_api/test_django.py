@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, LiveServerTestCase
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
 import datetime
@@ -191,4 +191,61 @@ class TestAPILibrary(APITestCase):
         with self.assertRaises(APIError) as context:
             test_run_api.get_test_run(test_run_id)
 
-        self.assertIn("Failed to fetch test run", str(context.exception))
\ No newline at end of file
+        self.assertIn("Failed to fetch test run", str(context.exception))
+
+
+class TestAPILibraryLiveServer(LiveServerTestCase):
+    def setUp(self):
+        """Set up a user and the test cases referred to by the runs, and log in to the live server."""
+        self.username = "anshul"
+        self.password = "password"
+        User.objects.create_user(username=self.username, password=self.password)
+        for i in range(1, 4):
+            TestCase.objects.create(name=f"Test Case {i}", oid=f"TC00{i}")
+
+        self.auth = PortalAuth(base_url=self.live_server_url)
+        self.assertIsNotNone(self.auth.login(username=self.username, password=self.password))
+
+    def tearDown(self):
+        self.auth.close()
+
+    def test_append_executions(self):
+        """Test appending executions to an existing test run in chunks."""
+        test_run_api = TestRunAPI(self.auth)
+
+        # Create a test run without executions
+        data = {
+            'date': datetime.datetime.now().isoformat(),
+            'notes': 'Test Run for Appending',
+            'published': True,
+            'executions': []
+        }
+        created_response = test_run_api.create_test_run(data)
+        test_run_id = created_response['id']
+
+        # Append the executions two at a time
+        executions = [
+            {'testcase': 'TC001', 'result': 'PASS', 'duration': '00:01:00'},
+            {'testcase': 'TC002', 'result': 'PASS', 'duration': '00:02:00'},
+            {'testcase': 'TC003', 'result': 'FAIL', 'duration': '00:03:00'},
+        ]
+        counts = test_run_api.append_executions(test_run_id, executions, chunk_size=2)
+        self.assertEqual(counts['appended'], 3)
+        self.assertEqual(counts['total'], 3)
+
+    def test_expired_access_token_is_refreshed(self):
+        """Test that a rejected access token is refreshed transparently."""
+        test_run_api = TestRunAPI(self.auth)
+        data = {
+            'date': datetime.datetime.now().isoformat(),
+            'notes': 'Test Run with Refreshed Token',
+            'published': True,
+            'executions': []
+        }
+        created_response = test_run_api.create_test_run(data)
+
+        # Invalidate the access token; the refresh token is still valid
+        self.auth.access_token = 'expired'
+        fetched_response = test_run_api.get_test_run(created_response['id'])
+        self.assertEqual(fetched_response['id'], created_response['id'])
+        self.assertNotEqual(self.auth.access_token, 'expired')
@@ -0,0 +1,100 @@
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.test import LiveServerTestCase
+
+from teams_core.models import TestCase, TestRun
+
+User = get_user_model()
+
+TEST_MODULE = textwrap.dedent('''
+    import pytest
+
+    @pytest.mark.teams_oid("TC001")
+    def test_passes():
+        pass
+
+    @pytest.mark.teams_oid("TC002")
+    def test_fails():
+        assert 1 == 2
+
+    @pytest.mark.skip(reason="not today")
+    def test_skipped():
+        pass
+''')
+
+
+class TestPytestPlugin(LiveServerTestCase):
+    def setUp(self):
+        """Set up a user and a pytest project reporting to the live server."""
+        self.user = User.objects.create_user(username="anshul", password="password")
+        TestCase.objects.create(name="Test Case 1", oid="TC001", author=self.user)
+        self.project_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.project_dir, "test_sample.py"), "w") as module:
+            module.write(TEST_MODULE)
+
+    def run_pytest(self, *args):
+        """Run the sample project in a separate pytest process and return its exit code."""
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return subprocess.run([
+            sys.executable, "-m", "pytest", self.project_dir, "-q",
+            "-p", "no:cacheprovider", "-p", "no:django", "-p", "teams_api.pytest_plugin",
+            "--rootdir", self.project_dir, *args,
+        ], env=env, capture_output=True).returncode
+
+    def run_pytest_reporting(self, *args):
+        return self.run_pytest(
+            "--teams-url", self.live_server_url,
+            "--teams-username", "anshul", "--teams-password", "password",
+            "--teams-spool-dir", os.path.join(self.project_dir, "spool"),
+            *args,
+        )
+
+    def test_session_is_reported(self):
+        """Test that every test of the session ends up as an execution of one finalized run."""
+        exit_code = self.run_pytest_reporting("--teams-register-testcases", "--teams-notes", "Nightly")
+        self.assertEqual(exit_code, pytest.ExitCode.TESTS_FAILED)
+
+        test_run = TestRun.objects.get()
+        self.assertEqual(test_run.created_by, self.user)
+        self.assertEqual(test_run.notes, "Nightly (exit status 1): 1 FAIL, 1 PASS, 1 SKIPPED")
+        results = {e.testcase.oid: e for e in test_run.testexecution_set.select_related('testcase')}
+        self.assertEqual(results["TC001"].result, "PASS")
+        self.assertEqual(results["TC002"].result, "FAIL")
+        self.assertIn("assert 1 == 2", results["TC002"].notes)
+        self.assertIsNotNone(results["TC002"].duration)
+        self.assertEqual(results["test_sample.py::test_skipped"].result, "SKIPPED")
+        self.assertEqual(TestCase.objects.get(oid="TC002").name, "test_fails")
+        self.assertEqual(os.listdir(os.path.join(self.project_dir, "spool")), [])
+
+    def test_unmarked_tests_are_not_reported_without_registration(self):
+        """Test that an unmarked test does not get the marked tests of its batch rejected."""
+        TestCase.objects.create(name="Test Case 2", oid="TC002", author=self.user)
+        exit_code = self.run_pytest_reporting()
+        self.assertEqual(exit_code, pytest.ExitCode.TESTS_FAILED)
+
+        test_run = TestRun.objects.get()
+        results = {e.testcase.oid: e.result for e in test_run.testexecution_set.select_related('testcase')}
+        self.assertEqual(results, {"TC001": "PASS", "TC002": "FAIL"})
+        self.assertEqual(os.listdir(os.path.join(self.project_dir, "spool")), [])
+
+    def test_session_is_reported_without_cache(self):
+        """Test that without a spool directory or the pytest cache the journal goes to a temporary directory."""
+        exit_code = self.run_pytest(
+            "--teams-url", self.live_server_url,
+            "--teams-username", "anshul", "--teams-password", "password",
+            "--teams-register-testcases",
+        )
+        self.assertEqual(exit_code, pytest.ExitCode.TESTS_FAILED)
+        self.assertEqual(TestRun.objects.get().testexecution_set.count(), 3)
+
+    def test_unreachable_server_does_not_fail_session(self):
+        """Test that tests still run when the server cannot be reached."""
+        exit_code = self.run_pytest("--teams-url", "http://127.0.0.1:9")
+        self.assertEqual(exit_code, pytest.ExitCode.TESTS_FAILED)
+        self.assertFalse(TestRun.objects.exists())
@@ -0,0 +1,108 @@
+import json
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase
+
+from teams_api import TestRunAPI, PortalAuth, APIError
+
+
+def make_response(status_code, data=None, headers=None):
+    """A requests.Response with a JSON body, as the session would return it."""
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    if data is not None:
+        response.headers["Content-Type"] = "application/json"
+        response._content = json.dumps(data).encode("utf-8")
+    else:
+        response._content = b""
+    return response
+
+
+@mock.patch("teams_api.test_run_api.time.sleep")
+class TestRequestRetries(SimpleTestCase):
+    """The retry, backoff and token refresh paths of TestRunAPI, against a mocked session."""
+    def setUp(self):
+        self.session = mock.Mock(spec=requests.Session)
+        self.auth = PortalAuth(base_url="http://teams.test", session=self.session)
+        self.auth.access_token = "access"
+        self.auth.refresh_token = "refresh"
+        self.api = TestRunAPI(self.auth, wire_format="json", retries=3, backoff=0.5)
+
+    def sent_headers(self):
+        return [call.kwargs["headers"] for call in self.session.request.call_args_list]
+
+    def test_transient_statuses_are_retried(self, sleep):
+        """Test that 503 and 429 are retried, waiting for Retry-After or with exponential backoff."""
+        self.session.request.side_effect = [
+            make_response(503),
+            make_response(429, headers={"Retry-After": "7"}),
+            make_response(201, {"id": 1}),
+        ]
+        self.assertEqual(self.api.create_test_run({"executions": []}), {"id": 1})
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [0.5, 7.0])
+
+        # Every attempt carries the same automatically generated Idempotency-Key
+        keys = {headers["Idempotency-Key"] for headers in self.sent_headers()}
+        self.assertEqual(len(keys), 1)
+        self.assertTrue(keys.pop())
+
+    def test_retries_are_bounded(self, sleep):
+        """Test that the last transient response is returned once the retries are used up."""
+        self.session.request.return_value = make_response(502)
+        with self.assertRaises(APIError) as raised:
+            self.api.get_test_run(1)
+        self.assertEqual(raised.exception.status_code, 502)
+        self.assertEqual(self.session.request.call_count, 4)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [0.5, 1.0, 2.0])
+        self.assertNotIn("Idempotency-Key", self.sent_headers()[0])
+
+    def test_connection_errors_are_retried(self, sleep):
+        """Test that a timed out POST is retried with its key, and that persistent errors raise APIError."""
+        self.session.request.side_effect = [requests.Timeout("timed out"), make_response(201, {"id": 2})]
+        self.assertEqual(self.api.create_test_run({"executions": []}, idempotency_key="run-1"), {"id": 2})
+        self.assertEqual([headers["Idempotency-Key"] for headers in self.sent_headers()], ["run-1", "run-1"])
+
+        self.session.request.side_effect = requests.ConnectionError("refused")
+        with self.assertRaises(APIError):
+            self.api.get_test_run(1)
+
+    def test_write_in_flight_is_retried(self, sleep):
+        """Test that a 409 for a key whose first attempt is still running is waited out."""
+        self.session.request.side_effect = [
+            make_response(409, {"detail": "in progress"}, headers={"Retry-After": "1"}),
+            make_response(201, {"id": 3}, headers={"Idempotent-Replayed": "true"}),
+        ]
+        self.assertEqual(self.api.create_test_run({"executions": []}), {"id": 3})
+        sleep.assert_called_once_with(1.0)
+
+        # Without Retry-After a 409 is an ordinary error
+        self.session.request.side_effect = [make_response(409, {"detail": "conflict"})]
+        with self.assertRaises(APIError):
+            self.api.create_test_run({"executions": []})
+
+    def test_expired_token_is_refreshed_once(self, sleep):
+        """Test that a 401 refreshes the access token and resends the request with the new one."""
+        self.session.request.side_effect = [make_response(401), make_response(200, {"id": 4})]
+        self.session.post.return_value = make_response(200, {"access": "fresh"})
+        self.assertEqual(self.api.get_test_run(4), {"id": 4})
+        self.assertEqual([headers["Authorization"] for headers in self.sent_headers()],
+                         ["Bearer access", "Bearer fresh"])
+        sleep.assert_not_called()
+
+        # A second 401 after the refresh is not refreshed again
+        self.session.request.side_effect = [make_response(401), make_response(401)]
+        self.session.post.reset_mock()
+        with self.assertRaises(APIError) as raised:
+            self.api.get_test_run(4)
+        self.assertEqual(raised.exception.status_code, 401)
+        self.assertEqual(self.session.post.call_count, 1)
+
+    def test_token_requests_time_out(self, sleep):
+        """Test that the token endpoints are called with a timeout, so a stalled server cannot hang the client."""
+        self.session.post.return_value = make_response(200, {"access": "new", "refresh": "refresh"})
+        auth = PortalAuth(base_url="http://teams.test", session=self.session, timeout=5)
+        auth.login("user", "password")
+        auth.refresh_access_token()
+        self.assertEqual([call.kwargs["timeout"] for call in self.session.post.call_args_list], [5, 5])
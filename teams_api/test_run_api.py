@@ -1,75 +1,155 @@
+import time
 import requests
-from .exceptions import APIError
+from .spool import ExecutionSpool
+from .utils import (
+    default_wire_format, new_idempotency_key, RequestPlan,
+    check_response, check_test_case_response, validate_test_case, validate_test_cases,
+    chunk_ranges, batch_idempotency_key, merge_append_counts, merge_upsert_results, check_ingestion_job,
+)
 
 class TestRunAPI:
-    def __init__(self, auth):
+    def __init__(self, auth, wire_format=None, compress=True, retries=3, backoff=0.5, timeout=60):
+        '''
+        wire_format is 'msgpack' (the default when msgpack is installed) or 'json'.
+        With compress, large request bodies are sent gzip encoded.
+        Requests go through the pooled session of `auth`. Connection errors,
+        429/502/503/504 responses and 409s telling that the first attempt of an
+        idempotent write is still running are retried up to `retries` times, waiting for
+        the Retry-After the server asked for or with exponential backoff starting
+        at `backoff` seconds, and an expired access token is refreshed once on a 401.
+        '''
         self.auth = auth
         self.base_url = self.auth.base_url
+        self.session = self.auth.session
+        self.wire_format = wire_format or default_wire_format()
+        self.compress = compress
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def _request(self, method, url, data=None, idempotency_key=None):
+        """
+        Send an authenticated request over the session, following the retry
+        and refresh decisions of a RequestPlan.
+        """
+        plan = RequestPlan(method, url, data, idempotency_key, self.wire_format, self.compress,
+                           self.retries, self.backoff)
+        while True:
+            try:
+                response = self.session.request(method, url, data=plan.body, headers=plan.headers(self.auth.access_token),
+                                                timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                plan.after_error(e)
+            else:
+                action = plan.after_response(response, can_refresh=bool(self.auth.refresh_token))
+                if action == RequestPlan.REFRESH:
+                    if self.auth.refresh_access_token() is not None:
+                        continue
+                    return response
+                if action == RequestPlan.RETURN:
+                    return response
+            time.sleep(plan.delay)
 
-    def _get_auth_headers(self):
-        """Helper method to get the Authorization headers with the access token."""
-        if not self.auth.access_token:
-            raise APIError("No access token found. Please log in.")
-        return {
-            "Authorization": f"Bearer {self.auth.access_token}"
-        }
+    @staticmethod
+    def new_idempotency_key():
+        """Generate a key for a write that may be retried."""
+        return new_idempotency_key()
 
-    def create_test_run(self, data):
+    def create_test_run(self, data, idempotency_key=None):
+        '''
+        Pass the same idempotency_key when retrying a create whose outcome is
+        unknown, and the server returns the run it already created.
+        '''
         url = f"{self.base_url}/tests/test-cases/testruns/"
-        headers = self._get_auth_headers()  # Add JWT token to headers
+        return check_response(self._request("POST", url, data, idempotency_key), (201,), "create test run")
+
+    def submit_test_run(self, data, idempotency_key=None):
+        '''
+        Queue a test run for asynchronous ingestion. Returns the ingestion job,
+        whose status can be polled with get_ingestion_job.
+        '''
+        url = f"{self.base_url}/tests/test-cases/testruns/?async=true"
+        return check_response(self._request("POST", url, data, idempotency_key), (202,), "submit test run")
+
+    def get_ingestion_job(self, job_id):
+        url = f"{self.base_url}/tests/test-cases/ingestionjobs/{job_id}/"
+        return check_response(self._request("GET", url), (200,), "fetch ingestion job")
 
-        response = requests.post(url, json=data, headers=headers)
-        if response.status_code != 201:
-            raise APIError(f"Failed to create test run: {response.content}")
-        return response.json()
+    def wait_for_ingestion_job(self, job_id, timeout=300, interval=2):
+        '''
+        Poll an ingestion job until it is processed. Returns the job on success and
+        raises APIError if it failed or did not finish within `timeout` seconds.
+        '''
+        deadline = time.monotonic() + timeout
+        while True:
+            job = check_ingestion_job(self.get_ingestion_job(job_id), job_id, deadline, timeout)
+            if job is not None:
+                return job
+            time.sleep(interval)
 
     def get_test_run(self, test_run_id):
         url = f"{self.base_url}/tests/test-cases/testruns/{test_run_id}/"
-        headers = self._get_auth_headers()  # Add JWT token to headers
-
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            raise APIError(f"Failed to fetch test run: {response.content}")
-        return response.json()
+        return check_response(self._request("GET", url), (200,), "fetch test run")
 
-    def update_test_run(self, test_run_id, data):
+    def update_test_run(self, test_run_id, data, idempotency_key=None):
         url = f"{self.base_url}/tests/test-cases/testruns/{test_run_id}/"
-        headers = self._get_auth_headers()  # Add JWT token to headers
+        return check_response(self._request("PUT", url, data, idempotency_key), (200, 201), "update test run")
 
-        response = requests.put(url, json=data, headers=headers)
-        if response.status_code not in (200, 201):
-            raise APIError(f"Failed to update test run: {response.content}")
-        return response.json()
+    def append_executions(self, test_run_id, executions, chunk_size=None, idempotency_key=None):
+        '''
+        Add executions to an existing test run without re-sending the ones already
+        uploaded. With chunk_size, the executions are sent in batches of that size.
+        Returns 'received' and 'appended' summed over all batches, and the
+        'total' number of executions of the run. An idempotency_key is
+        suffixed with the batch number so that every batch is replayed separately.
+        '''
+        url = f"{self.base_url}/tests/test-cases/testruns/{test_run_id}/executions/append/"
+
+        executions = list(executions)
+        chunk_size, starts = chunk_ranges(len(executions), chunk_size)
+        results = []
+        for index, start in enumerate(starts):
+            response = self._request("POST", url, {'executions': executions[start:start + chunk_size]},
+                                     batch_idempotency_key(idempotency_key, index))
+            results.append(check_response(response, (200,), "append executions"))
+        return merge_append_counts(results)
+
+    def spool_executions(self, test_run_id, spool_dir, **kwargs):
+        '''
+        Return an ExecutionSpool that journals executions of the test run locally
+        and uploads them in batches from a background thread. Call close() on it
+        (or use it as a context manager) when the run is over.
+        '''
+        return ExecutionSpool(self, test_run_id, spool_dir, **kwargs)
 
     def delete_test_run(self, test_run_id):
         url = f"{self.base_url}/tests/test-cases/testruns/{test_run_id}/"
-        headers = self._get_auth_headers()  # Add JWT token to headers
-
-        response = requests.delete(url, headers=headers)
-        if response.status_code != 204:
-            raise APIError(f"Failed to delete test run: {response.content}")
+        check_response(self._request("DELETE", url), (204,), "delete test run")
         return
 
     def create_test_case(self, data):
         '''
-        Name and OID are mandatory for us
+        Name and OID are mandatory for us. A test case that already exists is
+        not an error.
         '''
         url = f"{self.base_url}/tests/test-cases/testcases/"
-        if 'oid' not in data:
-            raise APIError(f"Cannot create test case without OID")
-        if 'name' not in data:
-            raise APIError(f"Cannot create test case without a name")
-        headers = self._get_auth_headers()  # Add JWT token to headers
-        
-        response = requests.post(url, json=data, headers=headers)
-        already_exists = False
-
-        if response.status_code != 201:
-            if response.status_code == 400:
-                errors = response.json().get('oid', [])
-                for error in errors:
-                    if 'already exist' in error:
-                        already_exists = True
-                if not already_exists:
-                    raise APIError(f"Failed to create test case: {response.content}")
-        return response.json()
\ No newline at end of file
+        validate_test_case(data)
+        return check_test_case_response(self._request("POST", url, data))
+
+    def bulk_upsert_test_cases(self, test_cases, update_names=False, chunk_size=None):
+        '''
+        Register many test cases at once. Each entry needs an 'oid' and a 'name';
+        test cases that already exist are left alone unless update_names is set.
+        Returns {'created': {oid: id}, 'existing': {oid: id}, 'renamed': [oid]},
+        merged over all chunks when chunk_size is given.
+        '''
+        url = f"{self.base_url}/tests/test-cases/testcases/bulk/"
+        test_cases = list(test_cases)
+        validate_test_cases(test_cases)
+
+        chunk_size, starts = chunk_ranges(len(test_cases), chunk_size)
+        chunks = []
+        for start in starts:
+            payload = {'testcases': test_cases[start:start + chunk_size], 'update_names': update_names}
+            chunks.append(check_response(self._request("POST", url, payload), (200,), "upsert test cases"))
+        return merge_upsert_results(chunks)
@@ -0,0 +1,124 @@
+import datetime
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import LiveServerTestCase, SimpleTestCase
+
+from teams_core.models import TestCase, TestExecution
+from teams_api import TestRunAPI, PortalAuth, APIError, ExecutionSpool, replay_spools
+
+User = get_user_model()
+
+
+class TestExecutionSpool(LiveServerTestCase):
+    def setUp(self):
+        """Set up a user, the test cases and an empty test run to spool into."""
+        self.username = "anshul"
+        self.password = "password"
+        User.objects.create_user(username=self.username, password=self.password)
+        for i in range(25):
+            TestCase.objects.create(name=f"Test Case {i}", oid=f"TC{i:03d}")
+
+        self.auth = PortalAuth(base_url=self.live_server_url)
+        self.assertIsNotNone(self.auth.login(username=self.username, password=self.password))
+        self.api = TestRunAPI(self.auth)
+        self.test_run_id = self.api.create_test_run({
+            'date': datetime.datetime.now().isoformat(),
+            'notes': 'Spooled Test Run',
+            'executions': []
+        })['id']
+
+        self.spool_dir = tempfile.mkdtemp()
+        self.executions = [{'testcase': f'TC{i:03d}', 'result': 'PASS', 'duration': '00:00:01'} for i in range(25)]
+
+    def tearDown(self):
+        self.auth.close()
+
+    def test_spooled_executions_are_flushed(self):
+        """Test that recorded executions are uploaded in batches and the journal is removed."""
+        with self.api.spool_executions(self.test_run_id, self.spool_dir, batch_size=10, flush_interval=0.1) as spool:
+            for execution in self.executions:
+                spool.record(execution)
+
+        self.assertEqual(spool.pending, 0)
+        self.assertEqual(TestExecution.objects.filter(run_id=self.test_run_id).count(), 25)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_journal_is_replayed_after_crash(self):
+        """Test that executions journaled but never acknowledged are sent by replay_spools."""
+        offline_auth = PortalAuth(base_url="http://127.0.0.1:9")
+        offline_auth.access_token = self.auth.access_token
+        offline_api = TestRunAPI(offline_auth, retries=0)
+
+        spool = offline_api.spool_executions(self.test_run_id, self.spool_dir, flush_interval=0.1, backoff=10)
+        for execution in self.executions:
+            spool.record(execution)
+        self.assertFalse(spool.close(timeout=0.5))
+        self.assertEqual(TestExecution.objects.filter(run_id=self.test_run_id).count(), 0)
+
+        # A partially written line left behind by the crash is ignored
+        with open(os.path.join(self.spool_dir, f"{self.test_run_id}.ndjson"), "a") as journal:
+            journal.write(json.dumps(self.executions[0])[:10])
+
+        self.assertEqual(replay_spools(self.api, self.spool_dir), [str(self.test_run_id)])
+        self.assertEqual(TestExecution.objects.filter(run_id=self.test_run_id).count(), 25)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+
+class TestExecutionSpoolErrors(SimpleTestCase):
+    """How the spool deals with errors of the API, against a mocked TestRunAPI."""
+    def setUp(self):
+        self.api = mock.Mock(spec=TestRunAPI)
+        self.spool_dir = tempfile.mkdtemp()
+        self.executions = [{'testcase': f'TC{i:03d}', 'result': 'PASS'} for i in range(3)]
+
+    def spool(self):
+        return ExecutionSpool(self.api, 7, self.spool_dir, flush_interval=0.05, backoff=0)
+
+    def test_permanent_errors_are_dead_lettered(self):
+        """Test that a batch refused for bad credentials is moved to the rejected file and logged, not retried."""
+        self.api.append_executions.side_effect = APIError("Failed to append executions", 401)
+        with self.assertLogs("teams_api.spool", level="ERROR") as logs:
+            spool = self.spool()
+            for execution in self.executions:
+                spool.record(execution)
+            self.assertFalse(spool.close(timeout=5))
+        self.assertEqual(self.api.append_executions.call_count, 1)
+        self.assertEqual(spool.rejected, 3)
+        self.assertEqual(spool.pending, 0)
+        self.assertEqual(os.listdir(self.spool_dir), ["7.rejected"])
+        self.assertIn("7.rejected", logs.output[0])
+        with open(os.path.join(self.spool_dir, "7.rejected")) as rejected:
+            self.assertEqual([json.loads(line) for line in rejected], self.executions)
+
+    def test_record_after_close(self):
+        """Test that recording into a closed spool raises a clear error, and the execution is neither journaled nor sent."""
+        spool = self.spool()
+        spool.record(self.executions[0])
+        self.assertTrue(spool.close(timeout=5))
+        with self.assertRaisesRegex(RuntimeError, "spool of test run 7 is closed"):
+            spool.record(self.executions[1])
+        self.assertEqual(self.api.append_executions.call_count, 1)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_transient_and_unexpected_errors_are_retried(self):
+        """Test that throttling, conflicts of an attempt still running and unexpected exceptions are logged and the batch is sent again."""
+        self.api.append_executions.side_effect = [
+            APIError("Failed to append executions", 429),
+            APIError("Failed to append executions", 409),
+            ValueError("unexpected"),
+            {'received': 3, 'appended': 3, 'total': 3},
+        ]
+        with self.assertLogs("teams_api.spool", level="WARNING") as logs:
+            spool = self.spool()
+            for execution in self.executions:
+                spool.record(execution)
+            self.assertTrue(spool.close(timeout=5))
+        self.assertEqual(self.api.append_executions.call_count, 4)
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual(spool.rejected, 0)
+        self.assertFalse(os.path.exists(os.path.join(self.spool_dir, "7.rejected")))
+        self.assertEqual(os.listdir(self.spool_dir), [])
@@ -0,0 +1,273 @@
+import gzip
+import json
+import time
+import uuid
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .exceptions import APIError
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional on the client side, JSON is used without it
+    msgpack = None
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_SIZE = 1024
+
+# Responses worth retrying: the server is throttling, restarting or overloaded
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Answer to a retry whose Idempotency-Key is still held by the first attempt
+IN_FLIGHT_STATUS = 409
+
+# Longest Retry-After a client waits for before giving the request another try
+MAX_RETRY_AFTER = 60
+
+
+def create_session(pool_size=10):
+    """
+    A requests.Session with a connection pool of `pool_size` kept-alive
+    connections per host, to be shared by PortalAuth and TestRunAPI.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def backoff_delay(backoff, attempt):
+    """Exponential backoff: backoff, 2*backoff, 4*backoff, ..."""
+    return backoff * (2 ** attempt)
+
+
+def should_retry(response, idempotency_key=None):
+    """
+    Whether a response is worth retrying: a transient server state, or, for a
+    request with an idempotency key, the server still running the first attempt.
+    """
+    if response.status_code in RETRY_STATUSES:
+        return True
+    return bool(idempotency_key) and response.status_code == IN_FLIGHT_STATUS and "Retry-After" in response.headers
+
+
+def retry_delay(response, backoff, attempt):
+    """
+    Seconds to wait before retrying `response`: its Retry-After header when the
+    server sent one (in seconds or as an HTTP date), the exponential backoff otherwise.
+    """
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0), MAX_RETRY_AFTER)
+    return backoff_delay(backoff, attempt)
+
+
+def default_wire_format():
+    """MessagePack when it is installed, JSON otherwise."""
+    return "msgpack" if msgpack is not None else "json"
+
+
+def accept_header(wire_format):
+    """Accept header preferring the given wire format, with JSON as a fallback."""
+    if wire_format == "msgpack":
+        return f"{MSGPACK_CONTENT_TYPE}, {JSON_CONTENT_TYPE};q=0.9"
+    return JSON_CONTENT_TYPE
+
+
+def encode_body(data, wire_format="json", compress=True):
+    """
+    Serialize a request payload. Returns the body and the headers describing it;
+    bodies of at least GZIP_MIN_SIZE bytes are gzip compressed when `compress` is set.
+    """
+    if wire_format == "msgpack":
+        body = msgpack.packb(data, use_bin_type=True)
+        headers = {"Content-Type": MSGPACK_CONTENT_TYPE}
+    else:
+        body = json.dumps(data).encode("utf-8")
+        headers = {"Content-Type": JSON_CONTENT_TYPE}
+
+    if compress and len(body) >= GZIP_MIN_SIZE:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+
+def decode_response(response):
+    """Deserialize a response body according to its Content-Type; other bodies are returned as text."""
+    if not response.content:
+        return None
+    content_type = response.headers.get("Content-Type", "")
+    if content_type.startswith(MSGPACK_CONTENT_TYPE) and msgpack is not None:
+        return msgpack.unpackb(response.content, raw=False)
+    if content_type.startswith(JSON_CONTENT_TYPE):
+        return response.json()
+    return response.text  # e.g. an HTML error page
+
+
+def new_idempotency_key():
+    """Generate a key for a write that may be retried."""
+    return str(uuid.uuid4())
+
+
+class RequestPlan:
+    """
+    Everything about a client request that does not depend on the transport:
+    the encoded body, the headers of each attempt, and after each attempt the
+    decision to return the response, refresh the access token, or retry after a
+    delay. TestRunAPI and AsyncTestRunAPI only send the attempts.
+
+    POSTs get an idempotency key when none is given, so that a retried write is
+    never applied twice. Connection errors and the responses accepted by
+    should_retry are retried up to `retries` times, waiting for the Retry-After
+    the server asked for or with exponential backoff starting at `backoff`
+    seconds, and a 401 is answered with one token refresh.
+    """
+    RETURN = "return"
+    REFRESH = "refresh"
+    RETRY = "retry"
+
+    def __init__(self, method, url, data=None, idempotency_key=None,
+                 wire_format="json", compress=True, retries=3, backoff=0.5):
+        if method == "POST" and idempotency_key is None:
+            idempotency_key = new_idempotency_key()
+        self.method = method
+        self.url = url
+        self.idempotency_key = idempotency_key
+        self.wire_format = wire_format
+        self.body, self.body_headers = None, {}
+        if data is not None:
+            self.body, self.body_headers = encode_body(data, wire_format, compress)
+        self.retries = retries
+        self.backoff = backoff
+        self.attempt = 0
+        self.refreshed = False
+        self.delay = 0
+
+    def headers(self, access_token):
+        """Headers of the next attempt, authenticated with `access_token`."""
+        if not access_token:
+            raise APIError("No access token found. Please log in.")
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Accept": accept_header(self.wire_format),
+        }
+        if self.idempotency_key:
+            # Lets the server replay its first response when a write is retried
+            headers["Idempotency-Key"] = self.idempotency_key
+        headers.update(self.body_headers)
+        return headers
+
+    def after_error(self, error):
+        """An attempt failed to connect or timed out: RETRY after self.delay, or raise APIError."""
+        if self.attempt >= self.retries:
+            raise APIError(f"Request to {self.url} failed: {error}")
+        return self._retry(backoff_delay(self.backoff, self.attempt))
+
+    def after_response(self, response, can_refresh=False):
+        """
+        Decide what to do with the response of an attempt: RETURN it, REFRESH the
+        access token and resend (when `can_refresh`; if the refresh fails the
+        response is returned), or RETRY after self.delay seconds.
+        """
+        if response.status_code == 401 and not self.refreshed and can_refresh:
+            # The access token probably expired
+            self.refreshed = True
+            return self.REFRESH
+        if not should_retry(response, self.idempotency_key) or self.attempt >= self.retries:
+            return self.RETURN
+        return self._retry(retry_delay(response, self.backoff, self.attempt))
+
+    def _retry(self, delay):
+        self.delay = delay
+        self.attempt += 1
+        return self.RETRY
+
+
+def check_response(response, expected, action):
+    """
+    Decode `response`, raising APIError("Failed to <action>: ...") unless its
+    status is one of `expected`.
+    """
+    if response.status_code not in expected:
+        raise APIError(f"Failed to {action}: {decode_response(response)}", response.status_code)
+    return decode_response(response)
+
+
+def check_test_case_response(response):
+    """Like check_response for a test case creation, accepting a test case that already exists."""
+    if response.status_code == 400:
+        errors = (decode_response(response) or {}).get('oid', [])
+        if any('already exist' in error for error in errors):
+            return decode_response(response)
+    return check_response(response, (201,), "create test case")
+
+
+def validate_test_case(data):
+    """Name and OID are mandatory for us."""
+    if 'oid' not in data:
+        raise APIError("Cannot create test case without OID")
+    if 'name' not in data:
+        raise APIError("Cannot create test case without a name")
+
+
+def validate_test_cases(test_cases):
+    for test_case in test_cases:
+        if 'oid' not in test_case or 'name' not in test_case:
+            raise APIError(f"Cannot create test case without OID and name: {test_case}")
+
+
+def chunk_ranges(count, chunk_size=None):
+    """Start offsets of the chunks of `chunk_size` items (all at once by default) among `count` items."""
+    chunk_size = chunk_size or count or 1
+    return chunk_size, range(0, count, chunk_size)
+
+
+def batch_idempotency_key(idempotency_key, index):
+    """Key of one batch of a chunked write, so that every batch is replayed separately."""
+    return f"{idempotency_key}-{index}" if idempotency_key else None
+
+
+def merge_append_counts(results):
+    """Sum the counts of append_executions batches; 'total' is the largest reported."""
+    return {
+        'received': sum(result['received'] for result in results),
+        'appended': sum(result['appended'] for result in results),
+        'total': max((result['total'] for result in results), default=None),
+    }
+
+
+def merge_upsert_results(chunks):
+    result = {'created': {}, 'existing': {}, 'renamed': []}
+    for chunk in chunks:
+        result['created'].update(chunk['created'])
+        result['existing'].update(chunk['existing'])
+        result['renamed'].extend(chunk['renamed'])
+    return result
+
+
+def check_ingestion_job(job, job_id, deadline, timeout):
+    """
+    Return the job when it is DONE, raise APIError when it FAILED or `deadline`
+    (of time.monotonic()) has passed, and None while it is still pending.
+    """
+    if job['status'] == 'DONE':
+        return job
+    if job['status'] == 'FAILED':
+        raise APIError(f"Ingestion job {job_id} failed: {job['errors']}")
+    if time.monotonic() >= deadline:
+        raise APIError(f"Ingestion job {job_id} did not finish within {timeout} seconds")
+    return None
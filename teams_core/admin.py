@@ -1,7 +1,7 @@
 from django.contrib import admin
 from reversion.admin import VersionAdmin
 
-from .models import TestCase, TestExecution, TestRun, TestSuite, Subscription
+from .models import TestCase, TestExecution, TestRun, TestSuite, Subscription, IngestionJob, IdempotencyKey, FailureEvent
 
 # Register your models here.
 class TestCaseAdmin(VersionAdmin):
@@ -22,4 +22,19 @@ admin.site.register(TestSuite, TestSuiteAdmin)
 
 class SubscriptionAdmin(admin.ModelAdmin):
     pass
-admin.site.register(Subscription, SubscriptionAdmin)
\ No newline at end of file
+admin.site.register(Subscription, SubscriptionAdmin)
+
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ["id", "status", "created_by", "created_on", "finished_on"]
+    list_filter = ["status"]
+admin.site.register(IngestionJob, IngestionJobAdmin)
+
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ["key", "user", "method", "path", "status_code", "created_on"]
+    search_fields = ["key"]
+admin.site.register(IdempotencyKey, IdempotencyKeyAdmin)
+
+class FailureEventAdmin(admin.ModelAdmin):
+    list_display = ["id", "test_run", "status", "attempts", "created_on", "dispatched_on"]
+    list_filter = ["status"]
+admin.site.register(FailureEvent, FailureEventAdmin)
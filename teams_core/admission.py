@@ -0,0 +1,169 @@
+import functools
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.response import Response
+
+# Settings read by the admission controller; None disables the corresponding limit
+ADMISSION_SETTINGS = {
+    'TEAMS_ADMISSION_MAX_IN_FLIGHT': 8,  # Concurrent write requests across all users
+    'TEAMS_ADMISSION_MAX_IN_FLIGHT_PER_USER': 4,  # Concurrent write requests of one user
+    'TEAMS_ADMISSION_RATE': 50,  # Write requests per second across all users
+    'TEAMS_ADMISSION_BURST': 100,
+    'TEAMS_ADMISSION_USER_RATE': 10,  # Write requests per second of one user
+    'TEAMS_ADMISSION_USER_BURST': 20,
+    'TEAMS_ADMISSION_RETRY_AFTER': 1,  # Seconds suggested to clients rejected for concurrency
+}
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `burst`."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self):
+        """Seconds until a token is available, 0 if one is available now."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self, now):
+        """Whether the bucket has refilled completely, i.e. is as good as a new one."""
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class AdmissionController:
+    """
+    Bounds the write requests of this process: at most `max_in_flight` at once
+    (`max_in_flight_per_user` per user), admitted at the rates of a global and a
+    per-user token bucket. A request is either admitted straight away or
+    rejected with the number of seconds after which it is worth retrying, so
+    that bursts queue up at the clients instead of on the database locks.
+    Per-user buckets that have refilled completely are dropped from time to
+    time, so that they are only kept for the users active recently.
+    """
+    def __init__(self, max_in_flight=None, max_in_flight_per_user=None, rate=None, burst=None,
+                 user_rate=None, user_burst=None, retry_after=1):
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_user = max_in_flight_per_user
+        self.retry_after = retry_after
+        self.user_rate = user_rate
+        self.user_burst = user_burst or user_rate
+        self.bucket = TokenBucket(rate, burst or rate) if rate else None
+        self.user_buckets = {}
+        # A bucket left alone this long has refilled completely
+        self.user_refill_time = self.user_burst / user_rate if user_rate else None
+        self._next_eviction = time.monotonic()
+        self.in_flight = 0
+        self.user_in_flight = {}
+        self._lock = threading.Lock()
+
+    def _evict_full_buckets(self):
+        now = time.monotonic()
+        if now < self._next_eviction:
+            return
+        self.user_buckets = {
+            user_key: bucket for user_key, bucket in self.user_buckets.items() if not bucket.is_full(now)
+        }
+        self._next_eviction = now + self.user_refill_time
+
+    def _user_bucket(self, user_key):
+        if not self.user_rate:
+            return None
+        self._evict_full_buckets()
+        bucket = self.user_buckets.get(user_key)
+        if bucket is None:
+            bucket = self.user_buckets[user_key] = TokenBucket(self.user_rate, self.user_burst)
+        return bucket
+
+    def acquire(self, user_key):
+        """Admit a request of `user_key`. Returns None when admitted, or the seconds to wait."""
+        with self._lock:
+            user_in_flight = self.user_in_flight.get(user_key, 0)
+            if ((self.max_in_flight is not None and self.in_flight >= self.max_in_flight) or
+                    (self.max_in_flight_per_user is not None and user_in_flight >= self.max_in_flight_per_user)):
+                return self.retry_after
+
+            buckets = [bucket for bucket in (self.bucket, self._user_bucket(user_key)) if bucket is not None]
+            wait = max([bucket.wait_time() for bucket in buckets], default=0)
+            if wait:
+                return wait
+            for bucket in buckets:
+                bucket.take()
+
+            self.in_flight += 1
+            self.user_in_flight[user_key] = user_in_flight + 1
+            return None
+
+    def release(self, user_key):
+        with self._lock:
+            self.in_flight -= 1
+            remaining = self.user_in_flight.pop(user_key) - 1
+            if remaining:
+                self.user_in_flight[user_key] = remaining
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """The admission controller of this process, configured from the TEAMS_ADMISSION_* settings."""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            options = {name: getattr(settings, name, default) for name, default in ADMISSION_SETTINGS.items()}
+            _controller = AdmissionController(
+                max_in_flight=options['TEAMS_ADMISSION_MAX_IN_FLIGHT'],
+                max_in_flight_per_user=options['TEAMS_ADMISSION_MAX_IN_FLIGHT_PER_USER'],
+                rate=options['TEAMS_ADMISSION_RATE'],
+                burst=options['TEAMS_ADMISSION_BURST'],
+                user_rate=options['TEAMS_ADMISSION_USER_RATE'],
+                user_burst=options['TEAMS_ADMISSION_USER_BURST'],
+                retry_after=options['TEAMS_ADMISSION_RETRY_AFTER'],
+            )
+        return _controller
+
+
+@receiver(setting_changed)
+def reset_admission_controller(setting, **kwargs):
+    global _controller
+    if setting in ADMISSION_SETTINGS:
+        with _controller_lock:
+            _controller = None
+
+
+def admission_controlled(view_method):
+    """
+    Run a write method of a viewset only when the admission controller admits
+    it; otherwise answer 429 Too Many Requests with a Retry-After header.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        controller = get_admission_controller()
+        user_key = request.user.pk if request.user.is_authenticated else request.META.get('REMOTE_ADDR')
+        wait = controller.acquire(user_key)
+        if wait is not None:
+            retry_after = max(1, math.ceil(wait))
+            return Response(
+                {'detail': f'Too many concurrent writes, retry in {retry_after} seconds.'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(retry_after)},
+            )
+        try:
+            return view_method(self, request, *args, **kwargs)
+        finally:
+            controller.release(user_key)
+    return wrapper
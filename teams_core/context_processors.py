@@ -0,0 +1,14 @@
+from django.utils.functional import SimpleLazyObject
+
+from teams_core.utils import get_unread_notifications_summary
+
+
+def navbar_notifications(request):
+    """
+    Expose the cached unread notification summary of the user to templates as
+    `navbar_notifications`; it is only looked up when a template uses it.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'navbar_notifications': SimpleLazyObject(lambda: get_unread_notifications_summary(user))}
@@ -0,0 +1,181 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+from notifications.models import Notification
+
+from teams_core.models import Subscription, TestCase, TestExecution, TestRun
+from teams_core.utils import get_ingest_batch_size, invalidate_unread_notifications
+
+
+def get_subscribers_by_object(event_type, model, object_ids):
+    """
+    Resolve the active subscribers of many objects of `model` in one query, plus
+    one joining suite membership for test cases. Returns a dict mapping each
+    object id to the set of subscribed user ids.
+    """
+    subscribers = {}
+    rows = Subscription.objects.filter(
+        event_type=event_type,
+        content_type=ContentType.objects.get_for_model(model),
+        object_id__in=object_ids,
+        active=True,
+    ).values_list('object_id', 'user_id')
+    for object_id, user_id in rows:
+        subscribers.setdefault(object_id, set()).add(user_id)
+
+    if model is TestCase:
+        # Subscribers of a suite are subscribed to all of its test cases
+        rows = TestCase.suites.through.objects.filter(
+            testcase_id__in=object_ids,
+            testsuite__subscriptions__event_type=event_type,
+            testsuite__subscriptions__active=True,
+        ).values_list('testcase_id', 'testsuite__subscriptions__user_id')
+        for object_id, user_id in rows:
+            subscribers.setdefault(object_id, set()).add(user_id)
+    return subscribers
+
+
+# Failed test cases (OIDs and ids) kept in the data of a coalesced notification.
+# Below this the ids tell which failures were counted already; past it the count
+# is taken from the failing executions of the run, so it stays exact.
+MAX_COALESCED_OIDS = 100
+
+
+def coalesce_notifications():
+    """Whether failures are notified once per (recipient, run) rather than once per failure."""
+    return getattr(settings, 'TEAMS_NOTIFICATION_COALESCE', True)
+
+
+def coalesced_verb(test_run):
+    return f'Test run {test_run.pk} has failures'
+
+
+def get_failure_recipients(test_run, executions):
+    """
+    Map each recipient id to the failed test cases of `executions` it is notified
+    about: the author of each failed test case and, when the run is published,
+    its TEST_EXECUTION_FAIL subscribers, resolved in one query.
+    """
+    failed = [execution.testcase for execution in executions if execution.result == 'FAIL']
+    subscribers = {}
+    if failed and test_run.published:
+        subscribers = get_subscribers_by_object('TEST_EXECUTION_FAIL', TestCase, [test_case.pk for test_case in failed])
+
+    recipients = {}
+    for test_case in failed:
+        user_ids = set(subscribers.get(test_case.pk, ()))
+        if test_case.author_id:
+            user_ids.add(test_case.author_id)
+        for user_id in user_ids:
+            recipients.setdefault(user_id, []).append(test_case)
+    return recipients
+
+
+def send_failure_notifications(test_run, executions):
+    """
+    Notify the recipients of the failed executions of a run (see
+    get_failure_recipients), writing the notifications with bulk statements.
+    In coalescing mode every recipient gets one notification per run, which
+    later batches of the same run update while it is unread; otherwise one
+    notification per recipient and failed test case is created.
+    Returns the number of notifications created or updated.
+    """
+    if test_run.created_by_id is None:
+        return 0
+    recipients = get_failure_recipients(test_run, executions)
+    if not recipients:
+        return 0
+
+    if coalesce_notifications():
+        return _send_coalesced_notifications(test_run, recipients)
+
+    testcase_type = ContentType.objects.get_for_model(TestCase)
+    notifications = []
+    for recipient_id, test_cases in recipients.items():
+        for test_case in test_cases:
+            notifications.append(_new_notification(
+                test_run, recipient_id,
+                verb=f'{test_case.oid} failed',
+                description=f"Test Case '{test_case.oid}' failed during the test run on {test_run.date}.",
+                action_object_content_type=testcase_type,
+                action_object_object_id=test_case.pk,
+            ))
+    Notification.objects.bulk_create(notifications, batch_size=get_ingest_batch_size())
+    invalidate_unread_notifications(recipients.keys())
+    return len(notifications)
+
+
+@transaction.atomic
+def _send_coalesced_notifications(test_run, recipients):
+    verb = coalesced_verb(test_run)
+    # Locked, as send_notification_summary updates the data of these rows too
+    existing = {
+        notification.recipient_id: notification
+        for notification in Notification.objects.select_for_update().filter(
+            recipient_id__in=recipients.keys(),
+            target_content_type=ContentType.objects.get_for_model(TestRun),
+            target_object_id=test_run.pk,
+            verb=verb,
+            unread=True,
+            deleted=False,
+        )
+    }
+
+    created, updated, recount = [], [], []
+    for recipient_id, test_cases in recipients.items():
+        notification = existing.get(recipient_id)
+        if notification is None:
+            notification = _new_notification(test_run, recipient_id, verb=verb,
+                                              data={'count': 0, 'oids': [], 'testcases': []})
+            created.append(notification)
+        else:
+            notification.timestamp = timezone.now()
+            updated.append(notification)
+
+        data = notification.data
+        known = set(data['testcases'])
+        new_cases = [test_case for test_case in test_cases if test_case.pk not in known]
+        if len(known) + len(new_cases) > MAX_COALESCED_OIDS:
+            recount.append(notification)
+        else:
+            data['count'] += len(new_cases)
+        kept = new_cases[:MAX_COALESCED_OIDS - len(known)]
+        data['testcases'] += [test_case.pk for test_case in kept]
+        data['oids'] += [test_case.oid for test_case in kept]
+
+    if recount:
+        # One pass over the failures of the run resolves the count of every recipient past the cap
+        executions = TestExecution.objects.filter(
+            run=test_run, result='FAIL'
+        ).select_related('testcase').defer('testcase__content')
+        failing = get_failure_recipients(test_run, executions)
+        for notification in recount:
+            test_cases = failing.get(notification.recipient_id, ())
+            notification.data['count'] = len({test_case.pk for test_case in test_cases})
+
+    for notification in created + updated:
+        data = notification.data
+        notification.description = (
+            f"{data['count']} test case(s) failed during the test run on {test_run.date}: "
+            f"{', '.join(data['oids'][:5])}{', ...' if len(data['oids']) > 5 else ''}"
+        )
+
+    Notification.objects.bulk_create(created, batch_size=get_ingest_batch_size())
+    Notification.objects.bulk_update(updated, ['timestamp', 'description', 'data'], batch_size=get_ingest_batch_size())
+    invalidate_unread_notifications(recipients.keys())
+    return len(created) + len(updated)
+
+
+def _new_notification(test_run, recipient_id, **fields):
+    return Notification(
+        recipient_id=recipient_id,
+        actor_content_type=ContentType.objects.get_for_model(User),
+        actor_object_id=test_run.created_by_id,
+        timestamp=timezone.now(),
+        level=Notification.LEVELS.info,
+        target_content_type=ContentType.objects.get_for_model(TestRun),
+        target_object_id=test_run.pk,
+        **fields
+    )
@@ -0,0 +1,193 @@
+import functools
+import hashlib
+import io
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from teams_core.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+REPLAYED_RESPONSE_HEADERS = ('Location',)
+# Seconds a retry is asked to wait while the first request with its key is still running
+IN_FLIGHT_RETRY_AFTER = 1
+
+
+def get_idempotency_ttl():
+    """How long, in seconds, a stored response can be replayed."""
+    return getattr(settings, 'TEAMS_IDEMPOTENCY_TTL', 24 * 60 * 60)
+
+
+def get_in_flight_timeout():
+    """
+    Seconds after which a reservation that was never completed is taken to
+    belong to a request that died, and is taken over. It must be longer than
+    the longest request the server allows, e.g. a large NDJSON stream or JUnit
+    import, or a retry would run the write a second time alongside the first.
+    """
+    return getattr(settings, 'TEAMS_IDEMPOTENCY_IN_FLIGHT_TIMEOUT', 60 * 60)
+
+
+class BodyDigest:
+    """
+    Wraps the body stream of a request and hashes the bytes read through it, so
+    that the body can be fingerprinted without keeping it in memory.
+    """
+    def __init__(self, stream, prefix=b''):
+        self.stream = stream
+        self.digest = hashlib.sha256(prefix)
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.digest.update(data)
+        return data
+
+    def readline(self, *args):
+        data = self.stream.readline(*args)
+        self.digest.update(data)
+        return data
+
+    def hexdigest(self):
+        """Hash the rest of the body, which the view may have left unread, and return the fingerprint."""
+        while self.read(64 * 1024):
+            pass
+        return self.digest.hexdigest()
+
+
+def _canonical_file(value):
+    """JSON stand-in of an uploaded file for canonical_data: its name and a hash of its content."""
+    if not isinstance(value, File):
+        return str(value)
+    digest = hashlib.sha256()
+    for chunk in value.chunks():
+        digest.update(chunk)
+    value.seek(0)
+    return {'name': value.name, 'sha256': digest.hexdigest()}
+
+
+def canonical_data(data):
+    """The parsed data of a request as canonical JSON, with every value of multi-valued fields."""
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), default=_canonical_file).encode()
+
+
+def fingerprint_request(request):
+    """
+    Start fingerprinting the query string and body of a DRF request. Returns an
+    object whose hexdigest() gives the fingerprint once the view is done. When
+    the body stream was already consumed, e.g. by the CSRF check of a session
+    authenticated form POST reading request.POST, the parsed request.data is
+    fingerprinted instead.
+    """
+    django_request = request._request
+    prefix = django_request.META.get('QUERY_STRING', '').encode() + b'\n'
+    if hasattr(django_request, '_body'):  # Already read into memory
+        return BodyDigest(io.BytesIO(django_request._body), prefix)
+    if django_request._read_started:
+        return BodyDigest(io.BytesIO(canonical_data(request.data)), prefix)
+    django_request._stream = BodyDigest(django_request._stream, prefix)
+    return django_request._stream
+
+
+def reserve_key(user, key, method, path):
+    """
+    Reserve (user, key) for a request about to run. Returns (record, True) when
+    the key is now held by this request, or (record, False) with the record of
+    an earlier request using the key. Expired records and reservations of
+    requests that died are replaced.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        IdempotencyKey.objects.filter(user=user, key=key).filter(
+            created_on__lt=now - timedelta(seconds=get_idempotency_ttl())
+        ).delete()
+        IdempotencyKey.objects.filter(
+            user=user, key=key, status_code__isnull=True,
+            created_on__lt=now - timedelta(seconds=get_in_flight_timeout()),
+        ).delete()
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(user=user, key=key, method=method, path=path), True
+        except IntegrityError:
+            return IdempotencyKey.objects.get(user=user, key=key), False
+
+
+def idempotent(view_method):
+    """
+    Make a viewset method honour the Idempotency-Key header. The key is reserved
+    for the (user, key) pair before the view runs, so concurrent retries get a
+    409 while the first request is in flight. Its response is stored with a
+    fingerprint of the request, and retries with the same key within the TTL
+    get that response replayed instead of repeating the write; the same key with
+    a different request is rejected with a 422. Server errors and throttled
+    responses are not stored so that they can be retried.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+
+        digest = fingerprint_request(request)
+        record, reserved = reserve_key(request.user, key, request.method, request.path)
+        if not reserved:
+            if record.method != request.method or record.path != request.path:
+                return Response(
+                    {'detail': f'{IDEMPOTENCY_HEADER} was already used for {record.method} {record.path}.'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if record.status_code is None:
+                return Response(
+                    {'detail': f'A request with this {IDEMPOTENCY_HEADER} is still in progress.'},
+                    status=status.HTTP_409_CONFLICT,
+                    headers={'Retry-After': str(IN_FLIGHT_RETRY_AFTER)},
+                )
+            if record.fingerprint != digest.hexdigest():
+                return Response(
+                    {'detail': f'{IDEMPOTENCY_HEADER} was already used with a different request body.'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            headers = dict(record.headers or {}, **{REPLAYED_HEADER: 'true'})
+            return Response(record.response, status=record.status_code, headers=headers)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except BaseException:
+            record.delete()
+            raise
+        if response.status_code >= 500 or response.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+            record.delete()
+            return response
+
+        # An update rather than save(): the reservation may have been taken over meanwhile
+        IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True).update(
+            status_code=response.status_code,
+            response=response.data,
+            headers={name: response[name] for name in REPLAYED_RESPONSE_HEADERS if response.has_header(name)},
+            fingerprint=digest.hexdigest(),
+        )
+        return response
+    return wrapper
+
+
+def purge_expired_keys(batch_size=1000):
+    """
+    Delete the stored responses older than the TTL, batch_size rows per
+    statement. Run by the purge_idempotency_keys command rather than by the
+    write requests. Returns the number of deleted rows.
+    """
+    cutoff = timezone.now() - timedelta(seconds=get_idempotency_ttl())
+    deleted = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(created_on__lt=cutoff).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
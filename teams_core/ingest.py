@@ -0,0 +1,158 @@
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from teams_core.models import IngestionJob
+from teams_core.serializers import TestRunSerializer
+
+# Claims of a job before it is given up on, so a payload that kills workers doesn't loop
+MAX_ATTEMPTS = 3
+
+
+class LeaseExpired(Exception):
+    """The job was reclaimed by another worker while this one processed it."""
+
+
+def get_lease_timeout():
+    """
+    How long a claimed job is leased to its worker. The worker renews the lease
+    while it processes the job, so a RUNNING job is only claimed again once its
+    worker stopped renewing it for this long, i.e. died.
+    """
+    return timedelta(seconds=getattr(settings, 'TEAMS_INGEST_LEASE_TIMEOUT', 10 * 60))
+
+
+def enqueue_test_run(user, payload, register_testcases=False):
+    """
+    Store a raw test run payload for later ingestion and return the job.
+    """
+    return IngestionJob.objects.create(created_by=user, payload=payload, register_testcases=register_testcases)
+
+
+def claim_next_job():
+    """
+    Atomically move the oldest pending job, or a RUNNING job whose lease
+    expired because its worker died, to RUNNING under a new lease and return
+    it, or None if there is nothing to do. Safe to call from several workers
+    at once.
+    """
+    while True:
+        now = timezone.now()
+        job = IngestionJob.objects.filter(
+            Q(status='PENDING') | Q(status='RUNNING', lease_expires_on__lt=now)
+        ).order_by('created_on', 'id').first()
+        if job is None:
+            return None
+        if job.attempts >= MAX_ATTEMPTS:
+            IngestionJob.objects.filter(pk=job.pk, status=job.status, lease_expires_on=job.lease_expires_on).update(
+                status='FAILED', finished_on=now,
+                errors={'non_field_errors': [f'Given up after {job.attempts} attempts']},
+            )
+            continue
+        claimed = IngestionJob.objects.filter(pk=job.pk, status=job.status, lease_expires_on=job.lease_expires_on).update(
+            status='RUNNING', started_on=now, lease_expires_on=now + get_lease_timeout(), attempts=F('attempts') + 1
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def renew_lease(job):
+    """
+    Extend the lease of a claimed job. Each claim increments the attempts of the
+    job, so they identify the claim this worker holds. Returns False when the
+    job was claimed by another worker meanwhile.
+    """
+    return bool(IngestionJob.objects.filter(pk=job.pk, status='RUNNING', attempts=job.attempts).update(
+        lease_expires_on=timezone.now() + get_lease_timeout()
+    ))
+
+
+@contextmanager
+def keep_lease(job):
+    """Renew the lease of a claimed job from a background thread while the block runs."""
+    stop = threading.Event()
+
+    def renew():
+        try:
+            while not stop.wait(get_lease_timeout().total_seconds() / 3):
+                try:
+                    if not renew_lease(job):
+                        return
+                except DatabaseError:
+                    pass  # Try again at the next interval; the lease still has time left
+        finally:
+            connection.close()  # Connections are per thread; don't leave this one open
+
+    thread = threading.Thread(target=renew, name=f'teams-ingest-lease-{job.pk}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def finish_job(job):
+    """
+    Record the outcome of a claimed job, provided this worker still holds its
+    claim; raises LeaseExpired otherwise.
+    """
+    finished = IngestionJob.objects.filter(pk=job.pk, status='RUNNING', attempts=job.attempts).update(
+        test_run=job.test_run, status=job.status, errors=job.errors, finished_on=job.finished_on
+    )
+    if not finished:
+        raise LeaseExpired(f'Lease of ingestion job {job.pk} expired')
+
+
+def process_job(job):
+    """
+    Ingest the payload of a claimed job exactly as POST /testruns/ would, and
+    record the outcome on the job in the same transaction, so that a job
+    reclaimed from a dead worker is never ingested twice. The lease is renewed
+    meanwhile, so a long ingestion is not claimed by another worker.
+    """
+    context = {'user': job.created_by, 'register_testcases': job.register_testcases}
+    serializer = TestRunSerializer(data=job.payload, context=context)
+    with keep_lease(job), transaction.atomic():
+        if serializer.is_valid():
+            job.test_run = serializer.save(created_by=job.created_by)
+            job.status = 'DONE'
+        else:
+            job.errors = serializer.errors
+            job.status = 'FAILED'
+        job.finished_on = timezone.now()
+        finish_job(job)
+    return job
+
+
+def process_pending_jobs(limit=None):
+    """
+    Process queued jobs until the queue is empty or `limit` jobs were handled.
+    Returns the number of processed jobs.
+    """
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        try:
+            process_job(job)
+        except LeaseExpired:
+            pass
+        except Exception as e:
+            job.test_run = None
+            job.status = 'FAILED'
+            job.errors = {'non_field_errors': [str(e)]}
+            job.finished_on = timezone.now()
+            try:
+                finish_job(job)
+            except LeaseExpired:
+                pass
+        processed += 1
+    return processed
@@ -0,0 +1,95 @@
+from datetime import timedelta
+from xml.etree.ElementTree import iterparse, ParseError as XMLParseError
+
+from rest_framework.exceptions import ParseError
+
+from teams_core.serializers import TestRunSerializer, TestExecutionSerializer
+from teams_core.utils import get_ingest_batch_size
+
+# Child elements of <testcase> that decide the result, in order of precedence
+RESULT_ELEMENTS = (
+    ('error', 'ERROR'),
+    ('failure', 'FAIL'),
+    ('skipped', 'SKIPPED'),
+)
+
+
+def _local_name(tag):
+    """Tag name without an XML namespace."""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _execution_from_testcase(element):
+    classname = element.get('classname')
+    name = element.get('name') or ''
+    execution = {
+        'testcase': f"{classname}.{name}" if classname else name,
+        'name': name,
+        'result': 'PASS',
+    }
+    if element.get('time'):
+        try:
+            execution['duration'] = timedelta(seconds=float(element.get('time')))
+        except ValueError:
+            pass
+
+    children = {_local_name(child.tag): child for child in element}
+    for tag, result in RESULT_ELEMENTS:
+        if tag in children:
+            execution['result'] = result
+            detail = children[tag]
+            notes = '\n'.join(part for part in (detail.get('message'), (detail.text or '').strip()) if part)
+            if notes:
+                execution['notes'] = notes
+            break
+    return execution
+
+
+def iter_junit_executions(source):
+    """
+    Yield one execution dict per <testcase> of a JUnit XML report, parsing the
+    file incrementally. Each testcase element is dropped from the tree once it
+    has been read, so memory use does not grow with the size of the report.
+    The OID of a test case is '<classname>.<name>', or just its name.
+    """
+    stack = []
+    try:
+        for event, element in iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                stack.append(element)
+                continue
+            stack.pop()
+            if _local_name(element.tag) == 'testcase':
+                yield _execution_from_testcase(element)
+                element.clear()
+                if stack:
+                    stack[-1].remove(element)
+    except XMLParseError as e:
+        raise ParseError(f'Invalid JUnit XML - {e}')
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_junit_report(source, test_run, register_testcases=False):
+    """
+    Stream the executions of a JUnit XML report into `test_run`, validating and
+    writing them in batches. Call it inside a transaction so that an invalid
+    report leaves nothing behind. Returns the number of executions written.
+    """
+    context = {'user': test_run.created_by, 'register_testcases': register_testcases}
+    run_serializer = TestRunSerializer(test_run, context=context)
+    imported = 0
+    for batch in _batched(iter_junit_executions(source), get_ingest_batch_size()):
+        serializer = TestExecutionSerializer(data=batch, many=True, context=context)
+        serializer.is_valid(raise_exception=True)
+        imported += len(run_serializer.append_executions(serializer.validated_data))
+    return imported
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from teams_core.outbox import dispatch_pending_events
+
+
+class Command(BaseCommand):
+    help = "Send the failure notifications recorded in the outbox during test run ingestion."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Dispatch the events currently due and exit instead of polling.")
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help="Seconds to wait between polls when no event is due.")
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Maximum number of events to dispatch per poll.")
+
+    def handle(self, *args, **options):
+        while True:
+            handled = dispatch_pending_events(limit=options['limit'])
+            if handled:
+                self.stdout.write(self.style.SUCCESS(f"Dispatched {handled} failure event(s)"))
+            if options['once']:
+                break
+            if not handled:
+                time.sleep(options['interval'])
@@ -0,0 +1,47 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.exceptions import APIException
+
+from teams_core.junit import import_junit_report
+from teams_core.models import TestRun
+
+
+class Command(BaseCommand):
+    help = "Import a JUnit XML report as a test run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('report', help="Path to the JUnit XML file.")
+        parser.add_argument('--user', required=True, help="Username the test run is created by.")
+        parser.add_argument('--run', type=int, default=None,
+                            help="Add the executions to this existing test run instead of creating one.")
+        parser.add_argument('--notes', default=None, help="Notes of the created test run.")
+        parser.add_argument('--unpublished', action='store_true', help="Create the test run unpublished.")
+        parser.add_argument('--register-testcases', action='store_true',
+                            help="Create test cases for OIDs that do not exist yet.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+
+        try:
+            with transaction.atomic(), open(options['report'], 'rb') as report:
+                if options['run']:
+                    test_run = TestRun.objects.get(pk=options['run'])
+                else:
+                    test_run = TestRun.objects.create(
+                        created_by=user,
+                        notes=options['notes'] or f"Imported from {options['report']}",
+                        published=not options['unpublished'],
+                    )
+                imported = import_junit_report(report, test_run, register_testcases=options['register_testcases'])
+        except TestRun.DoesNotExist:
+            raise CommandError(f"Test run {options['run']} does not exist")
+        except OSError as e:
+            raise CommandError(str(e))
+        except APIException as e:
+            raise CommandError(f"Import failed: {e.detail}")
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {imported} executions into test run {test_run.id}"))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from teams_core.ingest import process_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Ingest test runs queued through POST /testruns/?async=true."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Process the jobs currently queued and exit instead of polling.")
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help="Seconds to wait between polls when the queue is empty.")
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Maximum number of jobs to process per poll.")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_pending_jobs(limit=options['limit'])
+            if processed:
+                self.stdout.write(self.style.SUCCESS(f"Processed {processed} ingestion job(s)"))
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['interval'])
@@ -0,0 +1,100 @@
+import gzip
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from notifications.models import Notification
+
+from teams_core.utils import invalidate_unread_notifications
+
+
+def delete_in_batches(queryset, batch_size, archive=None, pause=0):
+    """
+    Delete the rows of `queryset` batch_size at a time, each batch in its own
+    short transaction, writing them to `archive` (a text file) as JSON lines
+    first. The rows are deleted with a single statement rather than one by one,
+    which the post_delete receiver of Notification would cause, and the cached
+    unread summaries of their recipients are dropped once per batch.
+    Returns the number of deleted rows.
+    """
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            batch = Notification.objects.filter(id__in=ids)
+            if archive is not None:
+                rows = list(batch.values())
+                for row in rows:
+                    archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                recipient_ids = {row['recipient_id'] for row in rows}
+            else:
+                recipient_ids = set(batch.values_list('recipient_id', flat=True).distinct())
+            deleted += batch._raw_delete(batch.db)
+        invalidate_unread_notifications(recipient_ids)
+        if pause:
+            time.sleep(pause)
+
+
+class Command(BaseCommand):
+    help = "Delete old notifications so that the notifications table stays at a steady size."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int,
+                            default=getattr(settings, 'TEAMS_NOTIFICATION_MAX_AGE_DAYS', 90),
+                            help="Delete read notifications older than this many days (0 disables).")
+        parser.add_argument('--max-per-user', type=int,
+                            default=getattr(settings, 'TEAMS_NOTIFICATION_MAX_PER_USER', 1000),
+                            help="Keep at most this many notifications per user, the newest ones (0 disables).")
+        parser.add_argument('--keep-deleted', action='store_true',
+                            help="Do not purge notifications the users deleted.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Rows deleted per statement.")
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Seconds to sleep between batches, to let other writers in.")
+        parser.add_argument('--archive', default=None,
+                            help="Append the deleted notifications to this gzip compressed JSON lines file.")
+
+    def handle(self, *args, **options):
+        archive = gzip.open(options['archive'], 'at', encoding='utf-8') if options['archive'] else None
+
+        def delete(queryset):
+            return delete_in_batches(queryset, options['batch_size'], archive, options['pause'])
+
+        try:
+            if not options['keep_deleted']:
+                purged = delete(Notification.objects.filter(deleted=True))
+                self.stdout.write(f"Purged {purged} deleted notification(s)")
+
+            if options['max_age']:
+                cutoff = timezone.now() - timedelta(days=options['max_age'])
+                expired = delete(Notification.objects.filter(unread=False, timestamp__lt=cutoff))
+                self.stdout.write(f"Deleted {expired} read notification(s) older than {options['max_age']} days")
+
+            if options['max_per_user']:
+                trimmed = 0
+                over_limit = list(
+                    Notification.objects.values('recipient_id')
+                    .annotate(total=Count('id'))
+                    .filter(total__gt=options['max_per_user'])
+                    .values_list('recipient_id', flat=True)
+                )
+                for recipient_id in over_limit:
+                    notifications = Notification.objects.filter(recipient_id=recipient_id)
+                    # The oldest notification to keep; everything older goes
+                    last_kept = notifications.order_by('-timestamp', '-id')[options['max_per_user'] - 1]
+                    trimmed += delete(notifications.filter(
+                        Q(timestamp__lt=last_kept.timestamp) | Q(timestamp=last_kept.timestamp, id__lt=last_kept.id)
+                    ))
+                self.stdout.write(f"Deleted {trimmed} notification(s) beyond {options['max_per_user']} per user")
+        finally:
+            if archive is not None:
+                archive.close()
+        self.stdout.write(self.style.SUCCESS("Notification retention done"))
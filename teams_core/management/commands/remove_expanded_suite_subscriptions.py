@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from teams_core.utils import remove_expanded_suite_subscriptions
+
+
+class Command(BaseCommand):
+    help = ("Delete the per test case subscriptions created by subscribing to a test suite before suite "
+            "subscriptions were resolved through suite membership. Run once after upgrading.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Rows deleted per statement.")
+
+    def handle(self, *args, **options):
+        deleted = remove_expanded_suite_subscriptions(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expanded suite subscription(s)"))
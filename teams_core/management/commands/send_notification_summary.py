@@ -1,74 +1,186 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
-from django.core.mail import send_mail
-from django.db.models import Count
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, When
 from notifications.models import Notification
 from django.urls import reverse
 from django.conf import settings
 
-from datetime import timedelta
 from urllib.parse import urljoin
 
+from teams_core.models import NotificationDigest, TestCase, TestRun
+
+
+def get_summary_delay():
+    """
+    Notifications younger than this are left to the next summary. Timestamps are
+    assigned before the notifications commit, so a watermark of the current time
+    would skip those still being written.
+    """
+    return timedelta(seconds=getattr(settings, 'TEAMS_NOTIFICATION_SUMMARY_DELAY', 60))
+
+
+def get_new_unread_notifications(until):
+    """
+    Unread notifications of users with an email address, newer than the user's
+    NotificationDigest watermark and not newer than `until`.
+    """
+    return Notification.objects.filter(
+        unread=True,
+        deleted=False,
+        timestamp__lte=until,
+        recipient__is_active=True,
+    ).exclude(recipient__email='').filter(
+        Q(recipient__notification_digest__isnull=True) |
+        Q(timestamp__gt=F('recipient__notification_digest__last_sent_on'))
+    )
+
+
+def collect_summaries(until):
+    """
+    Count the new failures of every user, and how often each test case failed.
+    Notifications about single test cases are counted with one grouped query.
+    Coalesced per-run notifications are updated in place as failures arrive, so
+    only the failures past the count a previous summary reported are new.
+    Returns {user_id: (failure_count, Counter of test case ids)} and the failure
+    count of each coalesced notification, {user_id: {notification_id: count}},
+    to be stored with mark_reported() once the summary is sent.
+    """
+    notifications = get_new_unread_notifications(until)
+    testcase_type = ContentType.objects.get_for_model(TestCase)
+    coalesced = Q(target_content_type=ContentType.objects.get_for_model(TestRun), data__isnull=False)
+
+    summaries = {}
+    grouped = (
+        notifications.exclude(coalesced)
+        .annotate(testcase_id=Case(
+            When(action_object_content_type=testcase_type, then='action_object_object_id'),
+            When(actor_content_type=testcase_type, then='actor_object_id'),
+        ))
+        .values('recipient_id', 'testcase_id')
+        .annotate(count=Count('id'))
+    )
+    for row in grouped:
+        total, tests = summaries.setdefault(row['recipient_id'], (0, Counter()))
+        if row['testcase_id'] is not None:
+            tests[int(row['testcase_id'])] += row['count']
+        summaries[row['recipient_id']] = (total + row['count'], tests)
+
+    reported = {}
+    for notification_id, recipient_id, data in notifications.filter(coalesced).values_list('id', 'recipient_id', 'data'):
+        already_reported = data.get('reported', 0)
+        if data['count'] <= already_reported:
+            continue
+        reported.setdefault(recipient_id, {})[notification_id] = data['count']
+        total, tests = summaries.setdefault(recipient_id, (0, Counter()))
+        summaries[recipient_id] = (total + data['count'] - already_reported, tests)
+        # The ids are capped like the OIDs, so failures past the cap are counted but not listed
+        tests.update(data['testcases'][already_reported:])
+    return summaries, reported
+
+
+def mark_reported(reported):
+    """
+    Store the failure count a summary reported in the data of each coalesced
+    notification, {notification_id: count}. The rows are locked so that a
+    concurrent fan-out does not lose its update of the same data.
+    """
+    if not reported:
+        return
+    with transaction.atomic():
+        notifications = list(Notification.objects.select_for_update().filter(id__in=reported.keys()).only('id', 'data'))
+        for notification in notifications:
+            notification.data['reported'] = reported[notification.id]
+        Notification.objects.bulk_update(notifications, ['data'])
+
+
+def compose_message(user, failure_count, tests, top=5):
+    uname = user.get_short_name() or user.get_username()
+    message = (
+        f"Hello {uname},\n\n"
+        f"Here is your test failure summary since the last email:\n"
+        f"- Total new failures: {failure_count}\n"
+    )
+    top_failing_tests = tests.most_common(top)
+    if top_failing_tests:
+        message += "\nTop failing tests:\n"
+        for test_id, count in top_failing_tests:
+            test_url = urljoin(settings.TEAMS_HOST_URL, reverse('teams_core:test_case_detail', args=[test_id]))
+            message += f"- Test ID: {test_id} (Failures: {count}) - {test_url}\n"
+    else:
+        message += "\nNo tests failed recently.\n"
+    return EmailMessage(
+        subject="Test Failure Summary Notification",
+        body=message,
+        from_email=settings.TEAMS_ADMIN_MAIL,
+        to=[user.email],
+    )
+
+
+def send_messages(messages):
+    """
+    Send (user, message) pairs over a single mail connection. Returns the users
+    whose message was sent, and the errors of the others.
+    """
+    sent, errors = [], []
+    with get_connection() as connection:
+        for user, message in messages:
+            message.connection = connection
+            try:
+                message.send()
+                sent.append(user)
+            except Exception as e:
+                errors.append((user, e))
+    return sent, errors
+
+
 class Command(BaseCommand):
     help = "Send a summary email for notification updates to subscribed users."
 
-    def handle(self, *args, **kwargs):
-        # Calculate the last sent time (adjust this to your desired frequency)
-        last_sent_time = timezone.now() - timedelta(days=1)
-        
-        # Retrieve all users who have unread notifications
-        users_with_notifications = User.objects.filter(
-            #notifications__timestamp__gte=last_sent_time,
-            notifications__unread=True
-        ).distinct()
-
-        #print(f'Number of users for notifications: {len(users_with_notifications)}')
-
-        for user in users_with_notifications:
-            # Filter only relevant notifications for each user
-            unread_notifications = user.notifications.filter(
-                unread=True,
-                #timestamp__gte=last_sent_time
-            )
-
-            # Calculate the failure count and find most frequently failing tests
-            failure_count = unread_notifications.count()
-            top_failing_tests = (
-                unread_notifications
-                .values('actor_object_id')  # Assume `actor_object_id` is your test case ID
-                .annotate(count=Count('id'))
-                .order_by('-count')[:5]
-            )
-            
-            # Compose email content
-            uname = user.get_short_name()
-            if ((not uname) or  (uname and len(uname)==0)):
-                uname = user.get_username()
-            message = (
-                f"Hello {uname},\n\n"
-                f"Here is your test failure summary since the last email:\n"
-                f"- Total new failures: {failure_count}\n"
-            )
-            
-            if top_failing_tests:
-                message += "\nTop failing tests:\n"
-                for test in top_failing_tests:
-                    test_id = test['actor_object_id']
-                    count = test['count']
-                    #test_url = f"https://example.com/test-case/{test_id}/"
-                    test_url = urljoin(settings.TEAMS_HOST_URL, reverse('teams_core:test_case_detail', args=[test_id]))
-                    message += f"- Test ID: {test_id} (Failures: {count}) - {test_url}\n"
-            else:
-                message += "\nNo tests failed recently.\n"
-
-            #print(message)
-            # Send email to user if they have any failures
-            send_mail(
-                subject="Test Failure Summary Notification",
-                message=message,
-                from_email=settings.TEAMS_ADMIN_MAIL,
-                recipient_list=[user.email],
-                fail_silently=False,
-            )
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Send the emails over this many mail connections in parallel.")
+        parser.add_argument('--top', type=int, default=5,
+                            help="Number of most frequently failing tests listed per email.")
+
+    def handle(self, *args, **options):
+        until = timezone.now() - get_summary_delay()
+        summaries, reported = collect_summaries(until)
+        users = User.objects.in_bulk(summaries.keys())
+        messages = [
+            (users[user_id], compose_message(users[user_id], failure_count, tests, options['top']))
+            for user_id, (failure_count, tests) in summaries.items()
+        ]
+        if not messages:
+            return
+
+        workers = max(1, min(options['workers'], len(messages)))
+        sent, errors = [], []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for chunk_sent, chunk_errors in executor.map(send_messages, [messages[i::workers] for i in range(workers)]):
+                sent += chunk_sent
+                errors += chunk_errors
+
+        # Move the watermark of the users who got their email; the others are retried next time
+        mark_reported({
+            notification_id: count
+            for user in sent
+            for notification_id, count in reported.get(user.pk, {}).items()
+        })
+        NotificationDigest.objects.bulk_create(
+            [NotificationDigest(user=user, last_sent_on=until) for user in sent],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['last_sent_on'],
+        )
+        for user in sent:
             self.stdout.write(self.style.SUCCESS(f"Sent summary email to {user.username}"))
+        for user, error in errors:
+            self.stderr.write(self.style.ERROR(f"Failed to send summary email to {user.username}: {error}"))
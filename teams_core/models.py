@@ -2,12 +2,13 @@ from django.db import models, IntegrityError, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import datetime
-from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.urls import reverse
 from django.db.models.signals import m2m_changed
 from django.dispatch import receiver
 from django.db.models import Sum
+from django.core.serializers.json import DjangoJSONEncoder
 import reversion
 
 
@@ -17,6 +18,8 @@ class TestSuite(models.Model):
     created_on = models.DateTimeField(auto_now_add=True)
     last_modified = models.DateTimeField(auto_now=True)
     author = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    # Subscriptions to a suite apply to its test cases; they are resolved through suite membership
+    subscriptions = GenericRelation('Subscription')
 
     def __str__(self):
         return self.name
@@ -88,9 +91,100 @@ class TestExecution(models.Model):
     run = models.ForeignKey(TestRun, null=False, blank=False, on_delete=models.CASCADE)
     duration = models.DurationField(blank=True, null=True)  # Track how long the test took
 
+    class Meta:
+        unique_together = ('run', 'testcase')
+
     def __str__(self):
         return f'TE on {self.date} for {self.testcase}'
     
+class IngestionJob(models.Model):
+    """
+    A test run payload accepted by the API and waiting to be ingested by the
+    process_ingestion_jobs worker.
+    """
+    STATUS_CHOICES = [
+        ("PENDING", "Waiting to be processed"),
+        ("RUNNING", "Being processed"),
+        ("DONE", "Processed successfully"),
+        ("FAILED", "Processing failed"),
+    ]
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    payload = models.JSONField()
+    register_testcases = models.BooleanField(default=False)  # Create unknown OIDs as placeholder test cases
+    status = models.CharField(choices=STATUS_CHOICES, max_length=10, default="PENDING")
+    errors = models.JSONField(blank=True, null=True)
+    test_run = models.ForeignKey(TestRun, null=True, blank=True, on_delete=models.SET_NULL)
+    created_on = models.DateTimeField(auto_now_add=True)
+    started_on = models.DateTimeField(blank=True, null=True)
+    finished_on = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    lease_expires_on = models.DateTimeField(blank=True, null=True)  # A RUNNING job is reclaimed after this time
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_on'])]
+
+    def __str__(self):
+        return f'Ingestion job {self.id} ({self.status})'
+
+class IdempotencyKey(models.Model):
+    """
+    The stored response of a write request made with an Idempotency-Key header,
+    replayed when the same user retries with the same key. The row is created
+    before the request runs, to reserve the key against concurrent retries.
+    """
+    key = models.CharField(max_length=255)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=1024)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)  # None while the request is in flight
+    response = models.JSONField(encoder=DjangoJSONEncoder, blank=True, null=True)
+    headers = models.JSONField(blank=True, null=True)
+    fingerprint = models.CharField(max_length=64, blank=True)  # SHA-256 of the query string and body
+    created_on = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.key})'
+
+class FailureEvent(models.Model):
+    """
+    Outbox entry for the failed executions of one ingest batch. It is written in
+    the same transaction as the executions and turned into notifications after
+    commit by teams_core.outbox, which retries it with backoff on errors.
+    """
+    STATUS_CHOICES = [
+        ("PENDING", "Waiting to be dispatched"),
+        ("DONE", "Notifications sent"),
+        ("FAILED", "Gave up after repeated errors"),
+    ]
+    test_run = models.ForeignKey(TestRun, on_delete=models.CASCADE)
+    testcases = models.JSONField()  # Primary keys of the failed test cases
+    status = models.CharField(choices=STATUS_CHOICES, max_length=10, default="PENDING")
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    available_on = models.DateTimeField(default=timezone.now)  # Not dispatched before this time
+    created_on = models.DateTimeField(auto_now_add=True)
+    dispatched_on = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'available_on'])]
+
+    def __str__(self):
+        return f'Failure event {self.id} of {self.test_run} ({self.status})'
+
+class NotificationDigest(models.Model):
+    """
+    Watermark of the send_notification_summary command: notifications of the
+    user up to last_sent_on have been included in a summary email.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='notification_digest')
+    last_sent_on = models.DateTimeField()
+
+    def __str__(self):
+        return f'Notification summary of {self.user} sent on {self.last_sent_on}'
+
 class Subscription(models.Model):
     EVENT_CHOICES = [
         ('TEST_EXECUTION_FAIL', 'Test Execution Failure'),
@@ -0,0 +1,119 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from teams_core.fanout import send_failure_notifications
+from teams_core.models import FailureEvent, TestExecution
+
+# A claimed event is handed to another worker if it is not finished within this time
+CLAIM_TIMEOUT = timedelta(minutes=5)
+# First retry delay; doubled after every further failed attempt
+RETRY_BACKOFF = timedelta(seconds=30)
+
+
+def get_max_attempts():
+    """How many times an event is tried before it is marked FAILED."""
+    return getattr(settings, 'TEAMS_NOTIFICATION_MAX_ATTEMPTS', 5)
+
+
+def get_worker_count():
+    """Threads dispatching events after commit; 0 leaves them to the dispatch_notifications command."""
+    return getattr(settings, 'TEAMS_NOTIFICATION_WORKERS', 2)
+
+
+def record_failure_event(test_run, executions):
+    """
+    Record the failed executions of an ingest batch in the outbox, as part of
+    the current transaction, and have them dispatched once it commits.
+    """
+    testcases = [execution.testcase.pk for execution in executions if execution.result == 'FAIL']
+    if not testcases:
+        return None
+    event = FailureEvent.objects.create(test_run=test_run, testcases=testcases)
+    if get_worker_count():
+        transaction.on_commit(_dispatch_in_background)
+    return event
+
+
+def claim_next_event():
+    """
+    Claim the oldest event that is due, or return None. The claim pushes the
+    event's available_on past CLAIM_TIMEOUT, so concurrent workers skip it and
+    it is picked up again if this worker dies before finishing it.
+    """
+    while True:
+        now = timezone.now()
+        event = FailureEvent.objects.filter(status='PENDING', available_on__lte=now).order_by('available_on', 'id').first()
+        if event is None:
+            return None
+        claimed = FailureEvent.objects.filter(pk=event.pk, status='PENDING', available_on=event.available_on).update(
+            available_on=now + CLAIM_TIMEOUT, attempts=F('attempts') + 1
+        )
+        if claimed:
+            event.refresh_from_db()
+            return event
+
+
+def dispatch_event(event):
+    """
+    Send the notifications of a claimed event. They are written in the same
+    transaction that marks the event DONE, so a retry never notifies twice.
+    Test cases that no longer fail in the run are left out.
+    """
+    with transaction.atomic():
+        executions = TestExecution.objects.filter(
+            run=event.test_run, testcase_id__in=event.testcases, result='FAIL'
+        ).select_related('testcase').defer('testcase__content')
+        send_failure_notifications(event.test_run, executions)
+        event.status = 'DONE'
+        event.dispatched_on = timezone.now()
+        event.last_error = None
+        event.save(update_fields=['status', 'dispatched_on', 'last_error'])
+
+
+def dispatch_pending_events(limit=None):
+    """
+    Dispatch due events until none are left or `limit` were handled. Failed
+    events are retried with exponential backoff, up to get_max_attempts() tries.
+    Returns the number of handled events.
+    """
+    handled = 0
+    while limit is None or handled < limit:
+        event = claim_next_event()
+        if event is None:
+            break
+        try:
+            dispatch_event(event)
+        except Exception as e:
+            event.last_error = str(e)
+            if event.attempts >= get_max_attempts():
+                event.status = 'FAILED'
+            else:
+                event.available_on = timezone.now() + RETRY_BACKOFF * (2 ** (event.attempts - 1))
+            event.save(update_fields=['status', 'available_on', 'last_error'])
+        handled += 1
+    return handled
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _dispatch_in_background():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_worker_count(), thread_name_prefix='teams-notify')
+    _executor.submit(_dispatch_worker)
+
+
+def _dispatch_worker():
+    try:
+        dispatch_pending_events()
+    finally:
+        connection.close()  # Connections are per thread; don't leave this one open
@@ -0,0 +1,60 @@
+import json
+
+import msgpack
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONLines:
+    """
+    Iterates over the records of a newline-delimited JSON stream, one line at a
+    time. line_number is the physical line of the last record returned, blank
+    lines included, so that errors can point at the line of the body.
+    """
+    def __init__(self, stream, encoding):
+        self._lines = enumerate(stream if stream is not None else (), start=1)
+        self.encoding = encoding
+        self.line_number = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for line_number, line in self._lines:
+            line = line.strip()
+            if not line:
+                continue
+            self.line_number = line_number
+            try:
+                return json.loads(line.decode(self.encoding))
+            except ValueError as exc:
+                raise ParseError(f'NDJSON parse error on line {line_number} - {exc}')
+        raise StopIteration
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline-delimited JSON lazily. The parsed data is an NDJSONLines
+    iterator that reads one line at a time from the request stream, so the body
+    is never held in memory as a whole. Blank lines are skipped.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return NDJSONLines(stream, encoding)
+
+
+class MessagePackParser(BaseParser):
+    """
+    Parses MessagePack encoded request bodies.
+    """
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
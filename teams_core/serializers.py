@@ -1,8 +1,10 @@
 from rest_framework import serializers
-from .models import TestRun, TestExecution, TestCase, TestSuite
+from django.utils.encoding import smart_str
+from reversion import add_to_revision, create_revision, set_comment, set_user
+from .models import TestRun, TestExecution, TestCase, TestSuite, IngestionJob
 from django.contrib.auth.models import Group, User
-from notifications.signals import notify
 from teams_core.utils import *
+from teams_core.outbox import record_failure_event
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -28,6 +30,15 @@ class TestCaseSerializer(serializers.ModelSerializer):
             'oid': {'required': False},
         }
 
+class TestCaseBulkSerializer(serializers.Serializer):
+    """
+    One entry of a bulk test case upsert. Only the OID and name are required.
+    """
+    oid = serializers.CharField(max_length=1024)
+    name = serializers.CharField(max_length=255)
+    content = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    version = serializers.CharField(max_length=20, required=False)
+
 class TestSuiteSerializer(serializers.ModelSerializer):
     testcases = serializers.PrimaryKeyRelatedField(many=True, write_only=True, queryset=TestCase.objects.all())
     author = serializers.ReadOnlyField(source='author.username')
@@ -60,11 +71,68 @@ class TestSuiteSerializer(serializers.ModelSerializer):
         return representation  # Return the modified representation
 
 
+class TestCaseOIDField(serializers.SlugRelatedField):
+    """
+    Resolves a TestCase by OID. When the enclosing list serializer has prefetched
+    the OIDs of the whole payload, lookups are served from that map instead of
+    issuing one query per row.
+    """
+    def __init__(self, **kwargs):
+        kwargs.setdefault('slug_field', 'oid')
+        super().__init__(**kwargs)
+        self.prefetched = None
+
+    def to_internal_value(self, data):
+        if self.prefetched is None:
+            return super().to_internal_value(data)
+        try:
+            return self.prefetched[smart_str(data)]
+        except (KeyError, TypeError):
+            self.fail('does_not_exist', slug_name=self.slug_field, value=smart_str(data))
+
+
+class TestExecutionListSerializer(serializers.ListSerializer):
+    """
+    Validates a list of executions with a single OID lookup for the whole batch.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Rows are nested under a run that may not exist yet; the (run, testcase)
+        # uniqueness is enforced by the upsert in TestRunSerializer instead.
+        self.child.validators = []
+
+    def to_internal_value(self, data):
+        oid_field = self.child.fields['testcase']
+        if isinstance(data, list):
+            items = [item for item in data if isinstance(item, dict) and isinstance(item.get('testcase'), (str, int))]
+            oid_field.prefetched = get_testcases_by_oid(smart_str(item['testcase']) for item in items)
+            if self.context.get('register_testcases'):
+                self._add_placeholders(oid_field.prefetched, items)
+        try:
+            return super().to_internal_value(data)
+        finally:
+            oid_field.prefetched = None
+
+    def _add_placeholders(self, testcases, items):
+        """
+        Stand in unsaved TestCases for the unknown OIDs, to be created along with
+        the executions by TestRunSerializer.
+        """
+        max_oid_length = TestCase._meta.get_field('oid').max_length
+        max_name_length = TestCase._meta.get_field('name').max_length
+        for item in items:
+            oid = smart_str(item['testcase'])
+            if oid and oid not in testcases and len(oid) <= max_oid_length:
+                name = smart_str(item.get('name') or oid)[:max_name_length]
+                testcases[oid] = TestCase(oid=oid, name=name)
+
+
 class TestExecutionSerializer(serializers.ModelSerializer):
-    testcase = serializers.SlugRelatedField(slug_field='oid', queryset=TestCase.objects.all())
+    testcase = TestCaseOIDField(queryset=TestCase.objects.all())
 
     class Meta:
         model = TestExecution
+        list_serializer_class = TestExecutionListSerializer
         fields = ['id', 'date', 'testcase', 'result', 'notes', 'duration', 'run']
         extra_kwargs = {
             'testcase': {'required': True},
@@ -88,7 +156,7 @@ class TestRunSerializer(serializers.ModelSerializer):
         }
     
     def validate(self, data):
-        user = self.context['request'].user
+        user = self._get_user()
         if self.instance is None:  # Only check for uniqueness if creating a new instance
             if TestRun.objects.filter(date=data['date'], created_by=user).exists():
                 raise serializers.ValidationError("A test run with this timestamp already exists for this user.")
@@ -97,11 +165,9 @@ class TestRunSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         executions_data = validated_data.pop('executions', [])
         test_run = TestRun.objects.create(**validated_data)
-        for execution_data in executions_data:
-            execution = TestExecution.objects.create(run=test_run, **execution_data)
-            # Send notification if the test case failed
-            if execution.result == 'FAIL':
-                self._send_failure_notification(execution)
+        executions = self._upsert_executions(test_run, executions_data)
+        # Queue notifications for the failed test cases, sent once the transaction commits
+        record_failure_event(test_run, executions)
         return test_run
 
     def update(self, instance, validated_data):
@@ -112,54 +178,93 @@ class TestRunSerializer(serializers.ModelSerializer):
 
         if executions_data is not None:
             # Update or create TestExecution instances
-            for execution_data in executions_data:
-                execution, created = TestExecution.objects.update_or_create(
-                    run=instance,
-                    testcase=execution_data['testcase'],
-                    defaults={
-                        'result': execution_data['result'],
-                        'notes': execution_data.get('notes', ''),
-                        'duration': execution_data.get('duration', None)
-                    }
-                )
-                # Send notification if the test case failed and is newly created or updated to fail
-                if execution.result == 'FAIL' and (created or execution_data['result'] == 'FAIL'):
-                    self._send_failure_notification(execution)
+            executions = self._upsert_executions(instance, executions_data)
+            # Queue a notification for every test case that is newly created or updated to fail
+            record_failure_event(instance, executions)
         return instance  # Return the instance to be processed by DRF
     
     def to_representation(self, instance):
         """Customize the representation to include serialized executions."""
         representation = super().to_representation(instance)  # Call the parent method
-        representation['executions'] = TestExecutionSerializer(instance.testexecution_set.all(), many=True).data
+        executions = instance.testexecution_set.select_related('testcase').defer('testcase__content')
+        representation['executions'] = TestExecutionSerializer(executions, many=True).data
         return representation  # Return the modified representation
-    
-    def _send_failure_notification(self, execution):
-        # Get the author of the test case
-        test_case = execution.testcase
-        test_case_author = test_case.author
-
-        # Compose the message content
-        message = f"Test Case '{execution.testcase.oid}' failed during the test run on {execution.run.date}."
-        # Check if the author exists
-        if test_case_author:
-            # Send a notification to the test case author
-            notify.send(
-                sender=execution.run.created_by,
-                recipient=test_case_author,
-                verb=f'{execution.testcase.oid} failed',
-                description=message,
-                target=execution.run,
-                action_object=execution.testcase,
-            )
-        
-        if execution.run.published:
-            subscribers = get_active_subscribers('TEST_EXECUTION_FAIL', test_case)
-            for subscriber in subscribers:
-                    notify.send(
-                        sender=execution.run.created_by,
-                        recipient=subscriber,
-                        verb=f'{execution.testcase.oid} failed',
-                        description=message,
-                        target=execution.run,
-                        action_object=execution.testcase
-                    )
+
+    def _get_user(self):
+        """The submitting user, from the request or, for queued ingestion, the context."""
+        if 'request' in self.context:
+            return self.context['request'].user
+        return self.context.get('user')
+
+    def append_executions(self, executions_data):
+        """
+        Upsert a batch of executions into an existing run, leaving its other executions untouched.
+        """
+        executions = self._upsert_executions(self.instance, executions_data)
+        record_failure_event(self.instance, executions)
+        return executions
+
+    def _upsert_executions(self, test_run, executions_data):
+        """
+        Insert or update the executions of a run in batched statements, relying on
+        the (run, testcase) uniqueness. Later entries for the same test case win.
+        """
+        self._create_placeholders(test_run, executions_data)
+        executions = {}
+        for execution_data in executions_data:
+            execution_data.pop('run', None)
+            executions[execution_data['testcase'].pk] = TestExecution(run=test_run, **execution_data)
+        return TestExecution.objects.bulk_create(
+            list(executions.values()),
+            batch_size=get_ingest_batch_size(),
+            update_conflicts=True,
+            unique_fields=['run', 'testcase'],
+            update_fields=['result', 'notes', 'duration'],
+        )
+
+    def _create_placeholders(self, test_run, executions_data):
+        """
+        Save the placeholder test cases of unknown OIDs, authored by the run creator,
+        and point the executions at the saved rows. OIDs registered meanwhile by a
+        concurrent request are left as they are and used instead.
+        """
+        placeholders = {}
+        for execution_data in executions_data:
+            if execution_data['testcase'].pk is None:
+                placeholders[execution_data['testcase'].oid] = execution_data['testcase']
+        if not placeholders:
+            return
+        for test_case in placeholders.values():
+            test_case.author = test_run.created_by
+        batch_size = get_ingest_batch_size()
+        TestCase.objects.bulk_create(placeholders.values(), batch_size=batch_size, ignore_conflicts=True)
+        # ignore_conflicts leaves the primary keys unset, so read the rows back
+        oids = list(placeholders)
+        saved = {}
+        for start in range(0, len(oids), batch_size):
+            for test_case in TestCase.objects.filter(oid__in=oids[start:start + batch_size]):
+                saved[test_case.oid] = test_case
+        for execution_data in executions_data:
+            if execution_data['testcase'].pk is None:
+                execution_data['testcase'] = saved[execution_data['testcase'].oid]
+
+        created = [test_case for test_case in saved.values()
+                   if test_run.created_by_id and test_case.author_id == test_run.created_by_id]
+        if created:
+            # bulk_create skips the post_save signal, so record the revision and subscribe the author here
+            with create_revision():
+                for test_case in created:
+                    add_to_revision(test_case)
+                set_user(test_run.created_by)
+                set_comment(f"Registered by test run {test_run.pk}")
+            bulk_add_subscriptions(test_run.created_by, 'TEST_EXECUTION_FAIL', created)
+
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+    created_by = serializers.ReadOnlyField(source='created_by.username')
+
+    class Meta:
+        model = IngestionJob
+        fields = ['id', 'status', 'created_by', 'test_run', 'errors',
+                  'created_on', 'started_on', 'finished_on']
+        read_only_fields = fields
@@ -1,71 +1,79 @@
-from django.db.models.signals import m2m_changed, post_save, pre_save
+from django.db.models.signals import m2m_changed, post_init, post_save, pre_save, post_delete
 from django.dispatch import receiver
 from django.contrib.contenttypes.models import ContentType
-from .models import TestCase, Subscription, TestSuite
-from django.contrib.auth.models import User
-from .utils import add_subscription, remove_subscription
+from .models import TestCase
+from .utils import subscribe_users, unsubscribe_users, invalidate_unread_notifications
+from notifications.models import Notification
+
+# Marks an author id that was deferred when the TestCase was loaded
+UNKNOWN_AUTHOR = object()
 
 @receiver(m2m_changed, sender=TestCase.maintainers.through)
-def manage_subscriptions(sender, instance, action, pk_set, **kwargs):
+def manage_subscriptions(sender, instance, action, reverse, pk_set, **kwargs):
     """
-    Manage subscriptions when maintainers are added or removed.
+    Manage subscriptions when maintainers are added or removed, from either side
+    of the relation, with one bulk statement per change however many users or
+    test cases are involved.
     """
+    if action == "pre_clear":
+        # The cleared side is gone by post_clear, so remember it now
+        related = instance.maintained_cases if reverse else instance.maintainers
+        instance._cleared_pks = set(related.values_list('id', flat=True))
+        return
+    if action == "post_clear":
+        action, pk_set = "post_remove", instance.__dict__.pop('_cleared_pks', set())
+    if action not in ("post_add", "post_remove") or not pk_set:
+        return
+
+    user_ids, case_ids = ([instance.pk], list(pk_set)) if reverse else (list(pk_set), [instance.pk])
+    case_type = ContentType.objects.get_for_model(TestCase)
     if action == "post_add":
-        for user_id in pk_set:
-            user = User.objects.get(pk=user_id)
-            add_subscription(user, 'TEST_EXECUTION_FAIL', instance)
-    elif action == "post_remove":
-        for user_id in pk_set:
-            user = User.objects.get(pk=user_id)
-            remove_subscription(user, 'TEST_EXECUTION_FAIL', instance)
-    elif action == "post_clear":
-        # Remove all subscriptions related to this TestCase for TEST_EXECUTION_FAIL
-        Subscription.objects.filter(
-            event_type='TEST_EXECUTION_FAIL',
-            content_type=ContentType.objects.get_for_model(instance),
-            object_id=instance.id,
-            user__in=instance.maintainers.all()
-        ).update(active=False)
+        subscribe_users(user_ids, 'TEST_EXECUTION_FAIL', case_type, case_ids)
+    else:
+        unsubscribe_users(user_ids, 'TEST_EXECUTION_FAIL', case_type, case_ids)
 
-@receiver(m2m_changed, sender=TestSuite.testcase_set.through)
-def handle_test_suite_test_case_add(sender, instance, action, pk_set, **kwargs):
+@receiver(post_init, sender=TestCase)
+def remember_loaded_author(sender, instance, **kwargs):
     """
-    Handle subscriptions when TestCases are added to a TestSuite.
+    Remember the author a TestCase was loaded with, so that saving it can tell
+    whether the author changed without reading the row again.
     """
-    if action == "post_add":
-        case_type = ContentType.objects.get_for_model(TestCase)
-        suite_subscribers = Subscription.objects.filter(
-            event_type="TEST_EXECUTION_FAIL",
-            content_type=ContentType.objects.get_for_model(instance),
-            object_id=instance.id,
-            active=True
-        ).values_list("user", flat=True)
-
-        for test_case_id in pk_set:
-            for user_id in suite_subscribers:
-                Subscription.objects.get_or_create(
-                    user_id=user_id,
-                    content_type=case_type,
-                    object_id=test_case_id,
-                    event_type="TEST_EXECUTION_FAIL"
-                )
+    # Read __dict__ so that a deferred author is not fetched just for this
+    instance._loaded_author_id = instance.__dict__.get('author_id', UNKNOWN_AUTHOR)
 
 @receiver(pre_save, sender=TestCase)
-def track_author_change(sender, instance, **kwargs):
+def track_author_change(sender, instance, update_fields=None, **kwargs):
     """
-    Track changes to the author of a TestCase and manage subscriptions accordingly.
+    Track changes to the author of a TestCase and unsubscribe the previous author.
     """
-    if instance.pk:  # Only for updates, not creation
+    instance._author_changed = False
+    if instance._state.adding:  # Only for updates, not creation
+        return
+    if update_fields is not None and not {'author', 'author_id'} & set(update_fields):
+        return
+    old_author = instance._loaded_author_id
+    if old_author is UNKNOWN_AUTHOR:
         old_author = sender.objects.filter(pk=instance.pk).values_list('author', flat=True).first()
-        if old_author and old_author != instance.author_id:
-            # Remove subscription for the old author
-            old_user = User.objects.get(pk=old_author)
-            remove_subscription(old_user, 'TEST_EXECUTION_FAIL', instance)
+    if old_author != instance.author_id:
+        instance._author_changed = True
+        if old_author:
+            unsubscribe_users([old_author], 'TEST_EXECUTION_FAIL', ContentType.objects.get_for_model(instance), [instance.pk])
 
 @receiver(post_save, sender=TestCase)
 def subscribe_author_on_create_or_update(sender, instance, created, **kwargs):
     """
-    Subscribe the author to TEST_EXECUTION_FAIL notifications when a TestCase is created or updated.
+    Subscribe the author to TEST_EXECUTION_FAIL notifications when a TestCase is
+    created or its author changes. Other saves do not touch subscriptions.
+    """
+    if instance.author_id and (created or instance._author_changed):
+        subscribe_users([instance.author_id], 'TEST_EXECUTION_FAIL', ContentType.objects.get_for_model(instance), [instance.pk])
+    instance._loaded_author_id = instance.author_id
+
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def invalidate_unread_notifications_cache(sender, instance, **kwargs):
+    """
+    Drop the cached unread summary of the recipient when one of their notifications
+    is created, marked (un)read or deleted. Bulk writes invalidate it themselves.
     """
-    if instance.author:
-        add_subscription(instance.author, 'TEST_EXECUTION_FAIL', instance)
\ No newline at end of file
+    invalidate_unread_notifications([instance.recipient_id])
@@ -1,22 +1,22 @@
 # Inside yourapp/templatetags/subscription_tags.py
 from django import template
 from django.contrib.contenttypes.models import ContentType
-from teams_core.models import Subscription
+from teams_core.utils import get_subscribed_objects
 
 register = template.Library()
 
 @register.filter
 def is_subscribed(user, obj):
-    """Check if the user is subscribed to an event for a specific object."""
-    content_type = ContentType.objects.get_for_model(obj)
-    return Subscription.objects.filter(
-        user=user,
-        content_type=content_type,
-        object_id=obj.id,
-        event_type='TEST_EXECUTION_FAIL',
-        active=True
-    ).exists()
+    """
+    Check if the user is subscribed to an event for a specific object. The
+    user's subscriptions are loaded once per request, however many objects
+    are checked.
+    """
+    if not user.is_authenticated:
+        return False
+    content_type = ContentType.objects.get_for_model(obj)  # Cached by ContentTypeManager
+    return (content_type.id, obj.id) in get_subscribed_objects(user, 'TEST_EXECUTION_FAIL')
 
 @register.filter
 def model_name(value):
-    return ContentType.objects.get_for_model(value).model
+    return value._meta.model_name
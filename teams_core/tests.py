@@ -1,3 +1,10 @@
+import gzip
+import os
+import tempfile
+from unittest import mock
+from io import StringIO
+import json
+import msgpack
 from django.test import TestCase as UnitTestCase
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
@@ -14,16 +21,32 @@ from teams_core.serializers import *
 from teams_core.models import *
 
 from django.core import mail
+from django.core.cache import cache
+from django.template import Context, Template
+from django.template.loader import render_to_string
+from django.utils.functional import SimpleLazyObject
+from notifications.signals import notify
 from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.contenttypes.models import ContentType
 from notifications.models import Notification
 from django.utils import timezone
 from datetime import timedelta
 
 from teams_core.metrics import *
+from teams_core.ingest import LeaseExpired, claim_next_job, process_job, process_pending_jobs, renew_lease
+
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.conf import settings
+from django.test import override_settings
 
 from reversion.models import Version
-from teams_core.utils import create_new_version
+from teams_core.utils import create_new_version, bulk_add_subscriptions, get_unread_notifications_summary
+from teams_core.fanout import send_failure_notifications
+from teams_core.outbox import dispatch_pending_events
+from teams_core.admission import AdmissionController
 
 User = get_user_model()
 
@@ -107,6 +130,622 @@ class Test_TestRuns(Test_Serializers):
         self.assertEqual(TestRun.objects.count(), 0)
         self.assertEqual(TestExecution.objects.count(), 0)
 
+    def test_create_test_run_bulk_queries(self):
+        """
+        Test that the number of queries to ingest a TestRun does not grow with the number of executions.
+        """
+        for i in range(3, 43):
+            TestCase.objects.create(name=f'Test Case {i}', oid=f'TC{i:03d}')
+
+        small_run = dict(self.test_run_data, date=timezone.now().isoformat())
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.post(reverse('teams_core:testrun-list'), small_run, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        large_run = {
+            "date": (timezone.now() + timedelta(minutes=1)).isoformat(),
+            "notes": "Large Test Run",
+            "executions": [
+                {"testcase": f"TC{i:03d}", "result": "PASS", "duration": "0:01:00"}
+                for i in range(3, 43)
+            ]
+        }
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.post(reverse('teams_core:testrun-list'), large_run, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['executions']), 40)
+        self.assertLessEqual(len(large.captured_queries), len(small.captured_queries))
+
+    @override_settings(TEAMS_NOTIFICATION_COALESCE=False)
+    def test_failure_notifications_batched(self):
+        """
+        Test that failure notifications are written in a constant number of queries,
+        one per recipient and failed test case.
+        """
+        subscriber = User.objects.create_user(username='subscriber', password='password')
+        test_cases = [TestCase.objects.create(name=f'Test Case {i}', oid=f'TC{i:03d}', author=self.test_user)
+                      for i in range(3, 23)]
+        bulk_add_subscriptions(subscriber, 'TEST_EXECUTION_FAIL', test_cases)
+        Notification.objects.all().delete()
+
+        test_run = TestRun.objects.create(created_by=self.test_user, notes='Failing run')
+        executions = [TestExecution.objects.create(run=test_run, testcase=tc, result='FAIL') for tc in test_cases]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(send_failure_notifications(test_run, executions), 40)
+        self.assertLessEqual(len(queries.captured_queries), 4)
+        self.assertEqual(Notification.objects.filter(recipient=subscriber).count(), 20)
+        # The author is subscribed to their test cases too, but only notified once per failure
+        self.assertEqual(Notification.objects.filter(recipient=self.test_user, verb='TC003 failed').count(), 1)
+        notification = Notification.objects.get(recipient=subscriber, verb='TC003 failed')
+        self.assertEqual(notification.target, test_run)
+        self.assertEqual(notification.action_object, test_cases[0])
+
+        # Subscribers are only notified about published runs
+        TestRun.objects.filter(pk=test_run.pk).update(published=False)
+        test_run.refresh_from_db()
+        self.assertEqual(send_failure_notifications(test_run, executions), 20)
+
+    def test_failure_notifications_coalesced(self):
+        """
+        Test that every recipient gets one notification per run, updated by later batches while unread.
+        """
+        subscriber = User.objects.create_user(username='subscriber', password='password')
+        test_cases = [TestCase.objects.create(name=f'Test Case {i}', oid=f'TC{i:03d}', author=self.test_user)
+                      for i in range(3, 13)]
+        bulk_add_subscriptions(subscriber, 'TEST_EXECUTION_FAIL', test_cases)
+        test_run = TestRun.objects.create(created_by=self.test_user, notes='Failing run')
+        executions = [TestExecution.objects.create(run=test_run, testcase=tc, result='FAIL') for tc in test_cases]
+
+        self.assertEqual(send_failure_notifications(test_run, executions[:6]), 2)
+        self.assertEqual(send_failure_notifications(test_run, executions[4:]), 2)
+        self.assertEqual(Notification.objects.count(), 2)
+        notification = Notification.objects.get(recipient=subscriber)
+        self.assertEqual(notification.target, test_run)
+        self.assertEqual(notification.data['count'], 10)
+        self.assertEqual(notification.data['oids'], [tc.oid for tc in test_cases])
+        self.assertTrue(notification.description.startswith('10 test case(s) failed'))
+
+        # Once read, new failures of the run start a new notification
+        notification.mark_as_read()
+        send_failure_notifications(test_run, executions[:1])
+        self.assertEqual(subscriber.notifications.unread().get().data,
+                         {'count': 1, 'oids': ['TC003'], 'testcases': [test_cases[0].pk]})
+
+    def test_failure_notifications_coalesced_count_beyond_shown_oids(self):
+        """
+        Test that failures past the OIDs a coalesced notification shows are not counted again when re-delivered.
+        """
+        test_cases = TestCase.objects.bulk_create([
+            TestCase(name=f'Test Case {i}', oid=f'TC{i:04d}', author=self.test_user) for i in range(1000, 1150)
+        ])
+        test_run = TestRun.objects.create(created_by=self.test_user, notes='Failing run')
+        executions = TestExecution.objects.bulk_create([
+            TestExecution(run=test_run, testcase=tc, result='FAIL') for tc in test_cases
+        ])
+
+        send_failure_notifications(test_run, executions)
+        send_failure_notifications(test_run, executions)
+        notification = Notification.objects.get(recipient=self.test_user, verb=f'Test run {test_run.pk} has failures')
+        self.assertEqual(notification.data['count'], 150)
+        self.assertEqual(len(notification.data['oids']), 100)
+        self.assertEqual(len(notification.data['testcases']), 100)
+        self.assertTrue(notification.description.startswith('150 test case(s) failed'))
+
+    def test_failure_notifications_dispatched_after_commit(self):
+        """
+        Test that failures are recorded in the outbox during ingest and notified on dispatch.
+        """
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('teams_core:testrun-list'), self.test_run_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(callbacks), 1)
+        event = FailureEvent.objects.get()
+        self.assertEqual(event.testcases, [self.test_case_2.pk])
+        self.assertFalse(Notification.objects.exists())
+
+        self.assertEqual(dispatch_pending_events(), 1)
+        event.refresh_from_db()
+        self.assertEqual(event.status, 'DONE')
+        self.assertEqual(Notification.objects.filter(recipient=self.test_user).count(), 1)
+        self.assertEqual(dispatch_pending_events(), 0)
+
+    def test_failure_event_retried(self):
+        """
+        Test that a failing dispatch is retried with backoff and eventually given up.
+        """
+        test_run = TestRun.objects.create(created_by=self.test_user)
+        TestExecution.objects.create(run=test_run, testcase=self.test_case_2, result='FAIL')
+        event = FailureEvent.objects.create(test_run=test_run, testcases=[self.test_case_2.pk])
+
+        with mock.patch('teams_core.outbox.send_failure_notifications', side_effect=RuntimeError('mail down')):
+            self.assertEqual(dispatch_pending_events(), 1)
+            event.refresh_from_db()
+            self.assertEqual((event.status, event.attempts, event.last_error), ('PENDING', 1, 'mail down'))
+            self.assertGreater(event.available_on, timezone.now())
+            self.assertEqual(dispatch_pending_events(), 0)  # Not due yet
+
+            with override_settings(TEAMS_NOTIFICATION_MAX_ATTEMPTS=2):
+                FailureEvent.objects.update(available_on=timezone.now())
+                dispatch_pending_events()
+            event.refresh_from_db()
+            self.assertEqual((event.status, event.attempts), ('FAILED', 2))
+        self.assertFalse(Notification.objects.exists())
+
+    def test_create_test_run_unknown_oid(self):
+        """
+        Test that a TestRun referring to an unknown test case is rejected as a whole.
+        """
+        self.test_run_data['executions'].append({"testcase": "TC404", "result": "PASS"})
+        response = self.client.post(reverse('teams_core:testrun-list'), self.test_run_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(TestRun.objects.count(), 0)
+        self.assertEqual(TestExecution.objects.count(), 0)
+
+    def test_update_test_run_upserts_executions(self):
+        """
+        Test that re-submitting executions of a TestRun updates them in place instead of duplicating them.
+        """
+        response = self.client.post(reverse('teams_core:testrun-list'), self.test_run_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        test_run_id = response.data['id']
+
+        update_data = {
+            "notes": "Rerun",
+            "executions": [
+                {"testcase": "TC002", "result": "FAIL", "notes": "Still failing"},
+                {"testcase": "TC002", "result": "PASS", "notes": "Passed on retry"},
+            ]
+        }
+        response = self.client.put(reverse('teams_core:testrun-detail', args=[test_run_id]), update_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(TestExecution.objects.count(), 2)
+        execution = TestExecution.objects.get(run_id=test_run_id, testcase=self.test_case_2)
+        self.assertEqual(execution.result, 'PASS')
+        self.assertEqual(execution.notes, 'Passed on retry')
+
+    def test_append_executions(self):
+        """
+        Test appending batches of executions to an existing TestRun.
+        """
+        TestCase.objects.create(name='Test Case 3', oid='TC003')
+        self.test_run_data['executions'] = self.test_run_data['executions'][:1]
+        response = self.client.post(reverse('teams_core:testrun-list'), self.test_run_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        append_url = reverse('teams_core:testrun-append-executions', args=[response.data['id']])
+
+        response = self.client.post(append_url, {"executions": [
+            {"testcase": "TC002", "result": "FAIL", "notes": "Failed at step 3"},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'received': 1, 'appended': 1, 'total': 2})
+
+        response = self.client.post(append_url, [{"testcase": "TC003", "result": "PASS"}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], 3)
+
+        response = self.client.post(append_url, [{"testcase": "TC404", "result": "PASS"}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(TestExecution.objects.count(), 3)
+
+    def test_stream_executions(self):
+        """
+        Test streaming executions to an existing TestRun as newline-delimited JSON.
+        """
+        for i in range(3, 13):
+            TestCase.objects.create(name=f'Test Case {i}', oid=f'TC{i:03d}')
+        self.test_run_data['executions'] = []
+        response = self.client.post(reverse('teams_core:testrun-list'), self.test_run_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        stream_url = reverse('teams_core:testrun-stream-executions', args=[response.data['id']])
+
+        lines = [json.dumps({"testcase": f"TC{i:03d}", "result": "PASS", "duration": "0:00:10"}) for i in range(1, 13)]
+        with self.settings(TEAMS_INGEST_BATCH_SIZE=5):
+            response = self.client.post(stream_url, data="\n".join(lines) + "\n\n", content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'received': 12, 'appended': 12, 'total': 12})
+
+    def test_stream_executions_invalid_line(self):
+        """
+        Test that a malformed line rejects the whole stream.
+        """
+        self.test_run_data['executions'] = []
+        response = self.client.post(reverse('teams_core:testrun-list'), self.test_run_data, format='json')
+        stream_url = reverse('teams_core:testrun-stream-executions', args=[response.data['id']])
+
+        body = '{"testcase": "TC001", "result": "PASS"}\n{"testcase": "TC002", \n'
+        response = self.client.post(stream_url, data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('line 2', str(response.data['detail']))
+        self.assertEqual(TestExecution.objects.count(), 0)
+
+        # Invalid records are reported by their line in the body, blank lines included
+        body = '{"testcase": "TC001", "result": "PASS"}\n\n{"testcase": "TC002", "result": "PASS"}\n\n{"testcase": "TC404", "result": "PASS"}\n'
+        with self.settings(TEAMS_INGEST_BATCH_SIZE=2):
+            response = self.client.post(stream_url, data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(response.data['executions']), [5])
+        self.assertEqual(TestExecution.objects.count(), 0)
+
+    def test_create_test_run_async(self):
+        """
+        Test that an asynchronous TestRun is only queued by the API and ingested by the worker.
+        """
+        response = self.client.post(reverse('teams_core:testrun-list') + '?async=true', self.test_run_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'PENDING')
+        self.assertEqual(TestRun.objects.count(), 0)
+        job_url = response['Location']
+
+        call_command('process_ingestion_jobs', '--once')
+
+        response = self.client.get(job_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'DONE')
+        test_run = TestRun.objects.get()
+        self.assertEqual(response.data['test_run'], test_run.id)
+        self.assertEqual(test_run.created_by, self.test_user)
+        self.assertEqual(test_run.testexecution_set.count(), 2)
+
+    def test_create_test_run_async_invalid(self):
+        """
+        Test that validation errors of a queued TestRun are reported on the job.
+        """
+        self.test_run_data['executions'][0]['testcase'] = 'TC404'
+        response = self.client.post(reverse('teams_core:testrun-list') + '?async=true', self.test_run_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        call_command('process_ingestion_jobs', '--once')
+
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.data['status'], 'FAILED')
+        self.assertIn('executions', response.data['errors'])
+        self.assertEqual(TestRun.objects.count(), 0)
+
+    def test_create_test_run_async_worker_died(self):
+        """
+        Test that a job left RUNNING by a dead worker is claimed again once its lease expires,
+        and given up on after repeated attempts.
+        """
+        response = self.client.post(reverse('teams_core:testrun-list') + '?async=true', self.test_run_data, format='json')
+        job = IngestionJob.objects.get()
+        job.status = 'RUNNING'
+        job.attempts = 1
+        job.lease_expires_on = timezone.now() + timedelta(minutes=5)
+        job.save()
+
+        # The lease of the other worker still holds
+        self.assertEqual(process_pending_jobs(), 0)
+
+        job.lease_expires_on = timezone.now() - timedelta(seconds=1)
+        job.save()
+        self.assertEqual(process_pending_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'DONE')
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(TestRun.objects.count(), 1)
+
+        response = self.client.post(reverse('teams_core:testrun-list') + '?async=true', self.test_run_data, format='json')
+        IngestionJob.objects.filter(pk=response.data['id']).update(
+            status='RUNNING', attempts=3, lease_expires_on=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(process_pending_jobs(), 0)
+        job = IngestionJob.objects.get(pk=response.data['id'])
+        self.assertEqual(job.status, 'FAILED')
+        self.assertEqual(TestRun.objects.count(), 1)
+
+    def test_create_test_run_async_lease_lost(self):
+        """
+        Test that a worker whose lease was taken over does not record its run.
+        """
+        self.client.post(reverse('teams_core:testrun-list') + '?async=true', self.test_run_data, format='json')
+        job = claim_next_job()
+        IngestionJob.objects.filter(pk=job.pk).update(attempts=F('attempts') + 1,
+                                                      lease_expires_on=timezone.now() + timedelta(hours=1))
+        with self.assertRaises(LeaseExpired):
+            process_job(job)
+        self.assertEqual(TestRun.objects.count(), 0)
+        self.assertFalse(renew_lease(job))
+
+    def test_create_test_run_async_lease_renewed(self):
+        """
+        Test that a renewed lease keeps the job from other workers and still lets its worker finish it.
+        """
+        self.client.post(reverse('teams_core:testrun-list') + '?async=true', self.test_run_data, format='json')
+        with self.settings(TEAMS_INGEST_LEASE_TIMEOUT=60):
+            job = claim_next_job()
+            IngestionJob.objects.filter(pk=job.pk).update(lease_expires_on=timezone.now() - timedelta(seconds=1))
+            self.assertTrue(renew_lease(job))
+            self.assertIsNone(claim_next_job())
+
+        process_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('DONE', 1))
+        self.assertEqual(TestRun.objects.count(), 1)
+
+    def test_create_test_run_idempotency_key(self):
+        """
+        Test that retrying a TestRun creation with the same Idempotency-Key replays the first response.
+        """
+        self.test_run_data['date'] = timezone.now().isoformat()
+        url = reverse('teams_core:testrun-list')
+        response = self.client.post(url, self.test_run_data, format='json', HTTP_IDEMPOTENCY_KEY='run-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        retry = self.client.post(url, self.test_run_data, format='json', HTTP_IDEMPOTENCY_KEY='run-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json()['id'], response.data['id'])
+        self.assertEqual(TestRun.objects.count(), 1)
+
+        # The same key cannot be reused for a different request
+        detail_url = reverse('teams_core:testrun-detail', args=[response.data['id']])
+        response = self.client.put(detail_url, self.test_run_data, format='json', HTTP_IDEMPOTENCY_KEY='run-1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        # Without a key, the duplicate is rejected as before
+        response = self.client.post(url, self.test_run_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_test_run_idempotency_key_conflicts(self):
+        """
+        Test that a key still in flight answers 409, that a key reused with a different body
+        answers 422, and that expired keys are purged by the command.
+        """
+        self.test_run_data['date'] = timezone.now().isoformat()
+        url = reverse('teams_core:testrun-list')
+        IdempotencyKey.objects.create(user=self.test_user, key='run-2', method='POST', path=url)
+        response = self.client.post(url, self.test_run_data, format='json', HTTP_IDEMPOTENCY_KEY='run-2')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(TestRun.objects.count(), 0)
+
+        # A long running request keeps its reservation
+        IdempotencyKey.objects.filter(key='run-2').update(created_on=timezone.now() - timedelta(minutes=30))
+        response = self.client.post(url, self.test_run_data, format='json', HTTP_IDEMPOTENCY_KEY='run-2')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        # A reservation left behind by a request that died is taken over
+        with self.settings(TEAMS_IDEMPOTENCY_IN_FLIGHT_TIMEOUT=20 * 60):
+            response = self.client.post(url, self.test_run_data, format='json', HTTP_IDEMPOTENCY_KEY='run-2')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.test_run_data['notes'] = 'Another run'
+        response = self.client.post(url, self.test_run_data, format='json', HTTP_IDEMPOTENCY_KEY='run-2')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(TestRun.objects.count(), 1)
+
+        # A request rejected with an exception releases its key
+        response = self.client.post(url, {'executions': 'invalid'}, format='json', HTTP_IDEMPOTENCY_KEY='run-3')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.filter(key='run-3').exists())
+
+        IdempotencyKey.objects.filter(key='run-2').update(created_on=timezone.now() - timedelta(days=2))
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Deleted 1 expired', out.getvalue())
+        self.assertFalse(IdempotencyKey.objects.filter(key='run-2').exists())
+
+    def test_create_test_run_msgpack_gzip(self):
+        """
+        Test creating a TestRun from a gzip compressed MessagePack body and reading it back as MessagePack.
+        """
+        body = gzip.compress(msgpack.packb(self.test_run_data))
+        response = self.client.post(reverse('teams_core:testrun-list'), data=body,
+                                    content_type='application/msgpack',
+                                    HTTP_CONTENT_ENCODING='gzip',
+                                    HTTP_ACCEPT='application/msgpack',
+                                    HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        data = msgpack.unpackb(gzip.decompress(response.content))
+        self.assertEqual(data['notes'], 'Automated Test Run')
+        self.assertEqual(len(data['executions']), 2)
+        self.assertEqual(TestExecution.objects.count(), 2)
+
+    def test_create_test_run_gzip_invalid(self):
+        """
+        Test that a corrupt gzip body is rejected with a 400 and one that decompresses beyond
+        the allowed size with a 413.
+        """
+        url = reverse('teams_core:testrun-list')
+        response = self.client.post(url, data=b'not gzip at all', content_type='application/json',
+                                    HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(url, data=gzip.compress(json.dumps(self.test_run_data).encode())[:-12],
+                                    content_type='application/json', HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.test_run_data['notes'] = ' ' * 100000
+        body = gzip.compress(msgpack.packb(self.test_run_data))
+        with self.settings(TEAMS_GZIP_MAX_BODY_SIZE=10000):
+            response = self.client.post(url, data=body, content_type='application/msgpack', HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(TestRun.objects.count(), 0)
+
+    def test_create_test_run_gzip_large(self):
+        """
+        Test that a gzip body decompressing beyond DATA_UPLOAD_MAX_MEMORY_SIZE is accepted,
+        just like the same body sent uncompressed.
+        """
+        self.test_run_data['notes'] = ' ' * (settings.DATA_UPLOAD_MAX_MEMORY_SIZE + 1024 ** 2)
+        body = gzip.compress(json.dumps(self.test_run_data).encode())
+        response = self.client.post(reverse('teams_core:testrun-list'), data=body,
+                                    content_type='application/json', HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(TestRun.objects.get().notes), len(self.test_run_data['notes']))
+
+    def test_create_test_run_registers_unknown_testcases(self):
+        """
+        Test that unknown OIDs are created as placeholder test cases when requested.
+        """
+        self.test_run_data['executions'] += [
+            {"testcase": "TC100", "name": "Brand New Test", "result": "FAIL"},
+            {"testcase": "TC101", "result": "PASS"},
+        ]
+        url = reverse('teams_core:testrun-list')
+        response = self.client.post(url, self.test_run_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(url + '?register_testcases=true', self.test_run_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(TestExecution.objects.count(), 4)
+        new_case = TestCase.objects.get(oid='TC100')
+        self.assertEqual(new_case.name, 'Brand New Test')
+        self.assertEqual(new_case.author, self.test_user)
+        self.assertEqual(TestCase.objects.get(oid='TC101').name, 'TC101')
+        dispatch_pending_events()
+        notification = Notification.objects.get(recipient=self.test_user)
+        self.assertEqual(notification.data, {'count': 2, 'oids': ['TC002', 'TC100'],
+                                             'testcases': [self.test_case_2.pk, new_case.pk]})
+        version = Version.objects.get_for_object(new_case).get()
+        self.assertEqual(version.revision.user, self.test_user)
+
+    def test_create_test_run_placeholder_registered_concurrently(self):
+        """
+        Test that an OID registered by another request between validation and save is used as is.
+        """
+        other_user = User.objects.create_user(username='otheruser', password='password')
+        test_case = TestCase.objects.create(name='Registered Meanwhile', oid='TC101', author=other_user)
+        self.test_run_data['executions'] = [{"testcase": "TC101", "result": "PASS"}]
+        url = reverse('teams_core:testrun-list') + '?register_testcases=true'
+        with mock.patch('teams_core.serializers.get_testcases_by_oid', return_value={}):
+            response = self.client.post(url, self.test_run_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(TestExecution.objects.get().testcase, test_case)
+        test_case.refresh_from_db()
+        self.assertEqual((test_case.name, test_case.author), ('Registered Meanwhile', other_user))
+        self.assertFalse(Version.objects.get_for_object(test_case).exists())
+
+    @override_settings(TEAMS_ADMISSION_USER_RATE=1, TEAMS_ADMISSION_USER_BURST=1)
+    def test_create_test_run_admission_rate(self):
+        """
+        Test that writes beyond the per-user token bucket are rejected with 429 and Retry-After.
+        """
+        url = reverse('teams_core:testrun-list')
+        response = self.client.post(url, self.test_run_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.test_run_data['date'] = '2024-01-01T00:00:00Z'
+        response = self.client.post(url, self.test_run_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(TestRun.objects.count(), 1)
+
+        # Reads are never throttled
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_admission_in_flight_limits(self):
+        """
+        Test that the admission controller bounds concurrent requests per user and globally.
+        """
+        controller = AdmissionController(max_in_flight=2, max_in_flight_per_user=1, retry_after=3)
+        self.assertIsNone(controller.acquire('a'))
+        self.assertEqual(controller.acquire('a'), 3)
+        self.assertIsNone(controller.acquire('b'))
+        self.assertEqual(controller.acquire('c'), 3)
+        controller.release('a')
+        self.assertIsNone(controller.acquire('c'))
+        self.assertEqual(controller.user_in_flight, {'b': 1, 'c': 1})
+
+    def test_admission_user_buckets_evicted(self):
+        """
+        Test that the per-user token buckets of users that were idle long enough to refill are dropped.
+        """
+        with mock.patch('teams_core.admission.time.monotonic', return_value=1000.0) as monotonic:
+            controller = AdmissionController(user_rate=10, user_burst=10)  # Refills within a second
+            for user_key in range(100):
+                self.assertIsNone(controller.acquire(user_key))
+                controller.release(user_key)
+            self.assertEqual(len(controller.user_buckets), 100)
+
+            # User 0 keeps writing, and its bucket has not refilled a second later
+            monotonic.return_value = 1000.9
+            for _ in range(5):
+                self.assertIsNone(controller.acquire(0))
+                controller.release(0)
+
+            monotonic.return_value = 1001.0
+            self.assertIsNone(controller.acquire('new'))
+            self.assertEqual(set(controller.user_buckets), {0, 'new'})
+
+    JUNIT_REPORT = b"""<?xml version="1.0" encoding="utf-8"?>
+<testsuites>
+  <testsuite name="suite" tests="3">
+    <testcase classname="pkg" name="TC001" time="1.5"/>
+    <testcase classname="pkg" name="TC002" time="0.25">
+      <failure message="assert 1 == 2">Traceback</failure>
+    </testcase>
+    <testcase name="TC003"><skipped/></testcase>
+  </testsuite>
+</testsuites>
+"""
+
+    def test_import_junit(self):
+        """
+        Test uploading a JUnit XML report as a new TestRun.
+        """
+        TestCase.objects.create(name='Test Case 1', oid='pkg.TC001', author=self.test_user)
+        TestCase.objects.create(name='Test Case 2', oid='pkg.TC002', author=self.test_user)
+        url = reverse('teams_core:testrun-import-junit')
+
+        response = self.client.post(url, {'file': SimpleUploadedFile('report.xml', self.JUNIT_REPORT)}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(TestRun.objects.exists())
+
+        response = self.client.post(url + '?register_testcases=true',
+                                    {'file': SimpleUploadedFile('report.xml', self.JUNIT_REPORT)}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['imported'], 3)
+        test_run = TestRun.objects.get(pk=response.data['id'])
+        self.assertEqual(test_run.notes, 'Imported from report.xml')
+        failed = test_run.testexecution_set.get(testcase__oid='pkg.TC002')
+        self.assertEqual(failed.result, 'FAIL')
+        self.assertEqual(failed.duration, timedelta(seconds=0.25))
+        self.assertIn('assert 1 == 2', failed.notes)
+        self.assertEqual(test_run.testexecution_set.get(testcase__oid='TC003').result, 'SKIPPED')
+
+        response = self.client.post(url, {'file': SimpleUploadedFile('report.xml', b'<testsuite><testcase')}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_import_junit_idempotency_key_session(self):
+        """
+        Test that a session authenticated upload, whose body the CSRF check reads,
+        is fingerprinted by its data: a retry replays, a different file is rejected.
+        """
+        client = APIClient(enforce_csrf_checks=True)
+        client.force_login(self.test_user)
+        client.cookies[settings.CSRF_COOKIE_NAME] = 'a' * 32
+        url = reverse('teams_core:testrun-import-junit') + '?register_testcases=true'
+
+        def upload(report):
+            return client.post(url, {'file': SimpleUploadedFile('report.xml', report)}, format='multipart',
+                               HTTP_X_CSRFTOKEN='a' * 32, HTTP_IDEMPOTENCY_KEY='junit-1')
+
+        response = upload(self.JUNIT_REPORT)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        retry = upload(self.JUNIT_REPORT)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json()['id'], response.data['id'])
+
+        response = upload(self.JUNIT_REPORT.replace(b'name="TC001"', b'name="TC004"'))
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(TestRun.objects.count(), 1)
+
+    def test_import_junit_command(self):
+        """
+        Test the import_junit management command.
+        """
+        with tempfile.NamedTemporaryFile(suffix='.xml') as report:
+            report.write(self.JUNIT_REPORT)
+            report.flush()
+            call_command('import_junit', report.name, user=self.test_user.username, register_testcases=True, stdout=StringIO())
+        test_run = TestRun.objects.get()
+        self.assertEqual(test_run.testexecution_set.count(), 3)
+        self.assertTrue(TestCase.objects.filter(oid='pkg.TC001').exists())
+
 class Test_TestCases(Test_Serializers):
 
     def setUp(self):
@@ -127,6 +766,20 @@ class Test_TestCases(Test_Serializers):
         self.assertEqual(TestCase.objects.count(), 1)
         self.assertEqual(TestCase.objects.get().name, 'New Test Case')
 
+    @override_settings(TEAMS_ADMISSION_USER_RATE=1, TEAMS_ADMISSION_USER_BURST=1)
+    def test_test_case_writes_admission_controlled(self):
+        """
+        Test that TestCase writes draw from the same per-user token bucket as the other writes.
+        """
+        response = self.client.post(reverse('teams_core:testcase-list'), self.test_case_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.delete(reverse('teams_core:testcase-detail', args=[response.data['id']]))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self.client.post(reverse('teams_core:testcase-bulk-upsert'), [{'oid': 'TC998', 'name': 'Bulk'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(TestCase.objects.count(), 1)
+
     def test_duplicate_test_case_not_allowed(self):
         """
         Test creating a new TestCase.
@@ -166,6 +819,53 @@ class Test_TestCases(Test_Serializers):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(TestCase.objects.count(), 0)
 
+    def test_bulk_upsert_test_cases(self):
+        """
+        Test creating missing test cases and renaming existing ones in one request.
+        """
+        existing = TestCase.objects.create(name='Old Name', oid='TC001', author=self.test_user)
+        payload = {
+            'update_names': True,
+            'testcases': [
+                {'oid': 'TC001', 'name': 'New Name'},
+                {'oid': 'TC002', 'name': 'Second'},
+                {'oid': 'TC003', 'name': 'Third'},
+            ]
+        }
+        response = self.client.post(reverse('teams_core:testcase-bulk-upsert'), payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['existing'], {'TC001': existing.id})
+        self.assertEqual(set(response.data['created']), {'TC002', 'TC003'})
+        self.assertEqual(response.data['renamed'], ['TC001'])
+        self.assertEqual(TestCase.objects.get(oid='TC001').name, 'New Name')
+        versions = Version.objects.get_for_object(existing)
+        self.assertEqual(versions.count(), 1)
+        self.assertEqual(versions[0].field_dict['name'], 'New Name')
+        self.assertEqual(versions[0].revision.user, self.test_user)
+
+        created = TestCase.objects.get(oid='TC002')
+        self.assertEqual(created.author, self.test_user)
+        self.assertTrue(Subscription.objects.filter(
+            user=self.test_user,
+            content_type=ContentType.objects.get_for_model(TestCase),
+            object_id=created.id
+        ).exists())
+
+        # Without update_names, existing names are kept
+        response = self.client.post(reverse('teams_core:testcase-bulk-upsert'),
+                                    [{'oid': 'TC001', 'name': 'Other Name'}], format='json')
+        self.assertEqual(response.data['created'], {})
+        self.assertEqual(TestCase.objects.get(oid='TC001').name, 'New Name')
+
+    def test_bulk_upsert_test_cases_invalid(self):
+        """
+        Test that an entry without a name rejects the whole request.
+        """
+        response = self.client.post(reverse('teams_core:testcase-bulk-upsert'),
+                                    [{'oid': 'TC001', 'name': 'First'}, {'oid': 'TC002'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(TestCase.objects.count(), 0)
+
 class Test_TestSuite(UnitTestCase):
     def setUp(self):
         # Create test cases to add to the suite
@@ -434,6 +1134,52 @@ class Test_Subscriptions(APITestCase):
         ).exists()
         self.assertTrue(subscription_exists, "Maintainer is not subscribed to the test case for failure notifications.")
 
+    def test_maintainer_subscriptions_bulk(self):
+        """
+        Test that maintainer changes update subscriptions with a constant number of queries.
+        """
+        maintainers = [User.objects.create_user(username=f'maintainer{i}', password='password') for i in range(10)]
+        case_type = ContentType.objects.get_for_model(TestCase)
+
+        def subscribed():
+            return set(Subscription.objects.filter(
+                content_type=case_type, object_id=self.test_case.id, active=True
+            ).values_list('user__username', flat=True))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.test_case.maintainers.add(*maintainers)
+        self.assertLessEqual(len(queries.captured_queries), 6)
+        self.assertEqual(subscribed(), {'testuser'} | {m.username for m in maintainers})
+
+        self.test_case.maintainers.remove(*maintainers[:5])
+        self.assertEqual(subscribed(), {'testuser'} | {m.username for m in maintainers[5:]})
+
+        self.test_case.maintainers.clear()
+        self.assertEqual(subscribed(), {'testuser'})
+
+        # From the user side of the relation, and reactivating earlier subscriptions
+        maintainers[0].maintained_cases.add(self.test_case)
+        self.assertEqual(subscribed(), {'testuser', 'maintainer0'})
+
+    def test_save_without_author_change_skips_subscriptions(self):
+        """
+        Test that saving a TestCase whose author did not change does not touch subscriptions.
+        """
+        test_case = TestCase.objects.get(pk=self.test_case.pk)
+        test_case.name = 'Renamed'
+        with CaptureQueriesContext(connection) as queries:
+            test_case.save()
+        self.assertFalse(any('teams_core_subscription' in q['sql'] for q in queries.captured_queries))
+
+        # Changing the author moves the subscription
+        new_author = User.objects.create_user(username='other_author', password='password')
+        test_case.author = new_author
+        test_case.save()
+        active = Subscription.objects.filter(
+            content_type=ContentType.objects.get_for_model(TestCase), object_id=test_case.id, active=True
+        ).values_list('user', flat=True)
+        self.assertEqual(list(active), [new_author.id])
+
     def test_subscribe_author_to_testsuite(self):
         """
         Test that the author is subscribed to failure notifications of all test cases
@@ -465,8 +1211,8 @@ class Test_Subscriptions(APITestCase):
 
     def test_nonauthor_subscribe_testsuite_testcase_added_later(self):
         """
-        Test that users subscribed to a TestSuite are automatically subscribed to
-        any new TestCase added to the suite.
+        Test that users subscribed to a TestSuite are subscribers of any TestCase
+        added to the suite later, without a subscription row per test case.
         """
         # Create a user and a test suite
         user = User.objects.create_user(username="suite_subscriber", password="password")
@@ -477,19 +1223,96 @@ class Test_Subscriptions(APITestCase):
 
         # Create a new test case and add it to the test suite
         test_case = TestCase.objects.create(name="New TestCase", oid="TC123")
-        test_suite.testcase_set.add(test_case)
+        with CaptureQueriesContext(connection) as queries:
+            test_suite.testcase_set.add(test_case)
+        self.assertFalse(any('teams_core_subscription' in q['sql'] for q in queries.captured_queries))
 
-        # Check if the user is subscribed to the new test case
-        case_subscribed = Subscription.objects.filter(
-            user=user,
-            content_type=ContentType.objects.get_for_model(TestCase),
-            object_id=test_case.id,
-            event_type="TEST_EXECUTION_FAIL",
-            active=True
-        ).exists()
+        # The user is resolved as a subscriber of the new test case through the suite
+        self.assertIn(user, get_active_subscribers("TEST_EXECUTION_FAIL", test_case))
+
+    def test_unsubscribe_testsuite_with_expanded_subscriptions(self):
+        """
+        Test that once the per test case rows of the old suite expansion are removed,
+        unsubscribing from the suite unsubscribes from its test cases, while the
+        subscriptions of test case authors stay.
+        """
+        user = User.objects.create_user(username="legacy_subscriber", password="password")
+        test_suite = TestSuite.objects.create(name="Legacy Suite")
+        test_cases = [TestCase.objects.create(name=f"Legacy Case {i}", oid=f"TC9{i:02d}") for i in range(3)]
+        authored_case = TestCase.objects.create(name="Authored Case", oid="TC999", author=user)
+        test_suite.testcase_set.add(*test_cases, authored_case)
+        other_case = TestCase.objects.create(name="Other Case", oid="TC998")
 
-        self.assertTrue(case_subscribed, "The user should be subscribed to the new TestCase.")
+        add_subscription(user, "TEST_EXECUTION_FAIL", test_suite)
+        # Rows the suite subscription used to create for each test case
+        bulk_add_subscriptions(user, "TEST_EXECUTION_FAIL", test_cases)
+        add_subscription(user, "TEST_EXECUTION_FAIL", other_case)
+
+        out = StringIO()
+        call_command('remove_expanded_suite_subscriptions', stdout=out)
+        self.assertIn('Deleted 3 expanded', out.getvalue())
+
+        remove_subscription(user, "TEST_EXECUTION_FAIL", test_suite)
+        for test_case in test_cases:
+            self.assertNotIn(user, get_active_subscribers("TEST_EXECUTION_FAIL", test_case))
+        self.assertIn(user, get_active_subscribers("TEST_EXECUTION_FAIL", authored_case))
+        self.assertIn(user, get_active_subscribers("TEST_EXECUTION_FAIL", other_case))
+        self.assertFalse(Subscription.objects.filter(
+            user=user, content_type=ContentType.objects.get_for_model(TestCase), object_id=test_case.id
+        ).exists())
+
+        # Failures of the test case reach the suite subscriber
+        test_run = TestRun.objects.create(created_by=self.user)
+        TestExecution.objects.create(run=test_run, testcase=test_case, result='FAIL')
+        send_failure_notifications(test_run, test_run.testexecution_set.all())
+        self.assertEqual(user.notifications.count(), 1)
+
+        # Unsubscribing from the suite is a single update
+        remove_subscription(user, "TEST_EXECUTION_FAIL", test_suite)
+        self.assertNotIn(user, get_active_subscribers("TEST_EXECUTION_FAIL", test_case))
+
+    def test_is_subscribed_filter_loads_subscriptions_once(self):
+        """
+        Test that the is_subscribed filter looks the user's subscriptions up once
+        per request, and sees the changes made by add/remove_subscription.
+        """
+        test_cases = [TestCase.objects.create(name=f"Case {i}", oid=f"TC2{i:02d}") for i in range(10)]
+        add_subscription(self.user, 'TEST_EXECUTION_FAIL', test_cases[0])
+        template = Template(
+            "{% load subscription_tags %}"
+            "{% for obj in objects %}{% if user|is_subscribed:obj %}1{% else %}0{% endif %}{% endfor %}"
+        )
+        user = SimpleLazyObject(lambda: User.objects.get(pk=self.user.pk))  # Like request.user
+        str(user)
+        ContentType.objects.get_for_models(TestCase, TestSuite)  # Warm the content type cache
+        with self.assertNumQueries(1):
+            rendered = template.render(Context({'user': user, 'objects': test_cases + [self.test_suite]}))
+        self.assertEqual(rendered, '10000000000')
+
+        remove_subscription(user, 'TEST_EXECUTION_FAIL', test_cases[0])
+        add_subscription(user, 'TEST_EXECUTION_FAIL', self.test_suite)
+        rendered = template.render(Context({'user': user, 'objects': test_cases + [self.test_suite]}))
+        self.assertEqual(rendered, '00000000001')
+
+    def test_is_subscribed_filter_covers_suite_test_cases(self):
+        """
+        Test that the is_subscribed filter shows the test cases of a subscribed
+        suite as subscribed, with one more query.
+        """
+        test_cases = [TestCase.objects.create(name=f"Case {i}", oid=f"TC3{i:02d}") for i in range(3)]
+        self.test_suite.testcase_set.add(*test_cases[:2])
+        add_subscription(self.user, 'TEST_EXECUTION_FAIL', self.test_suite)
+        template = Template(
+            "{% load subscription_tags %}"
+            "{% for obj in objects %}{% if user|is_subscribed:obj %}1{% else %}0{% endif %}{% endfor %}"
+        )
+        user = User.objects.get(pk=self.user.pk)
+        ContentType.objects.get_for_models(TestCase, TestSuite)  # Warm the content type cache
+        with self.assertNumQueries(2):
+            rendered = template.render(Context({'user': user, 'objects': test_cases + [self.test_suite]}))
+        self.assertEqual(rendered, '1101')
 
+@override_settings(TEAMS_NOTIFICATION_SUMMARY_DELAY=0)
 class Test_NotificationSummary(APITestCase):
 
     def setUp(self):
@@ -550,6 +1373,218 @@ class Test_NotificationSummary(APITestCase):
         self.assertIn("Total new failures: 1", email.body)
         self.assertIn("/test-cases/1/", email.body)
 
+    def test_notification_summary_watermark(self):
+        """
+        Test that each summary only covers the notifications that arrived since the previous one.
+        """
+        call_command('send_notification_summary', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        call_command('send_notification_summary', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+
+        other_case = TestCase.objects.create(name='Other Test Case', oid='TC1002', author=self.test_user)
+        other_run = TestRun.objects.create(created_by=self.test_user, notes='Another run')
+        TestExecution.objects.create(run=other_run, testcase=self.test_case, result='FAIL')
+        TestExecution.objects.create(run=other_run, testcase=other_case, result='FAIL')
+        send_failure_notifications(other_run, other_run.testexecution_set.all())
+        call_command('send_notification_summary', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn("Total new failures: 2", mail.outbox[1].body)
+        self.assertIn(f"/test-cases/{other_case.id}/", mail.outbox[1].body)
+
+    def test_notification_summary_coalesced_delta(self):
+        """
+        Test that a coalesced notification updated after a summary only reports its new failures in the next one.
+        """
+        call_command('send_notification_summary', stdout=StringIO())
+        other_case = TestCase.objects.create(name='Other Test Case', oid='TC1002', author=self.test_user)
+        other_run = TestRun.objects.create(created_by=self.test_user, notes='Another run')
+        first = TestExecution.objects.create(run=other_run, testcase=self.test_case, result='FAIL')
+        second = TestExecution.objects.create(run=other_run, testcase=other_case, result='FAIL')
+
+        send_failure_notifications(other_run, [first])
+        call_command('send_notification_summary', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn("Total new failures: 1", mail.outbox[1].body)
+
+        # The first failure is delivered again along with a new one
+        send_failure_notifications(other_run, [first, second])
+        call_command('send_notification_summary', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn("Total new failures: 1", mail.outbox[2].body)
+        self.assertIn(f"/test-cases/{other_case.id}/", mail.outbox[2].body)
+        self.assertNotIn(f"/test-cases/{self.test_case.id}/", mail.outbox[2].body)
+
+    @override_settings(TEAMS_NOTIFICATION_SUMMARY_DELAY=60)
+    def test_notification_summary_delay(self):
+        """
+        Test that notifications younger than the delay are left to the next summary, as they may still be committing.
+        """
+        call_command('send_notification_summary', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+
+        Notification.objects.update(timestamp=timezone.now() - timedelta(minutes=2))
+        call_command('send_notification_summary', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertLessEqual(self.test_user.notification_digest.last_sent_on, timezone.now() - timedelta(seconds=60))
+
+    def test_notification_summary_many_users(self):
+        """
+        Test that summaries for many users are computed with a constant number of queries.
+        """
+        for i in range(10):
+            user = User.objects.create_user(username=f'user{i}', password='password', email=f'user{i}@example.com')
+            Notification.objects.create(
+                recipient=user,
+                actor_content_type=ContentType.objects.get_for_model(self.test_case),
+                actor_object_id=self.test_case.id,
+                verb=f'{self.test_case.oid} failed',
+                timestamp=timezone.now()
+            )
+        with CaptureQueriesContext(connection) as queries:
+            call_command('send_notification_summary', workers=3, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 11)
+        self.assertLessEqual(len(queries.captured_queries), 5)
+        self.assertEqual(NotificationDigest.objects.count(), 11)
+
+class Test_NavbarNotifications(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='navbaruser', password='password')
+        self.test_case = TestCase.objects.create(name='Navbar Test Case', oid='TC2001', author=self.user)
+        self.test_run = TestRun.objects.create(created_by=self.user, notes='Navbar run')
+        TestExecution.objects.create(run=self.test_run, testcase=self.test_case, result='FAIL')
+        self.client.login(username='navbaruser', password='password')
+
+    def render_navbar(self):
+        request = Request()
+        request.user = self.user
+        return render_to_string('notification/navbar_notifications.html', request=request)
+
+    def test_unread_summary_cached(self):
+        """
+        Test that the navbar is served from the cache until the user's notifications change.
+        """
+        send_failure_notifications(self.test_run, self.test_run.testexecution_set.all())
+        with CaptureQueriesContext(connection) as uncached:
+            self.assertIn('Test run', self.render_navbar())
+        with CaptureQueriesContext(connection) as queries:
+            html = self.render_navbar()
+        self.assertEqual(len(queries.captured_queries), 0)
+        self.assertGreater(len(uncached.captured_queries), 0)
+        self.assertIn(self.test_run.get_absolute_url(), html)
+
+        notification = Notification.objects.get()
+        notification.mark_as_read()
+        self.assertEqual(get_unread_notifications_summary(self.user), {'count': 0, 'recent': []})
+
+        notify.send(self.user, recipient=self.user, verb='Hello', target=self.test_run)
+        self.assertEqual(get_unread_notifications_summary(self.user)['count'], 1)
+
+        response = self.client.get(reverse('teams_core:mark_notifications_read'))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(get_unread_notifications_summary(self.user)['count'], 0)
+
+    def test_notification_routes_invalidate_unread_summary(self):
+        """
+        Test that the django-notifications views, which update notifications without signals, drop the cached summary.
+        """
+        notify.send(self.user, recipient=self.user, verb='Hello', target=self.test_run)
+        notification = Notification.objects.get()
+        self.assertEqual(get_unread_notifications_summary(self.user)['count'], 1)
+
+        self.client.get(reverse('teams_core:notifications:mark_all_as_read'))
+        self.assertEqual(get_unread_notifications_summary(self.user)['count'], 0)
+
+        self.client.get(reverse('teams_core:notifications:mark_as_unread', args=[notification.slug]))
+        self.assertEqual(get_unread_notifications_summary(self.user)['count'], 1)
+
+        self.client.get(reverse('teams_core:notifications:mark_as_read', args=[notification.slug]))
+        self.assertEqual(get_unread_notifications_summary(self.user)['count'], 0)
+
+    def test_notification_inbox_keyset_pages(self):
+        """
+        Test that the inbox is paged by cursor, with a constant number of queries per page.
+        """
+        now = timezone.now()
+        for i in range(25):
+            Notification.objects.create(
+                recipient=self.user,
+                actor_content_type=ContentType.objects.get_for_model(self.user),
+                actor_object_id=self.user.id,
+                verb=f'Notification {i}',
+                target=self.test_run,
+                action_object=self.test_case,
+                timestamp=now - timedelta(minutes=i),
+            )
+        url = reverse('teams_core:all_notifications')
+
+        seen = []
+        cursor = ''
+        query_counts = []
+        while True:
+            cache.clear()  # Count the navbar queries on every page
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'page_size': 10, 'unread_after': cursor})
+            query_counts.append(len(queries.captured_queries))
+            seen += [n.verb for n in response.context['unread_notifications']]
+            cursor = response.context['unread_next']
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f'Notification {i}' for i in range(25)])
+        self.assertEqual(len(set(query_counts)), 1, query_counts)
+
+    def test_prune_notifications(self):
+        """
+        Test the notification retention policy and its archive.
+        """
+        now = timezone.now()
+        def create(i, **fields):
+            return Notification.objects.create(
+                recipient=self.user,
+                actor_content_type=ContentType.objects.get_for_model(self.user),
+                actor_object_id=self.user.id,
+                verb=f'Notification {i}',
+                timestamp=now - timedelta(days=i),
+                **fields
+            )
+        for i in range(10):
+            create(i)
+        create(10, deleted=True)
+        create(200, unread=False)
+        create(201)  # Old but unread
+
+        with tempfile.TemporaryDirectory() as archive_dir:
+            archive = os.path.join(archive_dir, 'notifications.jsonl.gz')
+            call_command('prune_notifications', max_age=90, max_per_user=8, batch_size=2,
+                         archive=archive, stdout=StringIO())
+            with gzip.open(archive, 'rt') as archived:
+                archived_verbs = {json.loads(line)['verb'] for line in archived}
+
+        remaining = list(Notification.objects.order_by('timestamp').values_list('verb', flat=True))
+        self.assertEqual(remaining, [f'Notification {i}' for i in range(7, -1, -1)])
+        self.assertEqual(archived_verbs, {'Notification 8', 'Notification 9', 'Notification 10',
+                                          'Notification 200', 'Notification 201'})
+
+    def test_prune_notifications_batch_queries(self):
+        """
+        Test that a batch is deleted with a constant number of queries, however many rows it holds.
+        """
+        for i in range(50):
+            Notification.objects.create(
+                recipient=self.user,
+                actor_content_type=ContentType.objects.get_for_model(self.user),
+                actor_object_id=self.user.id,
+                verb=f'Notification {i}',
+                deleted=True,
+            )
+        get_unread_notifications_summary(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            call_command('prune_notifications', max_age=0, max_per_user=0, batch_size=50, stdout=StringIO())
+        self.assertFalse(Notification.objects.exists())
+        self.assertLessEqual(len(queries.captured_queries), 10)
+        self.assertEqual(get_unread_notifications_summary(self.user)['count'], 0)
+
 class Test_HealthMetrics(UnitTestCase):
     
     def setUp(self):
@@ -558,39 +1593,37 @@ class Test_HealthMetrics(UnitTestCase):
         self.test_case2 = TestCase.objects.create(name="Signup Test")
         self.test_run = TestRun.objects.create()
 
+        self.rerun = TestRun.objects.create(date=timezone.now() + timedelta(hours=1))
+
         TestExecution.objects.create(testcase=self.test_case1, run=self.test_run, result="PASS")
-        TestExecution.objects.create(testcase=self.test_case1, run=self.test_run, result="FAIL")
+        TestExecution.objects.create(testcase=self.test_case1, run=self.rerun, result="FAIL")
         TestExecution.objects.create(testcase=self.test_case2, run=self.test_run, result="SKIPPED")
 
     def test_health_overview(self):
-        # Mark the test run as unpublished
-        self.test_run.published = False
-        self.test_run.save()
+        # Mark the test runs as unpublished
+        TestRun.objects.update(published=False)
 
         # Health overview should return an empty result since the test run is unpublished
         result = get_test_health_overview()
         self.assertEqual(result, {})
         
-        # Mark the test run as published
-        self.test_run.published = True
-        self.test_run.save()
+        # Mark the test runs as published
+        TestRun.objects.update(published=True)
 
         # Now, the results should be calculated correctly
         result = get_test_health_overview()
         self.assertEqual(result, {"PASS": 1, "FAIL": 1, "SKIPPED": 1})
 
     def test_frequent_failures(self):
-        # Mark the test run as unpublished
-        self.test_run.published = False
-        self.test_run.save()
+        # Mark the test runs as unpublished
+        TestRun.objects.update(published=False)
 
         # Frequent failures should return an empty result
         result = get_frequent_failures()
         self.assertEqual(len(result), 0)
 
-        # Mark the test run as published
-        self.test_run.published = True
-        self.test_run.save()
+        # Mark the test runs as published
+        TestRun.objects.update(published=True)
 
         # Now, the frequent failures should return results correctly
         result = get_frequent_failures()
@@ -608,8 +1641,10 @@ class Test_MetricsAPI(APITestCase):
         self.test_case2 = TestCase.objects.create(name="Signup Test")
         self.test_run = TestRun.objects.create()
 
+        self.rerun = TestRun.objects.create(date=timezone.now() + timedelta(hours=1))
+
         TestExecution.objects.create(testcase=self.test_case1, run=self.test_run, result="PASS")
-        TestExecution.objects.create(testcase=self.test_case1, run=self.test_run, result="FAIL")
+        TestExecution.objects.create(testcase=self.test_case1, run=self.rerun, result="FAIL")
         TestExecution.objects.create(testcase=self.test_case2, run=self.test_run, result="SKIPPED")
     
     def test_test_health_overview(self):
@@ -1,18 +1,29 @@
-from django.urls import path, include
+from django.urls import path, include, URLPattern
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
 import notifications.urls
 from . import views
+from .utils import invalidates_unread_notifications
 
 router = DefaultRouter()
 router.register(r'testcases', views.TestCaseViewSet)
 router.register(r'testruns', views.TestRunViewSet)
 router.register(r'testsuites', views.TestSuiteViewSet)
 router.register(r'testexecutions', views.TestExecutionViewSet)
+router.register(r'ingestionjobs', views.IngestionJobViewSet)
 router.register(r'users', views.UserViewSet)
 router.register(r'groups', views.GroupViewSet)
 
+# Views of django-notifications that change notifications with queryset updates,
+# which send no signals, so the cached navbar summary is dropped by a wrapper
+NOTIFICATION_WRITE_VIEWS = {'mark_all_as_read', 'mark_as_read', 'mark_as_unread', 'delete'}
+notification_urls = [
+    URLPattern(pattern.pattern, invalidates_unread_notifications(pattern.callback), pattern.default_args, pattern.name)
+    if pattern.name in NOTIFICATION_WRITE_VIEWS else pattern
+    for pattern in notifications.urls.urlpatterns
+]
+
 app_name = "teams_core"
 
 urlpatterns = [
@@ -36,7 +47,7 @@ urlpatterns = [
     path('api/upload-image/', views.ImageUploadView.as_view(), name='upload-image'),
     path('api/list-images/', views.ImageListView.as_view(), name='list-images'),
     path('test-cases/', include(router.urls)),
-    path('inbox/notifications/', include(notifications.urls, namespace='notifications')),
+    path('inbox/notifications/', include((notification_urls, notifications.urls.app_name), namespace='notifications')),
     path('notifications/', views.all_notifications, name='all_notifications'),
     path('notifications/mark-as-read/<int:notification_id>/', views.mark_notification_as_read, name='mark_notification_as_read'),
     path('notifications/delete/<int:notification_id>/', views.delete_notification, name='delete_notification'),
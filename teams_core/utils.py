@@ -1,11 +1,55 @@
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import Exists, OuterRef, Q
 from teams_core.models import Subscription
 from django.contrib.auth.models import User
 from .models import Subscription, TestCase, TestSuite
 from reversion import create_revision, set_user, set_comment
 
+def get_subscribed_objects(user, event_type):
+    """
+    The (content type id, object id) pairs of the user's active subscriptions to
+    an event, loaded with one query and kept on the user object. The test cases
+    of subscribed suites are included, resolved with one more query. request.user
+    lives for a single request, so the cache does too; add_subscription and
+    remove_subscription drop it.
+    """
+    subscribed = getattr(user, '_subscribed_objects', None)
+    if subscribed is None:
+        subscribed = user._subscribed_objects = {}
+    if event_type not in subscribed:
+        objects = set(Subscription.objects.filter(
+            user=user, event_type=event_type, active=True
+        ).values_list('content_type_id', 'object_id'))
+        suite_type_id = ContentType.objects.get_for_model(TestSuite).id
+        suite_ids = [object_id for content_type_id, object_id in objects if content_type_id == suite_type_id]
+        if suite_ids:
+            case_type_id = ContentType.objects.get_for_model(TestCase).id
+            objects.update(
+                (case_type_id, testcase_id)
+                for testcase_id in TestCase.suites.through.objects.filter(
+                    testsuite_id__in=suite_ids
+                ).values_list('testcase_id', flat=True)
+            )
+        subscribed[event_type] = objects
+    return subscribed[event_type]
+
+def forget_subscribed_objects(user):
+    """Drop the subscriptions cached by get_subscribed_objects."""
+    try:
+        del user._subscribed_objects
+    except AttributeError:
+        pass
+
 def add_subscription(user, event_type, obj):
-    """Add or reactivate a subscription for a user to a specific event and object."""
+    """
+    Add or reactivate a subscription for a user to a specific event and object.
+    A subscription to a TestSuite covers its current and future test cases
+    without a row per test case; see get_active_subscribers.
+    """
     content_type = ContentType.objects.get_for_model(obj)
     subscription, created = Subscription.objects.get_or_create(
         user=user,
@@ -16,17 +60,7 @@ def add_subscription(user, event_type, obj):
     if not created and not subscription.active:
         subscription.active = True
         subscription.save()
-    
-    # If subscribing to a TestSuite, subscribe to all its TestCases
-    if isinstance(obj, TestSuite):
-        case_type = ContentType.objects.get_for_model(TestCase)
-        for test_case in obj.testcase_set.all():
-            Subscription.objects.get_or_create(
-                user=user,
-                content_type=case_type,
-                object_id=test_case.id,
-                event_type=event_type
-            )
+    forget_subscribed_objects(user)
     return subscription
 
 
@@ -41,26 +75,167 @@ def remove_subscription(user, event_type, obj):
         content_type=content_type,
         object_id=obj.id
     ).update(active=False)
+    forget_subscribed_objects(user)
+
+def bulk_add_subscriptions(user, event_type, objects):
+    """
+    Subscribe a user to an event for many objects of one model in a single
+    statement. Existing subscriptions are left untouched.
+    """
+    objects = list(objects)
+    if not objects:
+        return
+    content_type = ContentType.objects.get_for_model(objects[0])
+    Subscription.objects.bulk_create(
+        [Subscription(user=user, event_type=event_type, content_type=content_type, object_id=obj.id) for obj in objects],
+        batch_size=get_ingest_batch_size(),
+        ignore_conflicts=True
+    )
 
-    # If unsubscribing from a TestSuite, remove subscriptions for all its TestCases
-    if isinstance(obj, TestSuite):
-        case_type = ContentType.objects.get_for_model(TestCase)
+def subscribe_users(user_ids, event_type, content_type, object_ids):
+    """
+    Subscribe every user to the event for every object, creating the missing
+    subscriptions in bulk and reactivating inactive ones with a single update.
+    """
+    Subscription.objects.bulk_create(
+        [Subscription(user_id=user_id, event_type=event_type, content_type=content_type, object_id=object_id)
+         for user_id in user_ids for object_id in object_ids],
+        batch_size=get_ingest_batch_size(),
+        ignore_conflicts=True
+    )
+    Subscription.objects.filter(
+        user_id__in=user_ids,
+        event_type=event_type,
+        content_type=content_type,
+        object_id__in=object_ids,
+        active=False
+    ).update(active=True)
+
+def unsubscribe_users(user_ids, event_type, content_type, object_ids):
+    """Deactivate the subscriptions of every user to the event for every object in one update."""
+    Subscription.objects.filter(
+        user_id__in=user_ids,
+        event_type=event_type,
+        content_type=content_type,
+        object_id__in=object_ids
+    ).update(active=False)
+
+def remove_expanded_suite_subscriptions(batch_size=1000):
+    """
+    Delete the per test case subscriptions that subscribing to a TestSuite used
+    to create for each of its test cases: rows of a user for a test case in a
+    suite the user is subscribed to for the same event. Subscriptions of the
+    author and maintainers of the test case are kept. Once the rows are gone,
+    unsubscribing from the suite unsubscribes from its test cases again.
+    Returns the number of deleted rows.
+    """
+    case_type = ContentType.objects.get_for_model(TestCase)
+    expanded = Subscription.objects.filter(content_type=case_type).filter(Exists(
         Subscription.objects.filter(
-            user=user,
-            content_type=case_type,
-            object_id__in=obj.testcase_set.values_list('id', flat=True),
-            event_type=event_type
-        ).delete()
+            user_id=OuterRef('user_id'),
+            event_type=OuterRef('event_type'),
+            content_type=ContentType.objects.get_for_model(TestSuite),
+            object_id__in=TestCase.suites.through.objects.filter(
+                testcase_id=OuterRef(OuterRef('object_id'))
+            ).values('testsuite_id'),
+        )
+    )).exclude(Exists(
+        TestCase.objects.filter(pk=OuterRef('object_id')).filter(
+            Q(author_id=OuterRef('user_id')) | Q(maintainers=OuterRef('user_id'))
+        )
+    ))
+    deleted = 0
+    while True:
+        ids = list(expanded.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Subscription.objects.filter(id__in=ids).delete()[0]
 
 def get_active_subscribers(event_type, obj):
-    """Retrieve all active subscribers to a specific event for an object."""
+    """
+    Retrieve all active subscribers to a specific event for an object. For a
+    TestCase, this includes the subscribers of the suites it belongs to.
+    """
     content_type = ContentType.objects.get_for_model(obj)
+    subscribed = Q(subscriptions__content_type=content_type, subscriptions__object_id=obj.id)
+    if isinstance(obj, TestCase):
+        subscribed |= Q(
+            subscriptions__content_type=ContentType.objects.get_for_model(TestSuite),
+            subscriptions__object_id__in=obj.suites.values('id'),
+        )
     return User.objects.filter(
+        subscribed,
         subscriptions__event_type=event_type,
-        subscriptions__content_type=content_type,
-        subscriptions__object_id=obj.id,
         subscriptions__active=True
-    )
+    ).distinct()
+
+def get_ingest_batch_size():
+    """Number of rows written per statement when bulk-ingesting test executions."""
+    return getattr(settings, 'TEAMS_INGEST_BATCH_SIZE', 1000)
+
+def get_testcases_by_oid(oids):
+    """
+    Resolve a collection of OIDs to their TestCases in as few queries as possible.
+    Returns a dict keyed by OID; unknown OIDs are simply absent.
+    """
+    oids = list(set(oids))
+    batch_size = get_ingest_batch_size()
+    testcases = {}
+    for start in range(0, len(oids), batch_size):
+        queryset = TestCase.objects.filter(oid__in=oids[start:start + batch_size]).select_related('author').defer('content')
+        for test_case in queryset:
+            testcases[test_case.oid] = test_case
+    return testcases
+
+# Unread notifications listed in the navbar dropdown
+NAVBAR_NOTIFICATIONS = 5
+
+def unread_notifications_cache_key(user_id):
+    return f'teams:unread-notifications:{user_id}'
+
+def get_unread_notifications_summary(user):
+    """
+    The unread notification count of a user and their latest unread notifications
+    (id, verb, description and target URL), as shown in the navbar. It is cached
+    until the user's notifications change, or for TEAMS_UNREAD_CACHE_TTL seconds:
+    with a per-process cache, changes made by other processes show once it expires.
+    """
+    key = unread_notifications_cache_key(user.pk)
+    summary = cache.get(key)
+    if summary is None:
+        unread = user.notifications.unread()
+        summary = {
+            'count': unread.count(),
+            'recent': [
+                {
+                    'id': notification.id,
+                    'verb': notification.verb,
+                    'description': notification.description,
+                    'url': notification.target.get_absolute_url() if notification.target else '#',
+                }
+                for notification in unread.prefetch_related('target')[:NAVBAR_NOTIFICATIONS]
+            ],
+        }
+        cache.set(key, summary, getattr(settings, 'TEAMS_UNREAD_CACHE_TTL', 30))
+    return summary
+
+def invalidate_unread_notifications(user_ids):
+    """Drop the cached unread notification summaries of the given users."""
+    cache.delete_many([unread_notifications_cache_key(user_id) for user_id in set(user_ids)])
+
+def invalidates_unread_notifications(view):
+    """
+    Decorate a view that changes the notifications of the requesting user
+    without sending signals, e.g. with a queryset update, so that the cached
+    summary is dropped after it ran.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if request.user.is_authenticated:
+            invalidate_unread_notifications([request.user.pk])
+        return response
+    return wrapper
 
 def increment_version(version_str):
     """
@@ -1,4 +1,5 @@
 import json
+from datetime import datetime
 from markdown2 import markdown
 
 from django.shortcuts import render, get_object_or_404, redirect
@@ -18,7 +19,7 @@ from notifications.models import Notification
 from django.contrib.contenttypes.models import ContentType
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
-from teams_core.utils import add_subscription, remove_subscription
+from teams_core.utils import add_subscription, remove_subscription, invalidate_unread_notifications
 from teams_core.export import generate_docx, generate_pdf
 
 from teams_core.utils import create_new_version
@@ -323,19 +324,58 @@ def test_run_create(request):
 def mark_notifications_read(request):
     """Mark all unread notifications as read."""
     request.user.notifications.unread().mark_all_as_read()
+    invalidate_unread_notifications([request.user.pk])
     if request.headers.get('HX-Request'):
         return HttpResponse('<ul class="list-group mb-4"><li class="list-group-item text-muted">No unread notifications.</li></ul>')
     return redirect('teams_core:all_notifications')
 
+def _keyset_page(queryset, cursor, page_size):
+    """
+    One page of notifications, newest first, starting after `cursor`. The cursor
+    is '<timestamp>,<id>' of the last notification of the previous page, so a
+    page costs the same however far back it is. Returns the page and the cursor
+    of the next one, or None on the last page.
+    """
+    queryset = queryset.order_by('-timestamp', '-id')
+    if cursor:
+        try:
+            timestamp, notification_id = cursor.rsplit(',', 1)
+            timestamp, notification_id = datetime.fromisoformat(timestamp), int(notification_id)
+        except ValueError:
+            pass  # A malformed cursor shows the first page
+        else:
+            queryset = queryset.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=notification_id)
+            )
+    page = list(queryset.prefetch_related('target', 'action_object')[:page_size + 1])
+    if len(page) <= page_size:
+        return page, None
+    page = page[:page_size]
+    return page, f'{page[-1].timestamp.isoformat()},{page[-1].id}'
+
 @login_required
 def all_notifications(request):
-    # Separate notifications into unread and read for clarity
-    unread_notifications = request.user.notifications.unread()
-    read_notifications = request.user.notifications.read()
-    
+    try:
+        page_size = min(max(int(request.GET.get('page_size', 25)), 1), 100)
+    except ValueError:
+        page_size = 25
+
+    # Separate notifications into unread and read for clarity, each paged on its own
+    unread_notifications, unread_next = _keyset_page(
+        request.user.notifications.unread(), request.GET.get('unread_after'), page_size
+    )
+    read_notifications, read_next = _keyset_page(
+        request.user.notifications.read(), request.GET.get('read_after'), page_size
+    )
+
     return render(request, 'notification/all_notifications.html', {
         'unread_notifications': unread_notifications,
         'read_notifications': read_notifications,
+        'unread_next': unread_next,
+        'read_next': read_next,
+        'unread_after': request.GET.get('unread_after', ''),
+        'read_after': request.GET.get('read_after', ''),
+        'page_size': page_size,
     })
 
 @login_required
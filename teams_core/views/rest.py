@@ -7,6 +7,7 @@ from django.core.files.storage import default_storage
 from django.conf import settings
 from django.db import IntegrityError, transaction
 from django.db.models import Q
+from django.urls import reverse
 
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
@@ -15,14 +16,23 @@ from rest_framework import status
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
 from rest_framework import viewsets
 from rest_framework import filters
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 
 from django_filters.rest_framework import DjangoFilterBackend
+from reversion import create_revision, set_comment, set_user
 
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.authentication import SessionAuthentication
 
-from teams_core.models import TestCase, TestRun, TestExecution, TestSuite
-from teams_core.serializers import TestCaseSerializer, TestRunSerializer, TestExecutionSerializer, TestSuiteSerializer, UserSerializer, GroupSerializer
+from teams_core.models import TestCase, TestRun, TestExecution, TestSuite, IngestionJob
+from teams_core.parsers import NDJSONParser
+from teams_core.utils import get_ingest_batch_size, get_testcases_by_oid, bulk_add_subscriptions
+from teams_core.serializers import TestCaseSerializer, TestCaseBulkSerializer, TestRunSerializer, TestExecutionSerializer, TestSuiteSerializer, UserSerializer, GroupSerializer, IngestionJobSerializer
+from teams_core.ingest import enqueue_test_run
+from teams_core.idempotency import idempotent
+from teams_core.admission import admission_controlled
+from teams_core.junit import import_junit_report
 
 from teams_core.metrics import (
     get_test_health_overview,
@@ -115,6 +125,72 @@ class TestCaseViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @admission_controlled
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    @admission_controlled
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
+    @admission_controlled
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    @admission_controlled
+    def bulk_upsert(self, request):
+        """
+        Create the missing test cases of a list of {oid, name, ...} objects in one
+        transaction. Accepts either the list itself or an object with a 'testcases'
+        list; with 'update_names' set, existing test cases are renamed to match,
+        saving each of them so that the renames are recorded as a revision.
+        Returns the ids of the created and existing test cases keyed by OID.
+        """
+        if isinstance(request.data, dict):
+            testcases_data = request.data.get('testcases')
+            update_names = str(request.data.get('update_names', False)).lower() in ('1', 'true', 'yes')
+        else:
+            testcases_data = request.data
+            update_names = False
+        serializer = TestCaseBulkSerializer(data=testcases_data, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        # Later entries for the same OID win
+        entries = {entry['oid']: entry for entry in serializer.validated_data}
+        batch_size = get_ingest_batch_size()
+
+        with transaction.atomic():
+            existing = get_testcases_by_oid(entries.keys())
+            created = TestCase.objects.bulk_create(
+                [TestCase(author=request.user, **entry) for oid, entry in entries.items() if oid not in existing],
+                batch_size=batch_size
+            )
+            # bulk_create skips the post_save signal, so subscribe the author here
+            bulk_add_subscriptions(request.user, 'TEST_EXECUTION_FAIL', created)
+
+            renamed = []
+            renames = {
+                test_case.pk: entries[oid]['name']
+                for oid, test_case in existing.items()
+                if update_names and test_case.name != entries[oid]['name']
+            }
+            if renames:
+                # Renames are rare; reload them in full, as the revision stores every field
+                with create_revision():
+                    for test_case in TestCase.objects.filter(pk__in=renames.keys()):
+                        test_case.name = renames[test_case.pk]
+                        test_case.save(update_fields=['name', 'last_modified'])
+                        renamed.append(test_case)
+                    set_user(request.user)
+                    set_comment("Renamed by a bulk test case upsert")
+
+        return Response({
+            'created': {test_case.oid: test_case.id for test_case in created},
+            'existing': {oid: test_case.id for oid, test_case in existing.items()},
+            'renamed': [test_case.oid for test_case in renamed],
+        }, status=status.HTTP_200_OK)
+
 
 class TestSuiteViewSet(viewsets.ModelViewSet):
     queryset = TestSuite.objects.all()
@@ -144,6 +220,41 @@ class TestRunViewSet(viewsets.ModelViewSet):
     #authentication_classes = [CsrfExemptSessionAuthentication]  # Apply custom authentication class
     authentication_classes = [JWTAuthentication, SessionAuthentication]
 
+    @idempotent
+    @admission_controlled
+    def create(self, request, *args, **kwargs):
+        """
+        With ?async=true the payload is only queued for the process_ingestion_jobs
+        worker, and the response is a 202 pointing at the job to poll.
+        """
+        if not self._query_flag('async'):
+            return super().create(request, *args, **kwargs)
+
+        if not isinstance(request.data, dict):
+            raise ValidationError({'non_field_errors': ['Expected a test run object.']})
+        job = enqueue_test_run(request.user, request.data, register_testcases=self._query_flag('register_testcases'))
+        location = reverse('teams_core:ingestionjob-detail', args=[job.id])
+        return Response(IngestionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': location})
+
+    @idempotent
+    @admission_controlled
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
+    def _query_flag(self, name):
+        return self.request.query_params.get(name, '').lower() in ('1', 'true', 'yes')
+
+    def get_serializer_context(self):
+        """
+        With ?register_testcases=true, executions referring to unknown OIDs create
+        placeholder test cases (named after the execution's 'name', if given)
+        instead of being rejected.
+        """
+        context = super().get_serializer_context()
+        context['register_testcases'] = self._query_flag('register_testcases')
+        return context
+
     def perform_create(self, serializer):
         # Ensure atomic operation
         with transaction.atomic():
@@ -157,21 +268,107 @@ class TestRunViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         # Ensure atomic operation
         with transaction.atomic():
-            executions_data = self.request.data.get('executions', [])
-            
-            # Save the updated TestRun and TestExecutions
-            test_run = serializer.save()
-            for execution_data in executions_data:
-                TestExecution.objects.update_or_create(
-                    run=test_run,
-                    testcase_id=execution_data['testcase'],
-                    defaults={
-                        'result': execution_data['result'],
-                        'notes': execution_data.get('notes', ''),
-                        'duration': execution_data.get('duration', None)
-                    }
-                )
-        
+            # Save the updated TestRun and upsert its TestExecutions
+            serializer.save()
+
+    @action(detail=True, methods=['post'], url_path='executions/append')
+    @idempotent
+    @admission_controlled
+    def append_executions(self, request, pk=None):
+        """
+        Add a batch of executions to an existing TestRun. Accepts either a list of
+        executions or an object with an 'executions' list, and returns only counts.
+        """
+        test_run = self.get_object()
+        executions_data = request.data.get('executions') if isinstance(request.data, dict) else request.data
+        serializer = TestExecutionSerializer(data=executions_data, many=True, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            run_serializer = self.get_serializer(test_run)
+            executions = run_serializer.append_executions(serializer.validated_data)
+
+        return Response({
+            'received': len(serializer.validated_data),
+            'appended': len(executions),
+            'total': test_run.testexecution_set.count(),
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'], url_path='executions/stream', parser_classes=[NDJSONParser])
+    @idempotent
+    @admission_controlled
+    def stream_executions(self, request, pk=None):
+        """
+        Add executions to an existing TestRun from a newline-delimited JSON body
+        (one execution object per line). Lines are read incrementally and written
+        in batches, so memory use does not depend on the size of the run.
+        """
+        test_run = self.get_object()
+        run_serializer = self.get_serializer(test_run)
+        batch_size = get_ingest_batch_size()
+        received = appended = 0
+
+        def flush(batch, line_numbers):
+            serializer = TestExecutionSerializer(data=batch, many=True, context=run_serializer.context)
+            if not serializer.is_valid():
+                # Keyed by the line of the body, blank lines included
+                errors = {line_numbers[index]: error for index, error in enumerate(serializer.errors) if error}
+                raise ValidationError({'executions': errors} if errors else serializer.errors)
+            return len(run_serializer.append_executions(serializer.validated_data))
+
+        with transaction.atomic():
+            lines = request.data
+            batch, line_numbers = [], []
+            for execution_data in lines:
+                batch.append(execution_data)
+                line_numbers.append(lines.line_number)
+                received += 1
+                if len(batch) >= batch_size:
+                    appended += flush(batch, line_numbers)
+                    batch, line_numbers = [], []
+            if batch:
+                appended += flush(batch, line_numbers)
+
+        return Response({
+            'received': received,
+            'appended': appended,
+            'total': test_run.testexecution_set.count(),
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='import/junit', parser_classes=[MultiPartParser])
+    @idempotent
+    @admission_controlled
+    def import_junit(self, request):
+        """
+        Create a TestRun from an uploaded JUnit XML report (multipart field 'file').
+        The report is parsed incrementally and written in batches.
+        """
+        report = request.FILES.get('file')
+        if not report:
+            return Response({"error": "No JUnit XML file provided"}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            test_run = TestRun.objects.create(
+                created_by=request.user,
+                notes=request.data.get('notes') or f'Imported from {report.name}',
+                published=str(request.data.get('published', True)).lower() not in ('0', 'false', 'no'),
+            )
+            imported = import_junit_report(report, test_run, register_testcases=self._query_flag('register_testcases'))
+
+        return Response({'id': test_run.id, 'imported': imported}, status=status.HTTP_201_CREATED)
+
+
+class IngestionJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint to poll the status of queued test run ingestion jobs
+    """
+    queryset = IngestionJob.objects.all().order_by('-created_on')
+    serializer_class = IngestionJobSerializer
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication, SessionAuthentication]
+
+    def get_queryset(self):
+        return self.queryset.filter(created_by=self.request.user)
 
 class TestExecutionViewSet(viewsets.ModelViewSet):
     queryset = TestExecution.objects.all()
@@ -180,6 +377,16 @@ class TestExecutionViewSet(viewsets.ModelViewSet):
     #authentication_classes = [CsrfExemptSessionAuthentication]  # Apply custom authentication class
     authentication_classes = [JWTAuthentication, SessionAuthentication]
 
+    @idempotent
+    @admission_controlled
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    @idempotent
+    @admission_controlled
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
 class TestHealthOverviewView(APIView):
     permission_classes = [IsAuthenticatedOrReadOnly]
 